@@ -164,6 +164,14 @@ def init_system():
         storage.set("settings.json", key, value)
         logger.info(f"Добавлена настройка: {key} = {value}")
     
+    # Словарные документы переносим в dbm, если он выбран в DATABASE_URL
+    if os.getenv("DATABASE_URL", "").startswith("dbm://"):
+        logger.info("Перенос пользователей в dbm хранилище...")
+        from src.storage import storage as backend
+        imported = backend.import_json_dir(storage.data_dir)
+        backend.close()
+        logger.info(f"Перенесено записей в dbm: {imported}")
+    
     logger.info("Инициализация системы завершена успешно!")
     
     # Покажем статистику
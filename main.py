@@ -1,5 +1,6 @@
 import logging
 from src.bot import YaEduMerchBot
+from src.bootstrap import bootstrap
 from config import settings
 
 # Настройка логирования
@@ -39,6 +40,9 @@ def main():
             print("\n" + "="*50)
             return
         
+        # Инициализируем хранилище и главного админа
+        bootstrap()
+        
         # Создаем и запускаем бота
         logger.info(f"Запуск бота с токеном: {settings.BOT_TOKEN[:10]}...")
         bot = YaEduMerchBot(settings.BOT_TOKEN)
@@ -6,7 +6,7 @@ from .storage import storage
 
 # Настройка отдельного логгера для аудита
 audit_logger = logging.getLogger('audit')
-audit_handler = logging.FileHandler('audit.log', encoding='utf-8')
+audit_handler = logging.FileHandler('audit.log', encoding='utf-8', delay=True)
 audit_formatter = logging.Formatter('%(asctime)s - %(message)s')
 audit_handler.setFormatter(audit_formatter)
 audit_logger.addHandler(audit_handler)
@@ -99,7 +99,7 @@ class AuditLogger:
     def get_recent_actions(limit: int = 50) -> list:
         """Получает последние действия из аудита"""
         try:
-            all_records = storage.get_all("audit_log.json")
+            all_records = storage.view("audit_log.json")
             # Сортируем по времени (новые первыми)
             sorted_records = sorted(
                 all_records.values(), 
@@ -115,7 +115,7 @@ class AuditLogger:
     def get_user_actions(user_id: int, limit: int = 20) -> list:
         """Получает действия конкретного пользователя"""
         try:
-            all_records = storage.get_all("audit_log.json")
+            all_records = storage.view("audit_log.json")
             user_records = [
                 record for record in all_records.values()
                 if record.get('actor_id') == user_id
@@ -135,7 +135,7 @@ class AuditLogger:
     def get_actions_by_target(target: str, target_id: str, limit: int = 20) -> list:
         """Получает действия над конкретным объектом"""
         try:
-            all_records = storage.get_all("audit_log.json")
+            all_records = storage.view("audit_log.json")
             target_records = [
                 record for record in all_records.values()
                 if record.get('target') == target and record.get('target_id') == target_id
@@ -2,6 +2,7 @@ import logging
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from .storage import storage
+from .lazy import LazyInstance
 from .audit_logger import log_user_added, log_role_changed, log_user_blocked, log_user_unblocked
 from config import settings
 
@@ -139,7 +140,7 @@ class RoleManager:
     
     def get_users_by_role(self, role: str) -> List[Dict[str, Any]]:
         """Получить всех пользователей с определенной ролью"""
-        users = storage.get_all("users.json")
+        users = storage.view("users.json")
         return [
             {"user_id": user_id, **user_data}
             for user_id, user_data in users.items()
@@ -148,7 +149,7 @@ class RoleManager:
     
     def get_all_active_users(self) -> List[Dict[str, Any]]:
         """Получить всех активных пользователей"""
-        users = storage.get_all("users.json")
+        users = storage.view("users.json")
         return [
             {"user_id": user_id, **user_data}
             for user_id, user_data in users.items()
@@ -214,16 +215,16 @@ class RoleManager:
         assigned_chats = coordinator_data.get("assigned_chats", [])
         if chat_id not in assigned_chats:
             assigned_chats.append(chat_id)
-            coordinator_data["assigned_chats"] = assigned_chats
-            storage.set("users.json", str(coordinator_id), coordinator_data)
         
-        # Обновляем данные чата
-        chat_data = storage.get_chat(chat_id)
-        if chat_data:
-            chat_data["coordinator_id"] = str(coordinator_id)
-            chat_data["assigned_by"] = str(assigned_by)
-            chat_data["assigned_at"] = datetime.now().isoformat()
-            storage.update_chat(chat_id, chat_data)
+        # Координатора и чат обновляем одной пакетной записью
+        storage.update_many({
+            "users.json": {str(coordinator_id): {"assigned_chats": assigned_chats}},
+            "chats.json": {str(chat_id): {
+                "coordinator_id": str(coordinator_id),
+                "assigned_by": str(assigned_by),
+                "assigned_at": datetime.now().isoformat()
+            }}
+        })
         
         from .audit_logger import log_chat_coordinator_assigned
         log_chat_coordinator_assigned(assigned_by, chat_id, coordinator_id)
@@ -243,7 +244,7 @@ class RoleManager:
         if not self.has_permission(searcher_id, "coordinator"):
             return []
         
-        users = storage.get_all("users.json")
+        users = storage.view("users.json")
         results = []
         
         query_lower = query.lower()
@@ -269,7 +270,7 @@ class RoleManager:
     
     def get_user_stats(self) -> Dict[str, Any]:
         """Получить статистику пользователей"""
-        users = storage.get_all("users.json")
+        users = storage.view("users.json")
         
         stats = {
             "total_users": len(users),
@@ -293,4 +294,4 @@ class RoleManager:
 
 
 # Глобальный экземпляр менеджера ролей
-role_manager = RoleManager()
+role_manager = LazyInstance(RoleManager, "role_manager")
@@ -0,0 +1,366 @@
+import os
+import sys
+import gzip
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы чанков: режем по строкам, где crc32 строки дает нулевые младшие биты
+# (в среднем раз в ~64 КБ), поэтому вставка в середину файла меняет только
+# соседние чанки. Файлы без переводов строк (compact, msgpack) режутся по CHUNK_MAX.
+CHUNK_MIN = 16 * 1024
+CHUNK_MAX = 1024 * 1024
+CHUNK_MASK = 0x3F
+
+# Служебные файлы, которые не попадают в резервную копию
+SKIP_SUFFIXES = (".tmp", ".lock", "-wal", "-shm", "-journal")
+# Папка копий по умолчанию - внутри папки данных (тот же docker volume)
+DEFAULT_BACKUP_SUBDIR = "backups"
+
+
+def default_backup_dir(data_dir: str) -> str:
+    """BACKUP_DIR или <data_dir>/backups"""
+    return os.getenv("BACKUP_DIR") or os.path.join(data_dir, DEFAULT_BACKUP_SUBDIR)
+
+
+def split_chunks(data: bytes) -> Iterator[bytes]:
+    """Разбить содержимое файла на чанки с границами по содержимому"""
+    start = 0
+    position = 0
+    length = len(data)
+    while position < length:
+        end = data.find(b"\n", position)
+        end = length if end == -1 else end + 1
+        size = end - start
+        if size >= CHUNK_MAX:
+            # Длинная строка без переводов: режем по фиксированному размеру
+            while end - start >= CHUNK_MAX:
+                yield data[start:start + CHUNK_MAX]
+                start += CHUNK_MAX
+        elif size >= CHUNK_MIN and zlib.crc32(data[position:end]) & CHUNK_MASK == 0:
+            yield data[start:end]
+            start = end
+        position = end
+    if start < length:
+        yield data[start:]
+
+
+class BackupStore:
+    """
+    Инкрементальные резервные копии папки данных
+    
+    Файлы режутся на чанки, чанк хранится один раз под своим sha256
+    (chunks/<2 символа>/<sha256>.gz, gzip). Каждый запуск пишет манифест
+    manifests/<время>.json со списком чанков каждого файла. Файл с теми же
+    размером и mtime берется из прошлого манифеста без чтения, у измененного
+    файла записываются только новые чанки - для дописываемого журнала заказов
+    это последний чанк. Папка копий может лежать внутри папки данных
+    (по умолчанию <data_dir>/backups) - в копии она не попадает.
+    """
+    
+    def __init__(self, data_dir: str = "data", backup_dir: Optional[str] = None, keep: int = 48):
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir or os.path.join(data_dir, DEFAULT_BACKUP_SUBDIR)
+        self.keep = keep
+        self.chunks_dir = os.path.join(self.backup_dir, "chunks")
+        self.manifests_dir = os.path.join(self.backup_dir, "manifests")
+        self._lock = threading.Lock()
+    
+    # === ЧАНКИ ===
+    
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.chunks_dir, digest[:2], f"{digest}.gz")
+    
+    def _store_chunk(self, chunk: bytes) -> Tuple[str, bool]:
+        """Сохранить чанк, если его еще нет; возвращает sha256 и признак нового чанка"""
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(chunk)
+        os.replace(tmp_path, path)
+        return digest, True
+    
+    def _read_chunk(self, digest: str) -> bytes:
+        with gzip.open(self._chunk_path(digest), "rb") as f:
+            chunk = f.read()
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Поврежден чанк {digest}")
+        return chunk
+    
+    # === МАНИФЕСТЫ ===
+    
+    def list_backups(self) -> List[str]:
+        """Имена манифестов по возрастанию времени"""
+        if not os.path.isdir(self.manifests_dir):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.manifests_dir)
+                      if name.endswith(".json"))
+    
+    def _load_manifest(self, name: str) -> Dict[str, Any]:
+        with open(os.path.join(self.manifests_dir, f"{name}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def _data_files(self) -> List[str]:
+        """Файлы данных относительно data_dir (без папки копий)"""
+        files = []
+        backup_dir = os.path.realpath(self.backup_dir)
+        for directory, subdirs, names in os.walk(self.data_dir):
+            subdirs[:] = [name for name in subdirs
+                          if os.path.realpath(os.path.join(directory, name)) != backup_dir]
+            for name in sorted(names):
+                if name.endswith(SKIP_SUFFIXES) or name.startswith("."):
+                    continue
+                files.append(os.path.relpath(os.path.join(directory, name), self.data_dir))
+        return sorted(files)
+    
+    def _read_data_file(self, relpath: str) -> bytes:
+        """Содержимое файла; SQLite база копируется через online backup API"""
+        path = os.path.join(self.data_dir, relpath)
+        if relpath.endswith(".db"):
+            fd, tmp_path = tempfile.mkstemp(suffix=".db")
+            os.close(fd)
+            try:
+                source = sqlite3.connect(path)
+                target = sqlite3.connect(tmp_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+                with open(tmp_path, "rb") as f:
+                    return f.read()
+            finally:
+                os.remove(tmp_path)
+        with open(path, "rb") as f:
+            return f.read()
+    
+    # === РЕЗЕРВНАЯ КОПИЯ ===
+    
+    def backup(self) -> Dict[str, Any]:
+        """
+        Сделать резервную копию, возвращает манифест
+        
+        Файлы заменяются атомарно (os.replace), поэтому каждый читается
+        в целостном состоянии; блокировки хранилища не берутся.
+        """
+        with self._lock:
+            backups = self.list_backups()
+            previous = self._load_manifest(backups[-1])["files"] if backups else {}
+            created_at = datetime.now()
+            files: Dict[str, Any] = {}
+            new_bytes = 0
+            
+            for relpath in self._data_files():
+                path = os.path.join(self.data_dir, relpath)
+                try:
+                    stat = os.stat(path)
+                    entry = previous.get(relpath)
+                    if (entry is not None and not relpath.endswith(".db") and
+                            entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns):
+                        files[relpath] = entry
+                        continue
+                    data = self._read_data_file(relpath)
+                except OSError as e:
+                    # Файл удалили или заменили во время обхода
+                    logger.warning(f"Файл {relpath} пропущен в резервной копии: {e}")
+                    continue
+                
+                chunks = []
+                for chunk in split_chunks(data):
+                    digest, is_new = self._store_chunk(chunk)
+                    if is_new:
+                        new_bytes += len(chunk)
+                    chunks.append(digest)
+                files[relpath] = {"size": len(data), "mtime_ns": stat.st_mtime_ns, "chunks": chunks}
+            
+            manifest = {"created_at": created_at.isoformat(), "files": files}
+            name = created_at.strftime("%Y%m%dT%H%M%S%f")
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            tmp_path = os.path.join(self.manifests_dir, f"{name}.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.manifests_dir, f"{name}.json"))
+            
+            logger.info(f"Резервная копия {name}: {len(files)} файлов, новых данных {new_bytes} байт")
+            self._prune()
+            return manifest
+    
+    def _prune(self):
+        """Оставить keep последних копий и удалить чанки, на которые никто не ссылается"""
+        backups = self.list_backups()
+        if self.keep <= 0 or len(backups) <= self.keep:
+            return
+        for name in backups[:-self.keep]:
+            os.remove(os.path.join(self.manifests_dir, f"{name}.json"))
+        
+        used = set()
+        for name in backups[-self.keep:]:
+            for entry in self._load_manifest(name)["files"].values():
+                used.update(entry["chunks"])
+        for directory, _, names in os.walk(self.chunks_dir):
+            for name in names:
+                if name.endswith(".gz") and name[:-len(".gz")] not in used:
+                    os.remove(os.path.join(directory, name))
+    
+    # === ВОССТАНОВЛЕНИЕ ===
+    
+    def find_backup(self, at: Optional[datetime] = None) -> Optional[str]:
+        """Последняя копия, сделанная не позже at (или самая последняя)"""
+        candidates = [name for name in self.list_backups()
+                      if at is None or datetime.strptime(name, "%Y%m%dT%H%M%S%f") <= at]
+        return candidates[-1] if candidates else None
+    
+    def file_versions(self, relpath: str) -> Iterator[Tuple[str, bytes]]:
+        """Сохраненные версии файла от новых к старым: (имя копии, содержимое)"""
+        seen = set()
+        for name in reversed(self.list_backups()):
+            entry = self._load_manifest(name)["files"].get(relpath)
+            if entry is None or tuple(entry["chunks"]) in seen:
+                continue
+            seen.add(tuple(entry["chunks"]))
+            try:
+                yield name, b"".join(self._read_chunk(digest) for digest in entry["chunks"])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Копия {relpath} из {name} не читается: {e}")
+    
+    def restore(self, at: Optional[datetime] = None, target_dir: Optional[str] = None) -> str:
+        """
+        Восстановить папку данных на момент at
+        
+        Файлы данных, которых не было в копии (например, более новые журналы
+        или сегменты заказов), удаляются, иначе при запуске они применились бы
+        поверх восстановленного состояния. Рядом с восстановленной базой SQLite
+        удаляются -wal/-shm/-journal текущей базы, чтобы SQLite не применил
+        их к копии. Бот на время восстановления должен быть остановлен.
+        """
+        from .storage import fsync_dir
+        
+        name = self.find_backup(at)
+        if name is None:
+            raise ValueError(f"Нет резервной копии на момент {at}")
+        target_dir = target_dir or self.data_dir
+        files = self._load_manifest(name)["files"]
+        
+        for relpath, entry in files.items():
+            data = b"".join(self._read_chunk(digest) for digest in entry["chunks"])
+            if len(data) != entry["size"]:
+                raise ValueError(f"Размер {relpath} не совпадает с манифестом")
+            path = os.path.join(target_dir, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            if relpath.endswith(".db"):
+                for suffix in ("-wal", "-shm", "-journal"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+            fsync_dir(os.path.dirname(path))
+        
+        current = BackupStore(target_dir, self.backup_dir)._data_files() if os.path.isdir(target_dir) else []
+        for relpath in current:
+            # Базу SQLite, которой нет в копии, не удаляем
+            if relpath not in files and not relpath.endswith(".db"):
+                os.remove(os.path.join(target_dir, relpath))
+                logger.info(f"Удален файл, которого нет в копии {name}: {relpath}")
+        
+        logger.info(f"Восстановлена резервная копия {name} в {target_dir}: {len(files)} файлов")
+        return name
+
+
+class BackupScheduler:
+    """Резервное копирование по расписанию в фоновом потоке (BACKUP_INTERVAL секунд)"""
+    
+    def __init__(self, store: BackupStore, interval: float, before_backup=None):
+        self.store = store
+        self.interval = interval
+        self.before_backup = before_backup
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="storage-backup", daemon=True)
+        self._thread.start()
+    
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.before_backup is not None:
+                    self.before_backup()
+                self.store.backup()
+            except Exception as e:
+                logger.error(f"Ошибка резервного копирования: {e}")
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def start_backup_scheduler(storage) -> Optional[BackupScheduler]:
+    """
+    Запустить резервное копирование, если задан BACKUP_INTERVAL (секунды)
+    
+    Копии пишутся в BACKUP_DIR (<data_dir>/backups), хранится BACKUP_KEEP (48) последних.
+    Перед копией сбрасываются отложенные записи хранилища.
+    """
+    interval = float(os.getenv("BACKUP_INTERVAL", "0"))
+    data_dir = getattr(storage, "data_dir", None)
+    if interval <= 0 or not data_dir or not os.path.isdir(data_dir):
+        return None
+    store = BackupStore(data_dir, default_backup_dir(data_dir), int(os.getenv("BACKUP_KEEP", "48")))
+    scheduler = BackupScheduler(store, interval, before_backup=storage.flush)
+    scheduler.start()
+    logger.info(f"Резервное копирование {data_dir} в {store.backup_dir} раз в {interval:.0f} с")
+    return scheduler
+
+
+def main(argv=None) -> int:
+    """python -m src.backup backup | list | restore --at 2026-10-17T12:00"""
+    parser = argparse.ArgumentParser(description="Резервные копии папки данных")
+    parser.add_argument("command", choices=("backup", "list", "restore"))
+    parser.add_argument("--data", default="data", help="папка данных")
+    parser.add_argument("--dest", help="папка резервных копий (по умолчанию BACKUP_DIR или <data>/backups)")
+    parser.add_argument("--at", type=datetime.fromisoformat, help="момент восстановления (ISO)")
+    parser.add_argument("--target", help="куда восстановить (по умолчанию папка данных)")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO)
+    store = BackupStore(args.data, args.dest or default_backup_dir(args.data), int(os.getenv("BACKUP_KEEP", "48")))
+    if args.command == "backup":
+        store.backup()
+    elif args.command == "list":
+        for name in store.list_backups():
+            manifest = store._load_manifest(name)
+            size = sum(entry["size"] for entry in manifest["files"].values())
+            print(f"{manifest['created_at']}  файлов: {len(manifest['files'])}, {size} байт")
+    else:
+        try:
+            name = store.restore(args.at, args.target)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"Восстановлена копия {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Tuple, List
+
+logger = logging.getLogger(__name__)
+
+# Модули, импорт которых не должен трогать диск
+LAZY_MODULES = ("src.storage", "src.auth", "src.merch_manager", "src.stock_holds")
+# Бюджет холодного импорта по умолчанию (STARTUP_IMPORT_BUDGET_MS)
+DEFAULT_IMPORT_BUDGET_MS = 500
+
+
+def bootstrap():
+    """
+    Явная инициализация глобальных объектов при запуске бота
+    
+    Создает хранилище (папка data/, файлы по умолчанию) и менеджер ролей
+    (главный админ). Без вызова они создаются при первом обращении.
+    Если задан BACKUP_INTERVAL, запускает резервное копирование.
+    """
+    from .storage import storage
+    from .auth import role_manager
+    from .backup import start_backup_scheduler
+    
+    started = time.perf_counter()
+    storage._lazy_get()
+    role_manager._lazy_get()
+    logger.info(f"Хранилище и менеджер ролей инициализированы за "
+                f"{(time.perf_counter() - started) * 1000:.0f} мс")
+    start_backup_scheduler(storage)
+
+
+def measure_cold_import(modules=LAZY_MODULES) -> Tuple[float, List[str]]:
+    """
+    Холодный импорт модулей в отдельном процессе и пустой рабочей папке
+    
+    Возвращает время импорта в мс и список файлов, созданных при импорте.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys, time; t = time.perf_counter(); "
+            f"[__import__(name) for name in {list(modules)!r}]; "
+            "print((time.perf_counter() - t) * 1000)")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get("PYTHONPATH", "")]))
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Импорт завершился ошибкой:\n{result.stderr}")
+        created = sorted(os.listdir(workdir))
+    return float(result.stdout.strip().splitlines()[-1]), created
+
+
+def main(argv=None) -> int:
+    """python -m src.bootstrap --budget-ms 500"""
+    parser = argparse.ArgumentParser(description="Проверка времени холодного импорта")
+    parser.add_argument("--budget-ms", type=float,
+                        default=float(os.getenv("STARTUP_IMPORT_BUDGET_MS", DEFAULT_IMPORT_BUDGET_MS)))
+    parser.add_argument("modules", nargs="*", default=list(LAZY_MODULES))
+    args = parser.parse_args(argv)
+    
+    elapsed_ms, created = measure_cold_import(args.modules)
+    print(f"Импорт {', '.join(args.modules)}: {elapsed_ms:.0f} мс (бюджет {args.budget_ms:.0f} мс)")
+    
+    failed = False
+    if created:
+        print(f"❌ При импорте созданы файлы: {', '.join(created)}")
+        failed = True
+    if elapsed_ms > args.budget_ms:
+        print("❌ Бюджет времени импорта превышен")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -58,10 +58,11 @@ class YaEduMerchBot:
         try:
             # Проверяем наличие основных данных
             from .storage import storage
-            users = storage.get_all("users.json")
-            chats = storage.list_active_chats()
-            inventory = storage.get_all("inventory.json")
-            settings = storage.get_all("settings.json")
+            snapshot = storage.snapshot()
+            users = snapshot.users
+            chats = snapshot.active_chats
+            inventory = snapshot.inventory
+            settings = snapshot.settings
             
             # Проект считается готовым, если есть:
             # 1. Хотя бы один админ
@@ -251,6 +252,9 @@ class YaEduMerchBot:
         
         if user_data['role'] == 'admin':
             status_text += "\n👑 <b>Права:</b> Полный доступ ко всем функциям"
+            from .stock_holds import stock_holds
+            holds = stock_holds.stats()
+            status_text += f"\n🛒 <b>Брони:</b> {holds['holds']} ({holds['held_units']} шт.)"
         elif user_data['role'] == 'coordinator':
             status_text += "\n🔧 <b>Права:</b> Можете добавлять промо-пользователей"
         elif user_data['role'] == 'promo':
@@ -684,3 +688,6 @@ class YaEduMerchBot:
         except Exception as e:
             logger.error(f"Ошибка работы бота: {e}")
             raise
+        finally:
+            from .storage import storage
+            storage.close()
@@ -198,11 +198,12 @@ class ChatManager:
             
             logger.info(f"Показываем системную статистику для чата {chat_id}, пользователя {user_id}")
             
-            # Получаем статистику
-            users = storage.get_all("users.json")
-            chats = storage.list_active_chats()
-            orders = storage.get_all("orders.json")
-            inventory = storage.get_all("inventory.json")
+            # Получаем статистику из согласованного среза
+            snapshot = storage.snapshot()
+            users = snapshot.users
+            chats = snapshot.active_chats
+            orders = snapshot.orders
+            inventory = snapshot.inventory
             
             content = "📊 <b>Системная статистика:</b>\n\n"
             content += f"👥 <b>Пользователи:</b> {len(users)}\n"
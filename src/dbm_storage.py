@@ -0,0 +1,249 @@
+import dbm
+import os
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional, List, Union
+from .storage import JSONStorage, StorageError, _KeyedView, _copy_json, load_json
+from .storage_codec import encode, decode
+
+logger = logging.getLogger(__name__)
+
+# Словарные документы, которые хранятся в dbm (остальные остаются JSON файлами)
+KEYED_FILES = ("users.json", "chat_messages.json", "audit_log.json")
+
+
+def dbm_dir_from_url(database_url: str, data_dir: str = "data") -> str:
+    """
+    Папка dbm баз из DATABASE_URL
+    
+    dbm:///kv -> <data_dir>/kv, dbm:////abs/kv -> /abs/kv, dbm:// -> <data_dir>/kv
+    """
+    path = database_url[len("dbm://"):]
+    if path.startswith("/"):
+        path = path[1:]
+    if not path:
+        path = "kv"
+    if os.path.isabs(path):
+        return path
+    return os.path.join(data_dir, path)
+
+
+class DbmStorage(JSONStorage):
+    """
+    Хранилище со словарными документами в stdlib dbm (gdbm/ndbm/dumb)
+    
+    users.json, chat_messages.json и audit_log.json лежат в отдельных dbm
+    базах: get/set по ID пользователя или чата - поиск по ключу на диске
+    вместо разбора всего JSON. Чаты, инвентарь и заказы хранятся как в JSONStorage.
+    """
+    
+    def __init__(self, dbm_dir: str, data_dir: str = "data"):
+        self.dbm_dir = dbm_dir
+        self._dbs: Dict[str, Any] = {}
+        # Базы dbm.dumb: данные пишутся сразу, а sync переписывает весь индекс
+        self._dumb_dbs = set()
+        self._db_locks = {filename: threading.RLock() for filename in KEYED_FILES}
+        super().__init__(data_dir)
+    
+    # === БАЗЫ ===
+    
+    def _db(self, filename: str):
+        """Открытая dbm база документа (открывается при первом обращении)"""
+        db = self._dbs.get(filename)
+        if db is None:
+            os.makedirs(self.dbm_dir, exist_ok=True)
+            path = os.path.join(self.dbm_dir, os.path.splitext(filename)[0])
+            db = dbm.open(path, "c")
+            if dbm.whichdb(path) == "dbm.dumb":
+                self._dumb_dbs.add(id(db))
+            self._dbs[filename] = db
+        return db
+    
+    def _sync(self, db):
+        """Сбросить запись на диск"""
+        if id(db) not in self._dumb_dbs and hasattr(db, "sync"):
+            db.sync()
+    
+    def _db_get(self, filename: str, key: str) -> Optional[Any]:
+        self._stats.count_read(filename)
+        started = time.perf_counter()
+        with self._db_locks[filename]:
+            raw = self._db(filename).get(str(key).encode("utf-8"))
+        if raw is None:
+            return None
+        value = decode(raw)
+        self._stats.record_parse(filename, len(raw), time.perf_counter() - started)
+        return value
+    
+    def _db_set(self, filename: str, key: str, value: Any):
+        self._stats.count_write(filename)
+        started = time.perf_counter()
+        raw = encode(value, "compact")
+        with self._db_locks[filename]:
+            db = self._db(filename)
+            db[str(key).encode("utf-8")] = raw
+            self._sync(db)
+        self._bump_version()
+        self._stats.record_serialize(filename, len(raw), time.perf_counter() - started)
+    
+    def _db_keys(self, filename: str) -> List[str]:
+        with self._db_locks[filename]:
+            return [key.decode("utf-8") for key in self._db(filename).keys()]
+    
+    # === ИНИЦИАЛИЗАЦИЯ ===
+    
+    def _init_users_layout(self, users_layout: Optional[str]):
+        """Пользователи хранятся в dbm"""
+        self.users_layout = "file"
+        self._user_ids = None
+    
+    def _init_data_files(self):
+        """JSON файлы для остальных документов и разовый импорт словарных документов"""
+        super()._init_data_files()
+        for filename in KEYED_FILES:
+            path = self._get_filepath(filename)
+            if os.path.exists(path) and not self._db_keys(filename):
+                self.import_json_file(path, filename)
+    
+    def _default_files(self) -> Dict[str, Any]:
+        files = super()._default_files()
+        for filename in KEYED_FILES:
+            files.pop(filename, None)
+        return files
+    
+    def import_json_file(self, path: str, filename: Optional[str] = None) -> int:
+        """
+        Импорт словарного JSON документа в dbm (существующие ключи перезаписываются)
+        
+        Возвращает количество импортированных записей.
+        """
+        filename = filename or os.path.basename(path)
+        data = load_json(path, None)
+        if not isinstance(data, dict):
+            return 0
+        with self._db_locks[filename]:
+            db = self._db(filename)
+            for key, value in data.items():
+                db[str(key).encode("utf-8")] = encode(value, "compact")
+            self._sync(db)
+        logger.info(f"Импортировано в dbm из {path}: {len(data)} записей")
+        return len(data)
+    
+    def import_json_dir(self, json_dir: str) -> int:
+        """Импорт всех словарных документов из папки JSON файлов"""
+        return sum(self.import_json_file(os.path.join(json_dir, filename), filename)
+                   for filename in KEYED_FILES
+                   if os.path.exists(os.path.join(json_dir, filename)))
+    
+    # === ДОКУМЕНТЫ ЦЕЛИКОМ (совместимость) ===
+    
+    def _load_cached(self, filename: str) -> Any:
+        if filename in KEYED_FILES:
+            return {key: self._db_get(filename, key) for key in sorted(self._db_keys(filename))}
+        return super()._load_cached(filename)
+    
+    def _write_file(self, filename: str, data: Any) -> bool:
+        if filename not in KEYED_FILES:
+            return super()._write_file(filename, data)
+        with self._db_locks[filename]:
+            db = self._db(filename)
+            for key in set(self._db_keys(filename)) - set(data):
+                del db[key.encode("utf-8")]
+            for key, value in data.items():
+                db[str(key).encode("utf-8")] = encode(value, "compact")
+            self._sync(db)
+        self._bump_version()
+        return True
+    
+    def get_all(self, filename: str) -> Any:
+        """Получить все данные из файла (словарные документы читаются по мере обхода)"""
+        if filename in KEYED_FILES:
+            return _KeyedView(self, filename, lambda: self._db_keys(filename))
+        return super().get_all(filename)
+    
+    def view(self, filename: str) -> Any:
+        """Документ только для чтения (словарные документы читаются по мере обхода)"""
+        if filename in KEYED_FILES:
+            return self.get_all(filename)
+        return super().view(filename)
+    
+    # === ЗАПИСИ ПО КЛЮЧУ ===
+    
+    def get(self, filename: str, key: str) -> Optional[Any]:
+        """Получить значение по ключу"""
+        if filename in KEYED_FILES:
+            return self._db_get(filename, key)
+        return super().get(filename, key)
+    
+    def set(self, filename: str, key: str, value: Any) -> bool:
+        """Установить значение по ключу"""
+        if filename not in KEYED_FILES:
+            return super().set(filename, key, value)
+        try:
+            self._db_set(filename, key, value)
+        except (OSError, dbm.error) as e:
+            logger.error(f"Ошибка записи {filename}[{key}] в dbm: {e}")
+            return False
+        return True
+    
+    def get_many(self, filename: str, keys: List[Union[str, int]]) -> Dict[str, Any]:
+        """Получить несколько записей"""
+        if filename not in KEYED_FILES:
+            return super().get_many(filename, keys)
+        return {str(key): self._db_get(filename, key) for key in keys}
+    
+    def update_many(self, changes: Dict[str, Dict[Union[str, int], Dict[str, Any]]],
+                    replace: bool = False) -> bool:
+        """Изменить записи: в dbm - по ключам, в JSON документах - одной записью файла"""
+        with self._snapshot_lock:
+            try:
+                for filename, records in changes.items():
+                    if filename not in KEYED_FILES:
+                        continue
+                    with self._db_locks[filename]:
+                        for key, value in records.items():
+                            if not replace:
+                                current = self._db_get(filename, key)
+                                if not isinstance(current, dict):
+                                    continue
+                                value = {**current, **value}
+                            self._db_set(filename, key, value)
+            except (OSError, dbm.error) as e:
+                logger.error(f"Ошибка пакетной записи в dbm: {e}")
+                return False
+            
+            other_changes = {filename: records for filename, records in changes.items()
+                             if filename not in KEYED_FILES}
+            return super().update_many(other_changes, replace) if other_changes else True
+    
+    def get_or_create_user(self, tg_user) -> Dict[str, Any]:
+        """Получить или создать пользователя"""
+        tg_id = str(tg_user.id)
+        with self._db_locks["users.json"]:
+            user = self._db_get("users.json", tg_id)
+            if user is None:
+                user = self._new_user(tg_user)
+                self._db_set("users.json", tg_id, user)
+        return _copy_json(user)
+    
+    def inc_total_orders(self, tg_id: Union[str, int]) -> int:
+        """Увеличить счетчик заказов пользователя"""
+        with self._db_locks["users.json"]:
+            user = self._db_get("users.json", str(tg_id))
+            if user is None:
+                return 0
+            user["total_orders"] = user.get("total_orders", 0) + 1
+            try:
+                self._db_set("users.json", str(tg_id), user)
+            except (OSError, dbm.error) as e:
+                raise StorageError(f"Не удалось записать пользователя {tg_id}: {e}")
+        return user["total_orders"]
+    
+    def close(self):
+        """Завершение работы: JSON документы и dbm базы"""
+        super().close()
+        for filename, db in list(self._dbs.items()):
+            with self._db_locks[filename]:
+                db.close()
+                del self._dbs[filename]
@@ -72,13 +72,7 @@ def register_admin_handlers(bot, chat_manager):
             return
         
         # Генерируем уникальный индекс для чата
-        all_chats = storage.list_active_chats()
-        used_prefixes = set()
-        
-        # Собираем все используемые индексы
-        for chat_info in all_chats:
-            if chat_info.get('prefix'):
-                used_prefixes.add(chat_info.get('prefix'))
+        used_prefixes = storage.used_prefixes()
         
         # Генерируем новый индекс
         new_prefix = None
@@ -740,9 +734,17 @@ def _show_orders_list(chat_id, chat_manager):
     """Показывает список заказов"""
     from ..keyboards import get_back_keyboard
     
+    # Последние заказы, ожидающие отправки
+    pending_orders = storage.orders_by_status("pending")[-20:]
+    
     content = "📋 <b>Список заказов</b>\n\n"
-    content += "Функция просмотра заказов будет реализована в следующих версиях.\n\n"
-    content += "Пока что используйте основные функции управления."
+    if not pending_orders:
+        content += "Заказов, ожидающих отправки, нет."
+    else:
+        content += f"⏳ <b>Ожидают отправки:</b> {len(pending_orders)}\n\n"
+        for order in reversed(pending_orders):
+            content += (f"#{order.get('id')} — {order.get('size')}/{order.get('color')}, "
+                        f"от {order.get('user_tg_id')} ({order.get('created_at', '')[:16]})\n")
     
     keyboard = get_back_keyboard("admin_manage_orders")
     chat_manager.update_chat_message(chat_id, content, keyboard)
@@ -750,10 +752,21 @@ def _show_orders_list(chat_id, chat_manager):
 def _show_orders_statistics(chat_id, chat_manager):
     """Показывает статистику заказов"""
     from ..keyboards import get_back_keyboard
+    from datetime import datetime, timedelta
+    
+    status_counts = storage.order_status_counts()
+    now = datetime.now()
+    today_orders = storage.orders_between(now.replace(hour=0, minute=0, second=0, microsecond=0), now)
+    week_orders = storage.orders_between(now - timedelta(days=7), now)
     
     content = "📊 <b>Статистика заказов</b>\n\n"
-    content += "Функция статистики заказов будет реализована в следующих версиях.\n\n"
-    content += "Пока что используйте основные функции управления."
+    content += f"📦 <b>Всего:</b> {sum(status_counts.values())}\n"
+    content += f"📅 <b>За сегодня:</b> {len(today_orders)}\n"
+    content += f"🗓 <b>За 7 дней:</b> {len(week_orders)}\n\n"
+    
+    content += "🔖 <b>По статусам:</b>\n"
+    for status, count in status_counts.items():
+        content += f"  {status}: {count}\n"
     
     keyboard = get_back_keyboard("admin_manage_orders")
     chat_manager.update_chat_message(chat_id, content, keyboard)
@@ -762,11 +775,12 @@ def _show_system_statistics(chat_id, chat_manager):
     """Показывает системную статистику"""
     from ..keyboards import get_back_keyboard
     
-    # Получаем статистику
-    users = storage.get_all("users.json")
-    chats = storage.list_active_chats()
-    orders = storage.get_all("orders.json")
-    inventory = storage.get_all("inventory.json")
+    # Получаем статистику из согласованного среза
+    snapshot = storage.snapshot()
+    users = snapshot.users
+    chats = snapshot.active_chats
+    orders = snapshot.orders
+    inventory = snapshot.inventory
     
     content = "📊 <b>Системная статистика:</b>\n\n"
     content += f"👥 <b>Пользователи:</b> {len(users)}\n"
@@ -1148,17 +1162,9 @@ def _handle_prefix_change(chat_id, user_id, target_chat_id, new_prefix, chat_man
         keyboard = get_back_keyboard("admin_manage_chats")
     else:
         # Проверяем, не занят ли уже этот индекс другим чатом
-        all_chats = storage.list_active_chats()
-        prefix_conflict = False
-        conflicting_chat = None
-        
-        for chat_info in all_chats:
-            if str(chat_info.get('chat_id')) != str(target_chat_id) and chat_info.get('prefix') == new_prefix:
-                prefix_conflict = True
-                conflicting_chat = chat_info
-                break
+        conflicting_chat = storage.find_chat_by_prefix(new_prefix, exclude_chat_id=target_chat_id)
         
-        if prefix_conflict:
+        if conflicting_chat:
             content = "❌ <b>Индекс уже занят!</b>\n\n"
             content += f"Индекс <b>{new_prefix}</b> уже используется чатом:\n"
             content += f"📝 <b>Название:</b> {conflicting_chat.get('title', 'Без названия')}\n"
@@ -1,8 +1,9 @@
 import logging
 from telebot.types import Message, CallbackQuery
 from telebot.handler_backends import State, StatesGroup
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from ..storage import storage
+from ..stock_holds import stock_holds
 from ..auth import role_manager
 from ..keyboards import get_back_keyboard
 from datetime import datetime
@@ -86,6 +87,14 @@ def register_merch_handlers(bot, chat_manager):
             bot.set_state(user_id, OrderStates.pick_color, chat_id)
             _show_color_selection(bot, chat_id, user_id, size, colors)
         else:
+            # Цвет выбирать не из чего - бронируем сразу
+            color = colors[0] if len(colors) == 1 else "_"
+            order_data[user_id]['color'] = color
+            if not stock_holds.place(user_id, size, color):
+                bot.answer_callback_query(call.id, "❌ Этот размер уже разобрали")
+                _show_size_selection(bot, chat_id, user_id)
+                return
+            
             # Пропускаем выбор цвета, переходим к загрузке фото
             bot.set_state(user_id, OrderStates.await_image, chat_id)
             _show_image_upload(bot, chat_id, user_id)
@@ -110,6 +119,12 @@ def register_merch_handlers(bot, chat_manager):
             order_data[user_id]['color'] = color
             order_data[user_id]['size'] = size
             
+            # Бронируем товар на время оформления
+            if not stock_holds.place(user_id, size, color):
+                bot.answer_callback_query(call.id, "❌ Этот цвет уже разобрали")
+                _show_color_selection(bot, chat_id, user_id, size, storage.list_colors(size))
+                return
+            
             # Переходим к загрузке фото
             bot.set_state(user_id, OrderStates.await_image, chat_id)
             _show_image_upload(bot, chat_id, user_id)
@@ -238,11 +253,8 @@ def register_merch_handlers(bot, chat_manager):
         chat_id = call.message.chat.id
         
         # Создаем заказ
-        success = _create_order(user_id)
-        if success:
-            # Получаем ID заказа для квитанции
-            order_id = storage.next_order_id() - 1  # Текущий ID будет следующим
-            
+        order_id = _create_order(user_id)
+        if order_id is not None:
             # Сохраняем данные для квитанции
             order_info = order_data.get(user_id, {})
             
@@ -287,10 +299,11 @@ def register_merch_handlers(bot, chat_manager):
         user_id = call.from_user.id
         chat_id = call.message.chat.id
         
-        # Очищаем состояние и данные
+        # Очищаем состояние, данные и бронь
         bot.delete_state(user_id, chat_id)
         if user_id in order_data:
             del order_data[user_id]
+        stock_holds.release(user_id)
         
         # Показываем главное меню
         chat_manager.show_main_menu(chat_id, user_id, role_manager.get_user_role(user_id))
@@ -356,24 +369,17 @@ def _show_order_start(bot, chat_id: int, user_id: int):
 
 def _show_size_selection(bot, chat_id: int, user_id: int):
     """Показывает выбор размера"""
-    sizes = storage.list_sizes()
+    # Одна матрица доступности на весь экран, без запросов на каждый размер
+    availability = storage.availability()
     
     text = "📏 <b>Выберите размер</b>\n\n"
     text += "Доступные размеры:\n"
     
     keyboard = InlineKeyboardMarkup(row_width=2)
     
-    for size in sizes:
-        # Получаем количество доступных товаров
-        colors = storage.list_colors(size)
-        total_available = 0
-        for color in colors:
-            if color == "_":
-                qty = storage._read_file("inventory.json")['sizes'][size]['colors']['_']
-                total_available += qty['qty_total'] - qty['qty_reserved']
-            else:
-                qty = storage._read_file("inventory.json")['sizes'][size]['colors'][color]
-                total_available += qty['qty_total'] - qty['qty_reserved']
+    for size in availability.sizes:
+        # Доступно по размеру (сумма по всем цветам и видам без чужих броней)
+        total_available = availability.totals[size] - stock_holds.held(size, exclude_user=user_id)
         
         text += f"• {size} (осталось {total_available})\n"
         keyboard.add(InlineKeyboardButton(f"{size} ({total_available})", callback_data=f"size_{size}"))
@@ -388,11 +394,11 @@ def _show_color_selection(bot, chat_id: int, user_id: int, size: str, colors: Li
     text += "Доступные цвета:\n"
     
     keyboard = InlineKeyboardMarkup(row_width=2)
+    available_by_color = storage.availability().colors.get(size, {})
     
     for color in colors:
         if color != "_":
-            qty = storage._read_file("inventory.json")['sizes'][size]['colors'][color]
-            available = qty['qty_total'] - qty['qty_reserved']
+            available = available_by_color.get(color, 0) - stock_holds.held(size, color, exclude_user=user_id)
             text += f"• {color} (осталось {available})\n"
             keyboard.add(InlineKeyboardButton(f"{color} ({available})", callback_data=f"color_{color}_{size}"))
     
@@ -496,20 +502,20 @@ def _show_order_confirmation(bot, chat_id: int, user_id: int):
     
     bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
 
-def _create_order(user_id: int) -> bool:
-    """Создает заказ в системе"""
+def _create_order(user_id: int) -> Optional[int]:
+    """Создает заказ в системе, возвращает ID заказа или None"""
     try:
         if user_id not in order_data:
-            return False
+            return None
         
         data = order_data[user_id]
         size = data.get('size')
         color = data.get('color', '_')
         
-        # Проверяем и резервируем остатки
-        if not storage.reserve(size, color, 1):
+        # Превращаем бронь в резерв (без брони - только не занятый чужими бронями остаток)
+        if not stock_holds.convert(user_id, size, color, 1):
             logger.warning(f"Не удалось зарезервировать товар: размер {size}, цвет {color}")
-            return False
+            return None
         
         # Создаем заказ в storage
         order_payload = {
@@ -536,7 +542,7 @@ def _create_order(user_id: int) -> bool:
                 # Пока что просто логируем
                 logger.info(f"Заказ {order_id} должен быть отправлен в чат {chat_id_str} с префиксом {prefix}")
         
-        return True
+        return order_id
         
     except Exception as e:
         logger.error(f"Ошибка создания заказа: {e}")
@@ -546,4 +552,4 @@ def _create_order(user_id: int) -> bool:
                 storage.release(size, color, 1)
         except:
             pass
-        return False
+        return None
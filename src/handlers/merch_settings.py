@@ -1,3 +1,5 @@
+import io
+import html
 import logging
 from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from telebot.handler_backends import State, StatesGroup
@@ -5,6 +7,7 @@ from typing import Dict, Any, List
 from ..storage import storage
 from ..auth import role_manager
 from ..keyboards import get_back_keyboard
+from ..stock_import import StockTableError, import_stock_table, export_stock_table, format_changes, COLUMNS
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,7 @@ class MerchSettingsStates(StatesGroup):
     waiting_for_product_sizes = State()
     waiting_for_quantity = State()
     waiting_for_size_name = State()
+    waiting_for_stock_file = State()
 
 # Временное хранилище для данных настройки
 merch_data = {}
@@ -179,24 +183,12 @@ def register_merch_settings_handlers(bot, chat_manager):
             return
         
         # Проверяем, не существует ли уже такой размер
-        inventory = storage.get_all("inventory.json")
-        existing_sizes = inventory.get('sizes', {})
-        
-        if size_name in existing_sizes:
+        if size_name in storage.list_sizes():
             bot.reply_to(message, f"❌ Размер {size_name} уже существует")
             return
         
-        # Добавляем новый размер в инвентарь
-        if 'sizes' not in inventory:
-            inventory['sizes'] = {}
-        
-        inventory['sizes'][size_name] = {
-            'qty_total': 0,
-            'qty_reserved': 0
-        }
-        
-        # Сохраняем обновленный инвентарь
-        success = storage.save_json_atomic("inventory.json", inventory)
+        # Добавляем новый размер в список размеров инвентаря
+        success = storage.add_size(size_name)
         
         if success:
             content = f"✅ Размер <b>{size_name}</b> успешно добавлен!\n\n"
@@ -255,6 +247,66 @@ def register_merch_settings_handlers(bot, chat_manager):
         _show_order_statistics(bot, chat_id, user_id, chat_manager)
         bot.answer_callback_query(call.id)
     
+    @bot.callback_query_handler(func=lambda call: call.data == "merch_import_stock")
+    def handle_import_stock(call: CallbackQuery):
+        """Обработчик загрузки таблицы остатков"""
+        user_id = call.from_user.id
+        chat_id = call.message.chat.id
+        
+        if not role_manager.has_permission(user_id, "admin"):
+            bot.answer_callback_query(call.id, "❌ Нет прав администратора!")
+            return
+        
+        bot.set_state(user_id, MerchSettingsStates.waiting_for_stock_file, chat_id)
+        _show_stock_import_form(bot, chat_id, user_id, chat_manager)
+        bot.answer_callback_query(call.id)
+    
+    @bot.message_handler(content_types=['document'], state=MerchSettingsStates.waiting_for_stock_file)
+    def handle_stock_file(message: Message):
+        """Обработчик файла с таблицей остатков"""
+        user_id = message.from_user.id
+        chat_id = message.chat.id
+        
+        if not role_manager.has_permission(user_id, "admin"):
+            bot.reply_to(message, "❌ У вас нет прав для настройки мерча")
+            return
+        
+        document = message.document
+        try:
+            file_info = bot.get_file(document.file_id)
+            content = bot.download_file(file_info.file_path)
+            changes = import_stock_table(storage, io.BytesIO(content), document.file_name or "")
+        except StockTableError as e:
+            bot.reply_to(message, f"❌ <b>Таблица не загружена</b>\n\n<pre>{html.escape(str(e))}</pre>\n\n"
+                                  f"Исправьте файл и отправьте снова", parse_mode='HTML')
+            return
+        except Exception as e:
+            logger.error(f"Ошибка загрузки таблицы остатков: {e}")
+            bot.reply_to(message, "❌ Не удалось прочитать файл. Попробуйте снова.")
+            return
+        
+        bot.delete_state(user_id, chat_id)
+        text = f"✅ <b>Остатки загружены</b>\n\nИзменено SKU: {len(changes)}\n\n"
+        text += f"<pre>{html.escape(format_changes(changes, limit=50))}</pre>"
+        bot.send_message(chat_id, text, reply_markup=get_back_keyboard("admin_merch_settings"), parse_mode='HTML')
+    
+    @bot.callback_query_handler(func=lambda call: call.data == "merch_export_stock")
+    def handle_export_stock(call: CallbackQuery):
+        """Обработчик выгрузки таблицы остатков"""
+        user_id = call.from_user.id
+        chat_id = call.message.chat.id
+        
+        if not role_manager.has_permission(user_id, "admin"):
+            bot.answer_callback_query(call.id, "❌ Нет прав администратора!")
+            return
+        
+        buffer = io.StringIO()
+        count = export_stock_table(storage, buffer)
+        document = io.BytesIO(buffer.getvalue().encode("utf-8-sig"))
+        document.name = "stock.csv"
+        bot.send_document(chat_id, document, caption=f"📤 Остатки: {count} SKU")
+        bot.answer_callback_query(call.id)
+    
     @bot.callback_query_handler(func=lambda call: call.data == "merch_general_settings")
     def handle_general_settings(call: CallbackQuery):
         """Обработчик общих настроек мерча"""
@@ -437,11 +489,27 @@ def _show_merch_settings_menu(bot, chat_id: int, user_id: int, chat_manager):
         InlineKeyboardButton("🎨 Управление цветами", callback_data="merch_manage_colors"),
         InlineKeyboardButton("📊 Статистика заказов", callback_data="merch_order_stats"),
         InlineKeyboardButton("⚙️ Общие настройки", callback_data="merch_general_settings"),
+        InlineKeyboardButton("📥 Загрузить остатки", callback_data="merch_import_stock"),
+        InlineKeyboardButton("📤 Выгрузить остатки", callback_data="merch_export_stock"),
         InlineKeyboardButton("🔙 Назад", callback_data="admin_merch_settings")
     )
     
     chat_manager.update_chat_message(chat_id, content, keyboard)
 
+def _show_stock_import_form(bot, chat_id: int, user_id: int, chat_manager):
+    """Показывает инструкцию по загрузке таблицы остатков"""
+    content = "📥 <b>Загрузка остатков</b>\n\n"
+    content += "Отправьте файл CSV или XLSX с колонками:\n"
+    content += f"<code>{', '.join(COLUMNS)}</code>\n\n"
+    content += "Вид, цвет и размер должны быть в справочниках (SKU, которые уже есть в остатках, "
+    content += "принимаются как есть), пустой цвет - товар без цвета. "
+    content += "Количество заменяет текущий остаток, вся таблица применяется одной записью.\n\n"
+    content += "Выгрузка остатков подходит как шаблон."
+    
+    keyboard = get_back_keyboard("admin_merch_settings")
+    
+    chat_manager.update_chat_message(chat_id, content, keyboard)
+
 def _show_add_product_form(bot, chat_id: int, user_id: int, chat_manager):
     """Показывает форму добавления товара"""
     content = "➕ <b>Добавление нового товара</b>\n\n"
@@ -489,8 +557,7 @@ def _show_color_selection(bot, chat_id: int, user_id: int, chat_manager):
 def _show_size_setup(bot, chat_id: int, user_id: int, chat_manager):
     """Показывает настройку размеров"""
     # Получаем доступные размеры из инвентаря
-    inventory = storage.get_all("inventory.json")
-    available_sizes = list(inventory.get('sizes', {}).keys())
+    available_sizes = storage.list_sizes()
     
     if not available_sizes:
         content = "❌ <b>Ошибка настройки размеров</b>\n\n"
@@ -645,8 +712,7 @@ def _show_products_list(bot, chat_id: int, user_id: int, chat_manager):
 def _show_sizes_management(bot, chat_id: int, user_id: int, chat_manager):
     """Показывает управление размерами"""
     # Получаем текущие размеры из инвентаря
-    inventory = storage.get_all("inventory.json")
-    current_sizes = list(inventory.get('sizes', {}).keys())
+    current_sizes = storage.list_sizes()
     
     content = "📏 <b>Управление размерами</b>\n\n"
     content += "Текущие размеры в системе:\n"
@@ -778,8 +844,7 @@ def _show_add_size_form(bot, chat_id: int, user_id: int, chat_manager):
 
 def _show_remove_size_selection(bot, chat_id: int, user_id: int, chat_manager):
     """Показывает выбор размера для удаления"""
-    inventory = storage.get_all("inventory.json")
-    current_sizes = list(inventory.get('sizes', {}).keys())
+    current_sizes = storage.list_sizes()
     
     if not current_sizes:
         content = "❌ <b>Нет размеров для удаления</b>\n\n"
@@ -821,28 +886,14 @@ def _show_delete_size_confirm(bot, chat_id: int, user_id: int, size_name: str, c
 def _delete_size(bot, chat_id: int, user_id: int, size_name: str, chat_manager):
     """Удаляет размер из системы"""
     try:
-        # Получаем текущий инвентарь
-        inventory = storage.get_all("inventory.json")
-        current_sizes = inventory.get('sizes', {})
-        
-        if size_name not in current_sizes:
+        if size_name not in storage.list_sizes():
             content = f"❌ Размер <b>{size_name}</b> не найден"
             keyboard = get_back_keyboard("merch_manage_sizes")
             chat_manager.update_chat_message(chat_id, content, keyboard)
             return
         
-        # Удаляем размер из инвентаря
-        del current_sizes[size_name]
-        inventory['sizes'] = current_sizes
-        
-        # Удаляем размер из всех товаров
-        products = inventory.get('products', {})
-        for product_id, product in products.items():
-            if 'sizes' in product and size_name in product['sizes']:
-                del product['sizes'][size_name]
-        
-        # Сохраняем обновленный инвентарь
-        success = storage.save_json_atomic("inventory.json", inventory)
+        # Размер удаляется вместе с остатками всех товаров этого размера
+        success = storage.remove_size(size_name)
         
         if success:
             content = f"✅ Размер <b>{size_name}</b> успешно удален!\n\n"
@@ -869,8 +920,7 @@ def _delete_size(bot, chat_id: int, user_id: int, size_name: str, chat_manager):
 
 def _show_edit_sizes_form(bot, chat_id: int, user_id: int, chat_manager):
     """Показывает форму редактирования размеров"""
-    inventory = storage.get_all("inventory.json")
-    current_sizes = list(inventory.get('sizes', {}).keys())
+    current_sizes = storage.list_sizes()
     
     if not current_sizes:
         content = "❌ <b>Нет размеров для редактирования</b>\n\n"
@@ -0,0 +1,333 @@
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_FILE = "inventory.json"
+
+# Версия схемы inventory.json: единая таблица SKU
+INVENTORY_SCHEMA = 2
+
+# Вид товара для остатков без вида и цвет для товаров без цвета
+NO_TYPE = ""
+NO_COLOR = "_"
+
+# Поля SKU, по которым можно переименовывать и фильтровать
+SKU_FIELDS = ("type", "color", "size")
+
+
+def sku_key(product_type: str, color: str, size: str) -> str:
+    """Ключ SKU в inventory.json["skus"]"""
+    return f"{product_type}|{color}|{size}"
+
+
+def new_sku(product_type: str, color: str, size: str, qty_total: int = 0, qty_reserved: int = 0) -> Dict[str, Any]:
+    return {"type": product_type, "color": color, "size": size,
+            "qty_total": qty_total, "qty_reserved": qty_reserved}
+
+
+def stock_record(sku: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия SKU с вычисленным qty_available"""
+    record = dict(sku)
+    record["qty_available"] = sku["qty_total"] - sku["qty_reserved"]
+    return record
+
+
+def empty_inventory() -> Dict[str, Any]:
+    return {"schema": INVENTORY_SCHEMA, "sizes": [], "products": {}, "skus": {}}
+
+
+# === МИГРАЦИЯ ===
+
+def _counters(data: Any) -> Tuple[int, int]:
+    if not isinstance(data, dict):
+        return 0, 0
+    return int(data.get("qty_total", 0) or 0), int(data.get("qty_reserved", 0) or 0)
+
+
+def migrate_inventory(inventory: Any) -> Dict[str, Any]:
+    """
+    Привести inventory.json к единой таблице SKU
+    
+    Понимает все прежние схемы файла:
+    - products[id]["sizes"][size] - остатки товара (вид, базовый цвет, размер);
+    - sizes[size]["colors"][color] - остатки по размеру и цвету (reserve/release),
+      в том числе сумма по товарам, которая велась второй раз;
+    - sizes[size] = {qty_total, qty_reserved} - размер без цветов (настройки мерча);
+    - плоские ключи "{вид}_{цвет}_{размер}" MerchManager.
+    Резервы берутся из sizes (их меняли reserve/release), остаток sizes сверх
+    суммы по товарам становится SKU без вида. Неизвестные ключи сохраняются.
+    """
+    if not isinstance(inventory, dict):
+        return empty_inventory()
+    if inventory.get("schema") == INVENTORY_SCHEMA:
+        return inventory
+    
+    result = empty_inventory()
+    sizes: List[str] = result["sizes"]
+    skus: Dict[str, Dict[str, Any]] = result["skus"]
+    
+    def add(product_type: str, color: str, size: str, qty_total: int, qty_reserved: int) -> Dict[str, Any]:
+        if size not in sizes:
+            sizes.append(size)
+        key = sku_key(product_type, color, size)
+        sku = skus.get(key)
+        if sku is None:
+            sku = skus[key] = new_sku(product_type, color, size)
+        sku["qty_total"] += qty_total
+        sku["qty_reserved"] += qty_reserved
+        return sku
+    
+    # Остатки товаров
+    by_size_color: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for product_id, product in (inventory.get("products") or {}).items():
+        if not isinstance(product, dict):
+            continue
+        result["products"][product_id] = {key: value for key, value in product.items() if key != "sizes"}
+        product_type = product.get("type", NO_TYPE)
+        color = product.get("base_color", NO_COLOR)
+        for size, counters in (product.get("sizes") or {}).items():
+            sku = add(product_type, color, size, *_counters(counters))
+            if sku not in by_size_color.setdefault((size, color), []):
+                by_size_color[(size, color)].append(sku)
+    
+    # Остатки по размерам и цветам: резервы отсюда, излишек - SKU без вида
+    legacy_sizes = inventory.get("sizes")
+    if isinstance(legacy_sizes, list):
+        for size in legacy_sizes:
+            if size not in sizes:
+                sizes.append(size)
+    elif isinstance(legacy_sizes, dict):
+        for size, size_data in legacy_sizes.items():
+            if size not in sizes:
+                sizes.append(size)
+            if not isinstance(size_data, dict):
+                continue
+            colors = size_data.get("colors")
+            if colors is None:
+                colors = {NO_COLOR: size_data} if any(_counters(size_data)) else {}
+            for color, counters in colors.items():
+                qty_total, qty_reserved = _counters(counters)
+                matched = by_size_color.get((size, color), [])
+                extra = qty_total - sum(sku["qty_total"] for sku in matched)
+                if extra > 0:
+                    matched = matched + [add(NO_TYPE, color, size, extra, 0)]
+                for sku in matched:
+                    sku["qty_reserved"] = min(sku["qty_total"], qty_reserved)
+                    qty_reserved -= sku["qty_reserved"]
+                if qty_reserved > 0:
+                    logger.warning(f"Миграция остатков: резерв {size}/{color} больше остатка, "
+                                   f"не перенесено {qty_reserved} шт.")
+    
+    # Плоские ключи MerchManager и прочие поля
+    for key, value in inventory.items():
+        if key in ("schema", "sizes", "products", "skus"):
+            continue
+        if isinstance(value, dict) and "merch_type" in value:
+            add(value["merch_type"], value.get("color", NO_COLOR), value.get("size", ""), *_counters(value))
+        else:
+            result[key] = value
+    
+    return result
+
+
+# === ИНДЕКС ===
+
+class AvailabilityMatrix:
+    """
+    Доступно (qty_total - qty_reserved) по каждой паре размер-цвет
+    
+    Строится один раз на версию остатков и только читается: отрисовка
+    выбора размера или цвета - один обход словаря без обращений к хранилищу.
+    """
+    
+    def __init__(self, sizes: Iterable[str], cells: Dict[str, Dict[str, int]]):
+        ordered = list(sizes)
+        self.sizes: Tuple[str, ...] = tuple(ordered + [size for size in cells if size not in ordered])
+        self.colors: Dict[str, Dict[str, int]] = {size: cells.get(size, {}) for size in self.sizes}
+        self.totals: Dict[str, int] = {size: sum(colors.values()) for size, colors in self.colors.items()}
+    
+    def available(self, size: str, color: Optional[str] = None) -> int:
+        if color is None:
+            return self.totals.get(size, 0)
+        return self.colors.get(size, {}).get(color, 0)
+
+
+class InventoryIndex:
+    """
+    Агрегаты остатков, построенные по версии inventory.json
+    
+    Хранит ключи SKU по (размер, цвет) и (вид, цвет) и суммы qty_total/qty_reserved
+    по размеру, по цвету и по паре размер-цвет. Изменения счетчиков переносятся
+    точечно через apply(), поэтому ни чтение, ни резерв не обходят все SKU.
+    """
+    
+    def __init__(self, inventory: Dict[str, Any]):
+        self.source = inventory
+        self.sizes: List[str] = list(inventory.get("sizes", []))
+        self._keys_by_size_color: Dict[Tuple[str, str], List[str]] = {}
+        self._keys_by_type_color: Dict[Tuple[str, str], List[str]] = {}
+        self._size_colors: Dict[str, Dict[str, List[int]]] = {}
+        self._size_totals: Dict[str, List[int]] = {}
+        self._color_totals: Dict[str, List[int]] = {}
+        self._totals = [0, 0]
+        # Номер изменения счетчиков и матрица доступности, построенная для него
+        self.generation = 0
+        self._matrix: Optional[Tuple[int, AvailabilityMatrix]] = None
+        for key, sku in inventory.get("skus", {}).items():
+            self._keys_by_size_color.setdefault((sku["size"], sku["color"]), []).append(key)
+            self._keys_by_type_color.setdefault((sku["type"], sku["color"]), []).append(key)
+            self._size_colors.setdefault(sku["size"], {}).setdefault(sku["color"], [0, 0])
+            self._add(sku, sku["qty_total"], sku["qty_reserved"])
+    
+    def _add(self, sku: Dict[str, Any], d_total: int, d_reserved: int):
+        for counters in (self._size_colors[sku["size"]][sku["color"]],
+                         self._size_totals.setdefault(sku["size"], [0, 0]),
+                         self._color_totals.setdefault(sku["color"], [0, 0]),
+                         self._totals):
+            counters[0] += d_total
+            counters[1] += d_reserved
+    
+    def apply(self, changes: Iterable[Tuple[Dict[str, Any], int, int]]):
+        """Перенести изменения счетчиков существующих SKU: (sku, d_total, d_reserved)"""
+        for sku, d_total, d_reserved in changes:
+            self._add(sku, d_total, d_reserved)
+        # Номер растет после изменения: матрица, собранная по частично
+        # обновленным счетчикам, получит старый номер и не будет использована
+        self.generation += 1
+    
+    def with_reserved(self, deltas: Dict[str, int]) -> "InventoryIndex":
+        """
+        Копия индекса с несохраненными изменениями резерва (ключ SKU -> разница)
+        
+        Ключи и размеры общие с исходным индексом, копируются только суммы.
+        source остается исходным документом - счетчики SKU в нем без этих изменений.
+        """
+        index = InventoryIndex.__new__(InventoryIndex)
+        index.__dict__.update(self.__dict__)
+        index._size_colors = {size: {color: list(counters) for color, counters in colors.items()}
+                              for size, colors in self._size_colors.items()}
+        index._size_totals = {size: list(counters) for size, counters in self._size_totals.items()}
+        index._color_totals = {color: list(counters) for color, counters in self._color_totals.items()}
+        index._totals = list(self._totals)
+        index._matrix = None
+        skus = self.source.get("skus", {})
+        for key, delta in deltas.items():
+            sku = skus.get(key)
+            if sku is not None:
+                index._add(sku, 0, delta)
+        return index
+    
+    # === ВЫБОРКИ ===
+    
+    def keys(self, size: str, color: str) -> List[str]:
+        """Ключи SKU размера и цвета (всех видов)"""
+        return self._keys_by_size_color.get((size, color), [])
+    
+    def product_keys(self, product_type: str, color: str) -> List[str]:
+        """Ключи SKU вида и цвета (все размеры товара)"""
+        return self._keys_by_type_color.get((product_type, color), [])
+    
+    def colors(self, size: str) -> List[str]:
+        return list(self._size_colors.get(size, {}))
+    
+    def counters(self, size: Optional[str] = None, color: Optional[str] = None) -> Tuple[int, int]:
+        """(qty_total, qty_reserved) по размеру, цвету, паре или по всем SKU"""
+        if size is not None and color is not None:
+            counters = self._size_colors.get(size, {}).get(color)
+        elif size is not None:
+            counters = self._size_totals.get(size)
+        elif color is not None:
+            counters = self._color_totals.get(color)
+        else:
+            counters = self._totals
+        return (counters[0], counters[1]) if counters else (0, 0)
+    
+    def available(self, size: Optional[str] = None, color: Optional[str] = None) -> int:
+        qty_total, qty_reserved = self.counters(size, color)
+        return qty_total - qty_reserved
+    
+    def availability(self) -> AvailabilityMatrix:
+        """Матрица доступности (строится при первом запросе после изменения счетчиков)"""
+        entry = self._matrix
+        if entry is not None and entry[0] == self.generation:
+            return entry[1]
+        generation = self.generation
+        cells = {size: {color: counters[0] - counters[1] for color, counters in colors.items()}
+                 for size, colors in self._size_colors.items()}
+        matrix = AvailabilityMatrix(self.sizes, cells)
+        self._matrix = (generation, matrix)
+        return matrix
+
+
+class StockDraft:
+    """
+    Черновик inventory.json для изменения SKU
+    
+    Запоминает исходные счетчики затронутых SKU, чтобы перенести в индекс
+    только разницу. Добавление и удаление SKU или размеров помечает
+    черновик как структурное изменение - индекс тогда перестраивается.
+    """
+    
+    def __init__(self, inventory: Dict[str, Any], index: InventoryIndex):
+        self.inventory = inventory
+        self.index = index
+        self.skus: Dict[str, Dict[str, Any]] = inventory.setdefault("skus", {})
+        self.sizes: List[str] = inventory.setdefault("sizes", [])
+        self.products: Dict[str, Any] = inventory.setdefault("products", {})
+        self.structural = False
+        self._before: Dict[str, Tuple[int, int]] = {}
+    
+    def get(self, product_type: str, color: str, size: str) -> Optional[Dict[str, Any]]:
+        return self.skus.get(sku_key(product_type, color, size))
+    
+    def find(self, size: str, color: str) -> List[Dict[str, Any]]:
+        """SKU размера и цвета в порядке индекса"""
+        return [self.skus[key] for key in self.index.keys(size, color) if key in self.skus]
+    
+    def set_counters(self, sku: Dict[str, Any], qty_total: int, qty_reserved: int):
+        key = sku_key(sku["type"], sku["color"], sku["size"])
+        self._before.setdefault(key, (sku["qty_total"], sku["qty_reserved"]))
+        sku["qty_total"] = qty_total
+        sku["qty_reserved"] = qty_reserved
+    
+    def add(self, product_type: str, color: str, size: str, qty_total: int = 0) -> Dict[str, Any]:
+        self.structural = True
+        self.add_size(size)
+        sku = self.skus[sku_key(product_type, color, size)] = new_sku(product_type, color, size, qty_total)
+        return sku
+    
+    def remove(self, sku: Dict[str, Any]):
+        self.structural = True
+        del self.skus[sku_key(sku["type"], sku["color"], sku["size"])]
+    
+    def add_size(self, size: str) -> bool:
+        if size in self.sizes:
+            return False
+        self.structural = True
+        self.sizes.append(size)
+        return True
+    
+    def remove_size(self, size: str) -> bool:
+        if size not in self.sizes:
+            return False
+        self.structural = True
+        self.sizes.remove(size)
+        return True
+    
+    def rename_size(self, old_size: str, new_size: str) -> bool:
+        """Переименовать размер на его месте в списке (если новый уже есть - старый удаляется)"""
+        if old_size not in self.sizes:
+            return False
+        self.structural = True
+        if new_size in self.sizes:
+            self.sizes.remove(old_size)
+        else:
+            self.sizes[self.sizes.index(old_size)] = new_size
+        return True
+    
+    def changes(self) -> List[Tuple[Dict[str, Any], int, int]]:
+        """Изменения счетчиков для InventoryIndex.apply"""
+        return [(self.skus[key], self.skus[key]["qty_total"] - qty_total,
+                 self.skus[key]["qty_reserved"] - qty_reserved)
+                for key, (qty_total, qty_reserved) in self._before.items() if key in self.skus]
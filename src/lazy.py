@@ -0,0 +1,40 @@
+import threading
+from typing import Any, Callable
+
+
+class LazyInstance:
+    """
+    Глобальный объект, который создается при первом обращении
+    
+    Модули по-прежнему делают `from .storage import storage`, но импорт
+    не создает папку data/ и не пишет файлы: фабрика вызывается при первом
+    обращении к атрибуту или явно через bootstrap().
+    """
+    
+    def __init__(self, factory: Callable[[], Any], name: str):
+        object.__setattr__(self, "_lazy_factory", factory)
+        object.__setattr__(self, "_lazy_name", name)
+        object.__setattr__(self, "_lazy_lock", threading.Lock())
+        object.__setattr__(self, "_lazy_instance", None)
+    
+    def _lazy_get(self) -> Any:
+        """Созданный объект (создается при первом вызове)"""
+        instance = self._lazy_instance
+        if instance is None:
+            with self._lazy_lock:
+                instance = self._lazy_instance
+                if instance is None:
+                    instance = self._lazy_factory()
+                    object.__setattr__(self, "_lazy_instance", instance)
+        return instance
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._lazy_get(), name)
+    
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._lazy_get(), name, value)
+    
+    def __repr__(self) -> str:
+        if self._lazy_instance is None:
+            return f"<{self._lazy_name}: не создан>"
+        return repr(self._lazy_instance)
@@ -0,0 +1,68 @@
+import logging
+from typing import Dict, Any, Optional
+from .storage import JSONStorage, _copy_json
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStorage(JSONStorage):
+    """
+    Хранилище в памяти процесса (DATABASE_URL=memory://)
+    
+    Документы живут только в словаре и не пишутся на диск - для нагрузочных
+    тестов и проверок без файлового ввода-вывода. Как и кеш JSONStorage,
+    сохраненные документы никогда не изменяются на месте: запись заменяет
+    объект целиком, поэтому view() и snapshot() работают без копирования.
+    """
+    
+    def __init__(self):
+        self._documents: Dict[str, Any] = {}
+        super().__init__("memory://", process_locks=False, write_behind=False)
+    
+    # === ИНИЦИАЛИЗАЦИЯ ===
+    
+    def _ensure_data_dir(self):
+        pass
+    
+    def _init_users_layout(self, users_layout: Optional[str]):
+        """Пользователи хранятся одним документом"""
+        self.users_layout = "file"
+        self._user_ids = None
+    
+    def _init_data_files(self):
+        for filename, default_data in self._default_files().items():
+            if filename != "orders.json":
+                self._documents[filename] = default_data
+    
+    def _init_order_journal(self):
+        from .order_journal import MemoryOrderJournal
+        self._order_journal = MemoryOrderJournal()
+    
+    def _record_codec(self):
+        """Формат файлов не используется"""
+        pass
+    
+    # === ДОКУМЕНТЫ ===
+    
+    def _load_cached(self, filename: str) -> Any:
+        self._stats.count_read(filename)
+        if filename == "orders.json":
+            return self._order_journal.orders()
+        with self._cache_lock:
+            data = self._documents.get(filename)
+        return data if data is not None else self._default_data(filename)
+    
+    def _write_file(self, filename: str, data: Any) -> bool:
+        self._stats.count_write(filename)
+        if filename == "orders.json":
+            self._order_journal.replace(data)
+            self._bump_version()
+            return True
+        with self._cache_lock:
+            self._documents[filename] = _copy_json(data)
+            self._version += 1
+        return True
+    
+    def invalidate_cache(self, filename: Optional[str] = None):
+        """Кеш не используется: документы и так в памяти"""
+        pass
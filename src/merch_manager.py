@@ -1,6 +1,8 @@
 import logging
 from typing import Dict, List, Optional, Tuple
 from .storage import storage
+from .lazy import LazyInstance
+from .inventory import sku_key
 
 logger = logging.getLogger(__name__)
 
@@ -14,23 +16,33 @@ class MerchManager:
     def _init_default_merch(self):
         """Инициализация базовых значений мерча"""
         # Проверяем, есть ли уже данные
-        if not storage.exists("merch_types.json", "types"):
+        if "types" not in storage.view("merch_types.json"):
             default_types = ["футболки", "толстовки", "лонгсливы"]
-            storage.set("merch_types.json", "types", default_types)
+            self._set_list("merch_types.json", "types", default_types)
         
-        if not storage.exists("merch_colors.json", "colors"):
+        if "colors" not in storage.view("merch_colors.json"):
             default_colors = ["белый", "черный", "серый"]
-            storage.set("merch_colors.json", "colors", default_colors)
+            self._set_list("merch_colors.json", "colors", default_colors)
         
-        if not storage.exists("merch_sizes.json", "sizes"):
+        if "sizes" not in storage.view("merch_sizes.json"):
             default_sizes = ["3XS", "2XS", "XS", "S", "M", "L", "XL", "2XL", "3XL", "4XL", "5XL", "6XL", "7XL", "8XL", "9XL", "10XL"]
-            storage.set("merch_sizes.json", "sizes", default_sizes)
+            self._set_list("merch_sizes.json", "sizes", default_sizes)
+    
+    @staticmethod
+    def _get_list(filename: str, key: str) -> List[str]:
+        """Список из справочника (merch_types.json и т.п.)"""
+        return list(storage.view(filename).get(key, []))
+    
+    @staticmethod
+    def _set_list(filename: str, key: str, values: List[str]):
+        with storage.edit(filename) as document:
+            document[key] = values
     
     # === УПРАВЛЕНИЕ ВИДАМИ МЕРЧА ===
     
     def get_merch_types(self) -> List[str]:
         """Получить список всех видов мерча"""
-        return storage.get("merch_types.json", "types") or []
+        return self._get_list("merch_types.json", "types")
     
     def add_merch_type(self, merch_type: str) -> bool:
         """Добавить новый вид мерча"""
@@ -40,7 +52,7 @@ class MerchManager:
                 return False  # Уже существует
             
             types.append(merch_type)
-            storage.set("merch_types.json", "types", types)
+            self._set_list("merch_types.json", "types", types)
             logger.info(f"Добавлен новый вид мерча: {merch_type}")
             return True
         except Exception as e:
@@ -55,7 +67,7 @@ class MerchManager:
                 return False
             
             types.remove(merch_type)
-            storage.set("merch_types.json", "types", types)
+            self._set_list("merch_types.json", "types", types)
             
             # Удаляем все связанные остатки
             self._remove_merch_type_inventory(merch_type)
@@ -78,7 +90,7 @@ class MerchManager:
             
             # Обновляем список типов
             types[types.index(old_name)] = new_name
-            storage.set("merch_types.json", "types", types)
+            self._set_list("merch_types.json", "types", types)
             
             # Обновляем инвентарь
             self._rename_merch_type_inventory(old_name, new_name)
@@ -93,7 +105,7 @@ class MerchManager:
     
     def get_colors(self) -> List[str]:
         """Получить список всех цветов"""
-        return storage.get("merch_colors.json", "colors") or []
+        return self._get_list("merch_colors.json", "colors")
     
     def add_color(self, color: str) -> bool:
         """Добавить новый цвет"""
@@ -103,7 +115,7 @@ class MerchManager:
                 return False
             
             colors.append(color)
-            storage.set("merch_colors.json", "colors", colors)
+            self._set_list("merch_colors.json", "colors", colors)
             logger.info(f"Добавлен новый цвет: {color}")
             return True
         except Exception as e:
@@ -118,7 +130,7 @@ class MerchManager:
                 return False
             
             colors.remove(color)
-            storage.set("merch_colors.json", "colors", colors)
+            self._set_list("merch_colors.json", "colors", colors)
             
             # Удаляем все связанные остатки
             self._remove_color_inventory(color)
@@ -140,7 +152,7 @@ class MerchManager:
                 return False
             
             colors[colors.index(old_name)] = new_name
-            storage.set("merch_colors.json", "colors", colors)
+            self._set_list("merch_colors.json", "colors", colors)
             
             # Обновляем инвентарь
             self._rename_color_inventory(old_name, new_name)
@@ -155,7 +167,7 @@ class MerchManager:
     
     def get_sizes(self) -> List[str]:
         """Получить список всех размеров"""
-        return storage.get("merch_sizes.json", "sizes") or []
+        return self._get_list("merch_sizes.json", "sizes")
     
     def add_size(self, size: str) -> bool:
         """Добавить новый размер"""
@@ -165,7 +177,7 @@ class MerchManager:
                 return False
             
             sizes.append(size)
-            storage.set("merch_sizes.json", "sizes", sizes)
+            self._set_list("merch_sizes.json", "sizes", sizes)
             logger.info(f"Добавлен новый размер: {size}")
             return True
         except Exception as e:
@@ -180,7 +192,7 @@ class MerchManager:
                 return False
             
             sizes.remove(size)
-            storage.set("merch_sizes.json", "sizes", sizes)
+            self._set_list("merch_sizes.json", "sizes", sizes)
             
             # Удаляем все связанные остатки
             self._remove_size_inventory(size)
@@ -202,7 +214,7 @@ class MerchManager:
                 return False
             
             sizes[sizes.index(old_name)] = new_name
-            storage.set("merch_sizes.json", "sizes", sizes)
+            self._set_list("merch_sizes.json", "sizes", sizes)
             
             # Обновляем инвентарь
             self._rename_size_inventory(old_name, new_name)
@@ -213,141 +225,61 @@ class MerchManager:
             logger.error(f"Ошибка переименования размера: {e}")
             return False
     
-    # === УПРАВЛЕНИЕ ОСТАТКАМИ ===
+    # === УПРАВЛЕНИЕ ОСТАТКАМИ (таблица SKU хранилища) ===
     
     def get_inventory_key(self, merch_type: str, color: str, size: str) -> str:
         """Создать ключ для инвентаря"""
-        return f"{merch_type}_{color}_{size}"
+        return sku_key(merch_type, color, size)
     
     def set_stock(self, merch_type: str, color: str, size: str, quantity: int) -> bool:
         """Установить остаток по конкретному виду/цвету/размеру"""
-        try:
-            key = self.get_inventory_key(merch_type, color, size)
-            inventory = storage.get_all("inventory.json")
-            
-            inventory[key] = {
-                "merch_type": merch_type,
-                "color": color,
-                "size": size,
-                "qty_total": max(0, quantity),
-                "qty_reserved": 0,
-                "qty_available": max(0, quantity)
-            }
-            
-            storage._write_file("inventory.json", inventory)
-            logger.info(f"Установлен остаток {merch_type} {color} {size}: {quantity}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка установки остатка: {e}")
+        if not storage.set_stock(merch_type, color, size, quantity):
+            logger.error(f"Ошибка установки остатка {merch_type} {color} {size}")
             return False
+        logger.info(f"Установлен остаток {merch_type} {color} {size}: {quantity}")
+        return True
     
     def increase_stock(self, merch_type: str, color: str, size: str, quantity: int) -> bool:
         """Увеличить остаток (при поступлении)"""
-        try:
-            key = self.get_inventory_key(merch_type, color, size)
-            inventory = storage.get_all("inventory.json")
-            
-            if key in inventory:
-                inventory[key]["qty_total"] += quantity
-                inventory[key]["qty_available"] = inventory[key]["qty_total"] - inventory[key]["qty_reserved"]
-            else:
-                inventory[key] = {
-                    "merch_type": merch_type,
-                    "color": color,
-                    "size": size,
-                    "qty_total": quantity,
-                    "qty_reserved": 0,
-                    "qty_available": quantity
-                }
-            
-            storage._write_file("inventory.json", inventory)
-            logger.info(f"Увеличен остаток {merch_type} {color} {size} на {quantity}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка увеличения остатка: {e}")
+        if not storage.adjust_stock(merch_type, color, size, delta_total=quantity):
             return False
+        logger.info(f"Увеличен остаток {merch_type} {color} {size} на {quantity}")
+        return True
     
     def decrease_stock(self, merch_type: str, color: str, size: str, quantity: int) -> bool:
         """Уменьшить остаток (при продаже/списании)"""
-        try:
-            key = self.get_inventory_key(merch_type, color, size)
-            inventory = storage.get_all("inventory.json")
-            
-            if key not in inventory:
-                return False
-            
-            current_stock = inventory[key]["qty_available"]
-            if current_stock < quantity:
-                return False
-            
-            inventory[key]["qty_total"] -= quantity
-            inventory[key]["qty_available"] = inventory[key]["qty_total"] - inventory[key]["qty_reserved"]
-            
-            storage._write_file("inventory.json", inventory)
-            logger.info(f"Уменьшен остаток {merch_type} {color} {size} на {quantity}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка уменьшения остатка: {e}")
+        if not storage.adjust_stock(merch_type, color, size, delta_total=-quantity):
             return False
+        logger.info(f"Уменьшен остаток {merch_type} {color} {size} на {quantity}")
+        return True
     
     def reserve_stock(self, merch_type: str, color: str, size: str, quantity: int) -> bool:
         """Зарезервировать товар (при оформлении заказа)"""
-        try:
-            key = self.get_inventory_key(merch_type, color, size)
-            inventory = storage.get_all("inventory.json")
-            
-            if key not in inventory:
-                return False
-            
-            if inventory[key]["qty_available"] < quantity:
-                return False
-            
-            inventory[key]["qty_reserved"] += quantity
-            inventory[key]["qty_available"] = inventory[key]["qty_total"] - inventory[key]["qty_reserved"]
-            
-            storage._write_file("inventory.json", inventory)
-            logger.info(f"Зарезервировано {merch_type} {color} {size}: {quantity}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка резервирования: {e}")
+        if not storage.try_reserve(sku_key(merch_type, color, size), quantity):
             return False
+        logger.info(f"Зарезервировано {merch_type} {color} {size}: {quantity}")
+        return True
     
     def release_reserved_stock(self, merch_type: str, color: str, size: str, quantity: int) -> bool:
         """Освободить зарезервированный товар"""
-        try:
-            key = self.get_inventory_key(merch_type, color, size)
-            inventory = storage.get_all("inventory.json")
-            
-            if key not in inventory:
-                return False
-            
-            if inventory[key]["qty_reserved"] < quantity:
-                return False
-            
-            inventory[key]["qty_reserved"] -= quantity
-            inventory[key]["qty_available"] = inventory[key]["qty_total"] - inventory[key]["qty_reserved"]
-            
-            storage._write_file("inventory.json", inventory)
-            logger.info(f"Освобождено резервирование {merch_type} {color} {size}: {quantity}")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка освобождения резервирования: {e}")
+        if not storage.try_release(sku_key(merch_type, color, size), quantity):
             return False
+        logger.info(f"Освобождено резервирование {merch_type} {color} {size}: {quantity}")
+        return True
     
     def get_stock(self, merch_type: str, color: str, size: str) -> Optional[Dict]:
         """Получить информацию об остатках"""
         try:
-            key = self.get_inventory_key(merch_type, color, size)
-            inventory = storage.get_all("inventory.json")
-            return inventory.get(key)
+            return storage.get_stock(merch_type, color, size)
         except Exception as e:
             logger.error(f"Ошибка получения остатка: {e}")
             return None
     
     def get_all_stocks(self) -> Dict[str, Dict]:
-        """Получить все остатки"""
+        """Получить все остатки: ключ SKU -> остаток"""
         try:
-            return storage.get_all("inventory.json")
+            return {self.get_inventory_key(item["type"], item["color"], item["size"]): item
+                    for item in storage.list_stock()}
         except Exception as e:
             logger.error(f"Ошибка получения всех остатков: {e}")
             return {}
@@ -364,7 +296,7 @@ class MerchManager:
             # Группируем по типу мерча
             merch_groups = {}
             for key, item in inventory.items():
-                merch_type = item.get("merch_type", "Неизвестно")
+                merch_type = item.get("type") or "Неизвестно"
                 if merch_type not in merch_groups:
                     merch_groups[merch_type] = []
                 merch_groups[merch_type].append(item)
@@ -417,96 +349,27 @@ class MerchManager:
     
     def _remove_merch_type_inventory(self, merch_type: str):
         """Удалить все остатки по типу мерча"""
-        try:
-            inventory = storage.get_all("inventory.json")
-            keys_to_remove = [key for key, item in inventory.items() 
-                             if item.get("merch_type") == merch_type]
-            
-            for key in keys_to_remove:
-                del inventory[key]
-            
-            storage._write_file("inventory.json", inventory)
-        except Exception as e:
-            logger.error(f"Ошибка удаления остатков типа мерча: {e}")
+        storage.remove_stock(product_type=merch_type)
     
     def _remove_color_inventory(self, color: str):
         """Удалить все остатки по цвету"""
-        try:
-            inventory = storage.get_all("inventory.json")
-            keys_to_remove = [key for key, item in inventory.items() 
-                             if item.get("color") == color]
-            
-            for key in keys_to_remove:
-                del inventory[key]
-            
-            storage._write_file("inventory.json", inventory)
-        except Exception as e:
-            logger.error(f"Ошибка удаления остатков цвета: {e}")
+        storage.remove_stock(color=color)
     
     def _remove_size_inventory(self, size: str):
-        """Удалить все остатки по размеру"""
-        try:
-            inventory = storage.get_all("inventory.json")
-            keys_to_remove = [key for key, item in inventory.items() 
-                             if item.get("size") == size]
-            
-            for key in keys_to_remove:
-                del inventory[key]
-            
-            storage._write_file("inventory.json", inventory)
-        except Exception as e:
-            logger.error(f"Ошибка удаления остатков размера: {e}")
+        """Удалить размер из списка размеров вместе с его остатками"""
+        storage.remove_size(size)
     
     def _rename_merch_type_inventory(self, old_name: str, new_name: str):
         """Переименовать тип мерча в инвентаре"""
-        try:
-            inventory = storage.get_all("inventory.json")
-            for key, item in inventory.items():
-                if item.get("merch_type") == old_name:
-                    item["merch_type"] = new_name
-                    # Обновляем ключ
-                    new_key = self.get_inventory_key(new_name, item.get("color"), item.get("size"))
-                    if new_key != key:
-                        inventory[new_key] = item
-                        del inventory[key]
-            
-            storage._write_file("inventory.json", inventory)
-        except Exception as e:
-            logger.error(f"Ошибка переименования типа мерча в инвентаре: {e}")
+        storage.rename_stock("type", old_name, new_name)
     
     def _rename_color_inventory(self, old_name: str, new_name: str):
         """Переименовать цвет в инвентаре"""
-        try:
-            inventory = storage.get_all("inventory.json")
-            for key, item in inventory.items():
-                if item.get("color") == old_name:
-                    item["color"] = new_name
-                    # Обновляем ключ
-                    new_key = self.get_inventory_key(item.get("merch_type"), new_name, item.get("size"))
-                    if new_key != key:
-                        inventory[new_key] = item
-                        del inventory[key]
-            
-            storage._write_file("inventory.json", inventory)
-        except Exception as e:
-            logger.error(f"Ошибка переименования цвета в инвентаре: {e}")
+        storage.rename_stock("color", old_name, new_name)
     
     def _rename_size_inventory(self, old_name: str, new_name: str):
         """Переименовать размер в инвентаре"""
-        try:
-            inventory = storage.get_all("inventory.json")
-            for key, item in inventory.items():
-                if item.get("size") == old_name:
-                    item["size"] = new_name
-                    # Обновляем ключ
-                    new_key = self.get_inventory_key(item.get("merch_type"), item.get("color"), new_name)
-                    if new_key != key:
-                        inventory[new_key] = item
-                        del inventory[key]
-            
-            storage._write_file("inventory.json", inventory)
-        except Exception as e:
-            logger.error(f"Ошибка переименования размера в инвентаре: {e}")
+        storage.rename_stock("size", old_name, new_name)
     
     def check_availability(self, merch_type: str, color: str, size: str, quantity: int = 1) -> bool:
         """Проверить доступность товара"""
@@ -533,4 +396,4 @@ class MerchManager:
 
 
 # Создаем глобальный экземпляр менеджера
-merch_manager = MerchManager()
+merch_manager = LazyInstance(MerchManager, "merch_manager")
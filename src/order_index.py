@@ -0,0 +1,101 @@
+import bisect
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Union
+
+# Ключ сортировки заказа: (created_at, id) — порядок по времени создания
+OrderKey = Tuple[str, int]
+
+
+def _time_bound(value: Union[str, datetime]) -> str:
+    """Граница интервала в формате created_at (ISO строка)"""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class OrderIndex:
+    """
+    Вторичные индексы заказов: по пользователю, статусу, чату и времени
+    
+    Каждый индекс хранит отсортированный по времени создания список ключей
+    (created_at, id) и обновляется точечно при создании заказа, доставке
+    и смене статуса, поэтому выборки не требуют обхода всех заказов.
+    """
+    
+    def __init__(self):
+        self._by_time: List[OrderKey] = []
+        self._by_user: Dict[str, List[OrderKey]] = {}
+        self._by_status: Dict[str, List[OrderKey]] = {}
+        self._by_chat: Dict[str, List[OrderKey]] = {}
+    
+    @staticmethod
+    def key(order: Dict[str, Any]) -> OrderKey:
+        """Ключ заказа в индексах"""
+        return (order.get("created_at") or "", order.get("id"))
+    
+    @staticmethod
+    def _insert(index: Dict[str, List[OrderKey]], value: str, key: OrderKey):
+        keys = index.setdefault(value, [])
+        if not keys or keys[-1] < key:
+            # Обычный случай: новый заказ позже всех остальных
+            keys.append(key)
+        else:
+            position = bisect.bisect_left(keys, key)
+            if position == len(keys) or keys[position] != key:
+                keys.insert(position, key)
+    
+    @staticmethod
+    def _remove(index: Dict[str, List[OrderKey]], value: str, key: OrderKey):
+        keys = index.get(value)
+        if not keys:
+            return
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+        if not keys:
+            del index[value]
+    
+    # === ОБНОВЛЕНИЕ ===
+    
+    def add(self, order: Dict[str, Any]):
+        """Проиндексировать новый заказ"""
+        key = self.key(order)
+        if not self._by_time or self._by_time[-1] < key:
+            self._by_time.append(key)
+        else:
+            bisect.insort(self._by_time, key)
+        self._insert(self._by_user, str(order.get("user_tg_id")), key)
+        self._insert(self._by_status, order.get("status", "pending"), key)
+        for delivery in order.get("deliveries", []):
+            self._insert(self._by_chat, str(delivery.get("chat_id")), key)
+    
+    def change_status(self, order: Dict[str, Any], old_status: str, new_status: str):
+        """Перенести заказ в индексе статусов"""
+        if old_status == new_status:
+            return
+        key = self.key(order)
+        self._remove(self._by_status, old_status, key)
+        self._insert(self._by_status, new_status, key)
+    
+    def add_delivery(self, order: Dict[str, Any], chat_id: str):
+        """Проиндексировать доставку заказа в чат"""
+        self._insert(self._by_chat, str(chat_id), self.key(order))
+    
+    # === ВЫБОРКИ (возвращают ID заказов по времени создания) ===
+    
+    def by_user(self, user_tg_id: Union[str, int]) -> List[int]:
+        return [order_id for _, order_id in self._by_user.get(str(user_tg_id), [])]
+    
+    def by_status(self, status: str) -> List[int]:
+        return [order_id for _, order_id in self._by_status.get(status, [])]
+    
+    def by_chat(self, chat_id: Union[str, int]) -> List[int]:
+        return [order_id for _, order_id in self._by_chat.get(str(chat_id), [])]
+    
+    def between(self, t0: Union[str, datetime], t1: Union[str, datetime]) -> List[int]:
+        """Заказы с t0 <= created_at < t1"""
+        start = bisect.bisect_left(self._by_time, (_time_bound(t0),))
+        end = bisect.bisect_left(self._by_time, (_time_bound(t1),))
+        return [order_id for _, order_id in self._by_time[start:end]]
+    
+    def status_counts(self) -> Dict[str, int]:
+        """Количество заказов по статусам"""
+        return {status: len(keys) for status, keys in self._by_status.items()}
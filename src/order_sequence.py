@@ -0,0 +1,44 @@
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class OrderIdSequence:
+    """
+    Потокобезопасный генератор ID заказов с арендой блоков
+    
+    В хранилище сохраняется только верхняя граница выданного блока
+    (high-water mark). ID внутри блока выдаются из памяти без записи на диск,
+    поэтому meta.json переписывается один раз на block_size заказов.
+    После перезапуска неиспользованный остаток блока пропускается.
+    """
+    
+    def __init__(self, load_high_water: Callable[[], int], save_high_water: Callable[[int], bool],
+                 block_size: int = 100):
+        self._load_high_water = load_high_water
+        self._save_high_water = save_high_water
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._limit = 0
+    
+    def next_id(self) -> int:
+        """Выдать следующий ID"""
+        with self._lock:
+            if self._next >= self._limit:
+                self._lease_block()
+            value = self._next
+            self._next += 1
+            return value
+    
+    def _lease_block(self):
+        """Арендовать новый блок ID, сохранив его верхнюю границу"""
+        start = max(self._next, self._load_high_water())
+        limit = start + self.block_size
+        if not self._save_high_water(limit):
+            raise RuntimeError("Не удалось сохранить границу последовательности ID заказов")
+        self._next = start
+        self._limit = limit
+        logger.info(f"Арендован блок ID заказов {start}..{limit - 1}")
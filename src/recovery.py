@@ -0,0 +1,145 @@
+import os
+import gzip
+import time
+import logging
+from typing import Dict, List, Optional
+
+from .storage import fsync_dir
+from .storage_codec import decode
+
+logger = logging.getLogger(__name__)
+
+# Временные файлы моложе этого возраста может дописывать другой процесс
+STALE_TMP_SECONDS = 60
+
+
+def is_complete(raw: bytes, compressed: bool = False, full: bool = False) -> bool:
+    """
+    Файл данных записан целиком
+    
+    Для JSON достаточно проверить, что файл не пустой и заканчивается
+    на } или ] - оборванная запись дает пустой или обрезанный файл.
+    Сжатые файлы, msgpack и проверка с full=True разбирают файл целиком.
+    """
+    try:
+        if compressed:
+            raw = gzip.decompress(raw)
+        stripped = raw.strip()
+        if not stripped:
+            return False
+        if not full and stripped[:1] in (b"{", b"["):
+            return stripped[-1:] in (b"}", b"]")
+        decode(raw)
+        return True
+    except (OSError, EOFError, ValueError):
+        return False
+
+
+def _check_file(path: str) -> bool:
+    """Проверка файла с диска (для JSON читаются только начало и конец)"""
+    compressed = path.endswith(".gz")
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            if compressed or size <= 64:
+                return is_complete(f.read(), compressed)
+            head = f.read(1)
+            if head not in (b"{", b"["):
+                f.seek(0)
+                return is_complete(f.read())
+            f.seek(-64, os.SEEK_END)
+            return is_complete(head + f.read())
+    except OSError:
+        return False
+
+
+def _restore_from_backup(data_dir: str, relpath: str, backup_dir: Optional[str]) -> Optional[str]:
+    """Записать последнюю версию файла из резервных копий, которая разбирается целиком"""
+    if not backup_dir or not os.path.isdir(backup_dir):
+        return None
+    from .backup import BackupStore
+    path = os.path.join(data_dir, relpath)
+    for name, data in BackupStore(data_dir, backup_dir).file_versions(relpath):
+        if not is_complete(data, path.endswith(".gz"), full=True):
+            continue
+        tmp_path = path + ".recovered.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        fsync_dir(os.path.dirname(path))
+        return name
+    return None
+
+
+def recover_file(data_dir: str, relpath: str, backup_dir: Optional[str] = None) -> Optional[str]:
+    """
+    Восстановить поврежденный файл данных
+    
+    Файл заменяется последней целой версией из резервных копий, а если
+    ее нет - переименовывается в <файл>.corrupt (не удаляется и не
+    подменяется молча пустым). Возвращает "restored", "quarantined"
+    или None, если файла уже нет (его восстановил другой поток).
+    """
+    path = os.path.join(data_dir, relpath)
+    try:
+        backup_name = _restore_from_backup(data_dir, relpath, backup_dir)
+        if backup_name is not None:
+            logger.warning(f"Файл {relpath} поврежден, восстановлен из резервной копии {backup_name}")
+            return "restored"
+        os.replace(path, path + ".corrupt")
+    except FileNotFoundError:
+        return None
+    fsync_dir(os.path.dirname(path))
+    logger.error(f"Файл {relpath} поврежден и нет резервной копии: сохранен как "
+                 f"{relpath}.corrupt, будут использованы данные по умолчанию")
+    return "quarantined"
+
+
+def recover_data_dir(data_dir: str, backup_dir: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Проход восстановления при запуске
+    
+    1. Удаляет временные файлы *.tmp, оставшиеся от прерванной записи
+       (по именам, сами файлы данных не открываются).
+    2. Проверяет документы верхнего уровня папки данных по началу и концу
+       файла, оборванный документ восстанавливается через recover_file.
+    
+    Файлы пользователей (users/) и сегменты заказов не проверяются, чтобы
+    запуск не зависел от их числа: хранилище восстанавливает файл, когда
+    его не удается разобрать при чтении.
+    """
+    report: Dict[str, List[str]] = {"removed_tmp": [], "restored": [], "quarantined": []}
+    if not os.path.isdir(data_dir):
+        return report
+    
+    now = time.time()
+    skip_dir = os.path.realpath(backup_dir) if backup_dir else None
+    for directory, subdirs, names in os.walk(data_dir):
+        # Манифесты резервных копий внутри папки данных - не файлы данных
+        subdirs[:] = [name for name in subdirs if os.path.realpath(os.path.join(directory, name)) != skip_dir]
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            relpath = os.path.relpath(path, data_dir)
+            
+            if name.endswith(".tmp"):
+                try:
+                    if now - os.path.getmtime(path) >= STALE_TMP_SECONDS:
+                        os.remove(path)
+                        report["removed_tmp"].append(relpath)
+                except OSError:
+                    pass
+                continue
+            
+            if directory != data_dir or not (name.endswith(".json") or name.endswith(".json.gz")):
+                continue
+            if _check_file(path):
+                continue
+            result = recover_file(data_dir, relpath, backup_dir)
+            if result is not None:
+                report[result].append(relpath)
+    
+    if report["removed_tmp"]:
+        logger.info(f"Удалено временных файлов прерванной записи: {len(report['removed_tmp'])}")
+    return report
@@ -0,0 +1,818 @@
+import json
+import os
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Union
+from datetime import datetime
+from .storage import JSONStorage, StorageError, StorageSnapshot, SNAPSHOT_DOCUMENTS, load_json, _copy_json, _freeze
+from .inventory import INVENTORY_FILE, AvailabilityMatrix, InventoryIndex, StockDraft, migrate_inventory
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    tg_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id TEXT PRIMARY KEY,
+    prefix TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chats_prefix ON chats(prefix);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    user_tg_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_tg_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at);
+
+CREATE TABLE IF NOT EXISTS order_deliveries (
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    chat_id TEXT NOT NULL,
+    prefix TEXT,
+    message_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_order ON order_deliveries(order_id);
+CREATE INDEX IF NOT EXISTS idx_deliveries_chat ON order_deliveries(chat_id);
+
+CREATE TABLE IF NOT EXISTS skus (
+    type TEXT NOT NULL,
+    color TEXT NOT NULL,
+    size TEXT NOT NULL,
+    qty_total INTEGER NOT NULL DEFAULT 0,
+    qty_reserved INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (type, color, size)
+);
+CREATE INDEX IF NOT EXISTS idx_skus_size_color ON skus(size, color);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+def sqlite_path_from_url(database_url: str, data_dir: str = "data") -> str:
+    """
+    Путь к файлу БД из DATABASE_URL
+    
+    sqlite:///bot.db -> <data_dir>/bot.db (относительные пути кладем в папку данных,
+    чтобы база попадала в примонтированный volume), sqlite:////abs/bot.db -> /abs/bot.db
+    """
+    path = database_url[len("sqlite://"):]
+    if path.startswith("/"):
+        path = path[1:]
+    if not path:
+        path = "bot.db"
+    if path == ":memory:" or os.path.isabs(path):
+        return path
+    return os.path.join(data_dir, path)
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+class SQLiteStorage(JSONStorage):
+    """
+    Хранилище на SQLite с тем же публичным API, что и JSONStorage
+    
+    Пользователи, чаты, заказы, остатки и meta лежат в отдельных таблицах,
+    поэтому create_order, inc_total_orders, reserve и т.п. меняют одну строку
+    вместо перезаписи всего файла. Остальные документы (settings.json,
+    chat_messages.json, ...) хранятся целиком в таблице documents.
+    """
+    
+    def __init__(self, db_path: str, data_dir: str = "data"):
+        self.db_path = db_path
+        self._db_lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Матрица доступности и (версия, PRAGMA data_version), для которых она построена
+        self._availability_cache: Optional[Tuple[Tuple[int, int], AvailabilityMatrix]] = None
+        super().__init__(data_dir)
+    
+    # === ПОДКЛЮЧЕНИЕ И СХЕМА ===
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть соединение с БД (одно на процесс, доступ под блокировкой)"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+    
+    @contextmanager
+    def _transaction(self):
+        """Транзакция записи (BEGIN IMMEDIATE ... COMMIT/ROLLBACK)"""
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self._version += 1
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        """Выполнить запрос на чтение"""
+        with self._db_lock:
+            return self._connect().execute(sql, params).fetchall()
+    
+    def _init_data_files(self):
+        """Создание схемы, разовый импорт JSON и базовые данные"""
+        self._connect()
+        if not self._get_meta("json_imported_at"):
+            self.import_json_dir(self.data_dir)
+        
+        for filename, default_data in self._default_files().items():
+            if self._is_empty(filename):
+                self._write_file(filename, default_data)
+                logger.info(f"Заполнена таблица для {filename}")
+    
+    def _is_empty(self, filename: str) -> bool:
+        """Нет ли данных для файла в БД"""
+        tables = {
+            "users.json": "users",
+            "chats.json": "chats",
+            "orders.json": "orders",
+            "inventory.json": "skus",
+            "meta.json": "meta"
+        }
+        if filename in tables:
+            if self._query(f"SELECT 1 FROM {tables[filename]} LIMIT 1"):
+                return False
+            if filename != "inventory.json":
+                return True
+        return not self._query("SELECT 1 FROM documents WHERE name = ?", (filename,))
+    
+    def _init_users_layout(self, users_layout: Optional[str]):
+        """Пользователи хранятся в таблице users"""
+        self.users_layout = "file"
+        self._user_ids = None
+    
+    def _record_codec(self):
+        """Формат файлов не используется: данные лежат в таблицах"""
+    
+    def _init_stock_counters(self):
+        """Резерв меняется одним UPDATE под блокировкой БД, счетчики в памяти не нужны"""
+        self._stock_counters = None
+    
+    def _init_order_journal(self):
+        """Заказы хранятся в таблице orders, журнал не нужен"""
+        self._order_journal = None
+    
+    def import_json_dir(self, json_dir: str) -> int:
+        """
+        Разовый импорт существующих data/*.json в БД
+        
+        Пользователи sharded раскладки (data/users/) импортируются вместе
+        с users.json. Возвращает количество импортированных документов.
+        """
+        imported = 0
+        with self._transaction() as conn:
+            if os.path.isdir(json_dir):
+                for filename in sorted(os.listdir(json_dir)):
+                    if not filename.endswith(".json"):
+                        continue
+                    data = load_json(os.path.join(json_dir, filename), None)
+                    if data is None:
+                        continue
+                    if filename == "orders.json":
+                        # Заказы берем вместе с сегментами и журналом ниже
+                        continue
+                    self._write_document(conn, filename, data)
+                    imported += 1
+                    logger.info(f"Импортирован {filename} в SQLite")
+                
+                users = self._read_json_sharded_users(json_dir)
+                if users:
+                    for tg_id, user in users.items():
+                        conn.execute(
+                            "INSERT INTO users (tg_id, data) VALUES (?, ?) "
+                            "ON CONFLICT(tg_id) DO UPDATE SET data = excluded.data",
+                            (tg_id, _dumps(user))
+                        )
+                    imported += 1
+                    logger.info(f"Импортировано пользователей из users/ в SQLite: {len(users)}")
+                
+                orders = self._read_json_orders(json_dir)
+                if orders:
+                    self._write_document(conn, "orders.json", orders)
+                    imported += 1
+                    logger.info(f"Импортировано заказов в SQLite: {len(orders)}")
+            self._set_meta(conn, "json_imported_at", datetime.now().isoformat())
+        return imported
+    
+    @staticmethod
+    def _read_json_sharded_users(json_dir: str) -> Dict[str, Any]:
+        """Пользователи sharded раскладки: users/<2 цифры ID>/<tg_id>.json"""
+        users = {}
+        users_dir = os.path.join(json_dir, "users")
+        if not os.path.isdir(users_dir):
+            return users
+        for shard in sorted(os.listdir(users_dir)):
+            shard_dir = os.path.join(users_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for filename in sorted(os.listdir(shard_dir)):
+                if not filename.endswith(".json"):
+                    continue
+                user = load_json(os.path.join(shard_dir, filename), None)
+                if user is not None:
+                    users[filename[:-len(".json")]] = user
+        return users
+    
+    @staticmethod
+    def _read_json_orders(json_dir: str) -> List[Dict[str, Any]]:
+        """Все заказы JSON хранилища: orders.json, сегменты и несжатый журнал"""
+        from .order_journal import OrderJournal
+        journal = OrderJournal(
+            os.path.join(json_dir, "orders.json"),
+            os.path.join(json_dir, "orders.journal.jsonl"),
+            segments_dir=os.path.join(json_dir, "orders")
+        )
+        return journal.orders()
+    
+    # === ЧТЕНИЕ / ЗАПИСЬ ДОКУМЕНТОВ ЦЕЛИКОМ (совместимость) ===
+    
+    def _load_cached(self, filename: str) -> Any:
+        """Собрать документ из таблиц (SQLite сам кеширует страницы)"""
+        return self._read_file(filename)
+    
+    def view(self, filename: str) -> Any:
+        """Документ только для чтения (собирается из таблиц при каждом вызове)"""
+        return _freeze(self._read_file(filename))
+    
+    def _read_file(self, filename: str) -> Any:
+        """Собрать документ в формате JSON файла"""
+        started = time.perf_counter()
+        data = self._read_document(filename)
+        # Документ собирается из строк таблиц - размер в байтах не считается
+        self._stats.count_read(filename)
+        self._stats.record_parse(filename, 0, time.perf_counter() - started)
+        return data
+    
+    def _read_document(self, filename: str) -> Any:
+        if filename == "users.json":
+            return {row["tg_id"]: json.loads(row["data"])
+                    for row in self._query("SELECT tg_id, data FROM users ORDER BY rowid")}
+        if filename == "chats.json":
+            return [json.loads(row["data"]) for row in self._query("SELECT data FROM chats ORDER BY rowid")]
+        if filename == "orders.json":
+            return self._select_orders("", ())
+        if filename == "inventory.json":
+            return self._read_inventory()
+        if filename == "meta.json":
+            return {row["key"]: json.loads(row["value"]) for row in self._query("SELECT key, value FROM meta")}
+        
+        rows = self._query("SELECT data FROM documents WHERE name = ?", (filename,))
+        if not rows:
+            return self._default_data(filename)
+        return json.loads(rows[0]["data"])
+    
+    def _write_file(self, filename: str, data: Any) -> bool:
+        """Заменить документ целиком"""
+        self._stats.count_write(filename)
+        started = time.perf_counter()
+        try:
+            with self._transaction() as conn:
+                self._write_document(conn, filename, data)
+            self._stats.record_serialize(filename, 0, time.perf_counter() - started)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка записи {filename} в SQLite: {e}")
+            return False
+    
+    @contextmanager
+    def transaction(self, filename: str):
+        """
+        Транзакция чтение-изменение-запись в одной BEGIN IMMEDIATE
+        
+        Документ читается и записывается внутри одной транзакции SQLite под
+        блокировкой БД, поэтому точечные UPDATE (reserve, release, adjust_stock)
+        этого и других процессов не теряются между чтением и записью черновика.
+        Вложенная транзакция по тому же файлу в том же потоке работает с тем же
+        черновиком. При ошибке записи поднимается StorageError.
+        """
+        drafts = getattr(self._drafts, "files", None)
+        if drafts is None:
+            drafts = self._drafts.files = {}
+        if filename in drafts:
+            yield drafts[filename]
+            return
+        
+        try:
+            with self._file_lock(filename), self._transaction() as conn:
+                original = self._read_file(filename)
+                draft = _copy_json(original)
+                drafts[filename] = draft
+                try:
+                    yield draft
+                finally:
+                    del drafts[filename]
+                if draft != original:
+                    self._stats.count_write(filename)
+                    started = time.perf_counter()
+                    self._write_document(conn, filename, draft)
+                    self._stats.record_serialize(filename, 0, time.perf_counter() - started)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи {filename} в SQLite: {e}")
+            raise StorageError(f"Не удалось записать {filename}") from e
+    
+    def _write_document(self, conn: sqlite3.Connection, filename: str, data: Any):
+        """Разложить документ по таблицам внутри открытой транзакции"""
+        if filename == "users.json":
+            conn.execute("DELETE FROM users")
+            conn.executemany("INSERT INTO users (tg_id, data) VALUES (?, ?)",
+                             [(str(tg_id), _dumps(user)) for tg_id, user in data.items()])
+        elif filename == "chats.json":
+            conn.execute("DELETE FROM chats")
+            for chat in data:
+                self._upsert_chat(conn, chat)
+        elif filename == "orders.json":
+            conn.execute("DELETE FROM order_deliveries")
+            conn.execute("DELETE FROM orders")
+            for order in data:
+                self._insert_order(conn, order)
+        elif filename == "inventory.json":
+            self._write_inventory(conn, data)
+        elif filename == "meta.json":
+            conn.execute("DELETE FROM meta")
+            for key, value in data.items():
+                self._set_meta(conn, key, value)
+        else:
+            conn.execute("INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)",
+                         (filename, _dumps(data)))
+    
+    def invalidate_cache(self, filename: Optional[str] = None):
+        """Кеш документов не используется"""
+        pass
+    
+    # === META ===
+    
+    def _get_meta(self, key: str, default: Any = None) -> Any:
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0]["value"]) if rows else default
+    
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value: Any):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, _dumps(value)))
+    
+    def _allocate_order_id(self, conn: sqlite3.Connection) -> int:
+        """Выдать ID заказа внутри открытой транзакции"""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_order_id'").fetchone()
+        next_id = json.loads(row["value"]) if row else 1
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM orders").fetchone()["max_id"]
+        next_id = max(next_id, max_id + 1)
+        self._set_meta(conn, "next_order_id", next_id + 1)
+        return next_id
+    
+    def next_order_id(self) -> int:
+        """Получение следующего ID заказа"""
+        with self._transaction() as conn:
+            return self._allocate_order_id(conn)
+    
+    # === ПОЛЬЗОВАТЕЛИ ===
+    
+    def get_or_create_user(self, tg_user) -> Dict[str, Any]:
+        """Получить или создать пользователя"""
+        tg_id = str(tg_user.id)
+        user = {
+            "username": tg_user.username or "",
+            "first_name": tg_user.first_name or "",
+            "last_name": tg_user.last_name or "",
+            "total_orders": 0,
+            "created_at": datetime.now().isoformat()
+        }
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO users (tg_id, data) VALUES (?, ?)", (tg_id, _dumps(user)))
+            row = conn.execute("SELECT data FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+        return json.loads(row["data"])
+    
+    def inc_total_orders(self, tg_id: Union[str, int]) -> int:
+        """Увеличить счетчик заказов пользователя"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "UPDATE users SET data = json_set(data, '$.total_orders', "
+                "COALESCE(json_extract(data, '$.total_orders'), 0) + 1) "
+                "WHERE tg_id = ? RETURNING json_extract(data, '$.total_orders') AS total",
+                (str(tg_id),)
+            ).fetchone()
+        return row["total"] if row else 0
+    
+    def get(self, filename: str, key: str) -> Optional[Any]:
+        """Получить значение по ключу (только для users.json)"""
+        if filename == "users.json":
+            rows = self._query("SELECT data FROM users WHERE tg_id = ?", (str(key),))
+            return json.loads(rows[0]["data"]) if rows else None
+        return None
+    
+    def set(self, filename: str, key: str, value: Any) -> bool:
+        """Установить значение по ключу (только для users.json)"""
+        if filename == "users.json":
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (tg_id, data) VALUES (?, ?) "
+                    "ON CONFLICT(tg_id) DO UPDATE SET data = excluded.data",
+                    (str(key), _dumps(value))
+                )
+            return True
+        return False
+    
+    def snapshot(self) -> StorageSnapshot:
+        """Срез всех документов, прочитанный в одной транзакции чтения"""
+        with self._snapshot_lock, self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                documents = {filename: _freeze(self._read_file(filename)) for filename in SNAPSHOT_DOCUMENTS}
+            finally:
+                conn.execute("COMMIT")
+            version = self._version
+        return StorageSnapshot(version, documents)
+    
+    # === ПАКЕТНЫЕ ОПЕРАЦИИ ===
+    
+    def get_many(self, filename: str, keys: List[Union[str, int]]) -> Dict[str, Any]:
+        """Получить несколько пользователей или чатов одним запросом"""
+        keys = [str(key) for key in keys]
+        if filename not in ("users.json", "chats.json") or not keys:
+            return super().get_many(filename, keys)
+        table, column = ("users", "tg_id") if filename == "users.json" else ("chats", "chat_id")
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self._query(f"SELECT {column} AS key, data FROM {table} WHERE {column} IN ({placeholders})",
+                           tuple(keys))
+        found = {row["key"]: json.loads(row["data"]) for row in rows}
+        return {key: found.get(key) for key in keys}
+    
+    def update_many(self, changes: Dict[str, Dict[Union[str, int], Dict[str, Any]]],
+                    replace: bool = False) -> bool:
+        """Пользователи и чаты меняются построчно в одной транзакции, остальные документы - целиком"""
+        row_changes = {filename: records for filename, records in changes.items()
+                       if filename in ("users.json", "chats.json")}
+        with self._snapshot_lock:
+            with self._transaction() as conn:
+                for filename, records in row_changes.items():
+                    for key, value in records.items():
+                        if filename == "users.json":
+                            self._update_user_row(conn, str(key), value, replace)
+                        else:
+                            self._update_chat_row(conn, str(key), value, replace)
+            
+            other_changes = {filename: records for filename, records in changes.items()
+                             if filename not in row_changes}
+            return super().update_many(other_changes, replace) if other_changes else True
+    
+    def _update_user_row(self, conn: sqlite3.Connection, tg_id: str, value: Dict[str, Any], replace: bool):
+        if not replace:
+            row = conn.execute("SELECT data FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+            if not row:
+                return
+            value = {**json.loads(row["data"]), **value}
+        conn.execute(
+            "INSERT INTO users (tg_id, data) VALUES (?, ?) "
+            "ON CONFLICT(tg_id) DO UPDATE SET data = excluded.data",
+            (tg_id, _dumps(value))
+        )
+    
+    def _update_chat_row(self, conn: sqlite3.Connection, chat_id: str, value: Dict[str, Any], replace: bool):
+        if not replace:
+            row = conn.execute("SELECT data FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            if not row:
+                return
+            value = {**json.loads(row["data"]), **value}
+        conn.execute(
+            "INSERT INTO chats (chat_id, prefix, data) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET prefix = excluded.prefix, data = excluded.data",
+            (chat_id, value.get("prefix"), _dumps(value))
+        )
+    
+    # === ЧАТЫ ===
+    
+    def _upsert_chat(self, conn: sqlite3.Connection, chat: Dict[str, Any]):
+        conn.execute(
+            "INSERT INTO chats (chat_id, prefix, data) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET prefix = excluded.prefix, data = excluded.data",
+            (str(chat.get("chat_id")), chat.get("prefix"), _dumps(chat))
+        )
+    
+    def add_chat(self, chat_data: Dict[str, Any]) -> bool:
+        """Добавить новый чат"""
+        with self._transaction() as conn:
+            self._upsert_chat(conn, chat_data)
+        return True
+    
+    def update_chat(self, chat_id: Union[str, int], updated_data: Dict[str, Any]) -> bool:
+        """Обновить существующий чат"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM chats WHERE chat_id = ?", (str(chat_id),)).fetchone()
+            if not row:
+                return False
+            chat = json.loads(row["data"])
+            chat.update(updated_data)
+            conn.execute("UPDATE chats SET prefix = ?, data = ? WHERE chat_id = ?",
+                         (chat.get("prefix"), _dumps(chat), str(chat_id)))
+        return True
+    
+    def delete_chat(self, chat_id: Union[str, int]) -> bool:
+        """Удалить чат по ID"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM chats WHERE chat_id = ?", (str(chat_id),))
+        return cursor.rowcount > 0
+    
+    def get_chat(self, chat_id: Union[str, int]) -> Optional[Dict[str, Any]]:
+        """Получить чат по ID"""
+        rows = self._query("SELECT data FROM chats WHERE chat_id = ?", (str(chat_id),))
+        return json.loads(rows[0]["data"]) if rows else None
+    
+    def get_prefix(self, chat_id: Union[str, int]) -> Optional[str]:
+        """Получить префикс чата"""
+        rows = self._query("SELECT prefix FROM chats WHERE chat_id = ?", (str(chat_id),))
+        return rows[0]["prefix"] if rows else None
+    
+    def find_chat_by_prefix(self, prefix: str, exclude_chat_id: Union[str, int, None] = None) -> Optional[Dict[str, Any]]:
+        """Найти активный чат с префиксом (кроме exclude_chat_id)"""
+        rows = self._query("SELECT chat_id, data FROM chats WHERE prefix = ? ORDER BY rowid", (prefix,))
+        for row in rows:
+            chat = json.loads(row["data"])
+            if chat.get("active", True) and (exclude_chat_id is None or row["chat_id"] != str(exclude_chat_id)):
+                return chat
+        return None
+    
+    def used_prefixes(self) -> set:
+        """Префиксы активных чатов"""
+        rows = self._query("SELECT prefix, data FROM chats WHERE prefix IS NOT NULL AND prefix != ''")
+        return {row["prefix"] for row in rows if json.loads(row["data"]).get("active", True)}
+    
+    # === ИНВЕНТАРЬ ===
+    
+    def _read_inventory(self) -> Dict[str, Any]:
+        """Собрать inventory.json из таблицы skus и документа с размерами и товарами"""
+        inventory = self._query("SELECT data FROM documents WHERE name = 'inventory.json'")
+        inventory = json.loads(inventory[0]["data"]) if inventory else {}
+        inventory["skus"] = {
+            f"{row['type']}|{row['color']}|{row['size']}": dict(row)
+            for row in self._query("SELECT type, color, size, qty_total, qty_reserved FROM skus ORDER BY rowid")
+        }
+        return inventory
+    
+    def _write_inventory(self, conn: sqlite3.Connection, inventory: Dict[str, Any]):
+        """
+        Разложить inventory.json: SKU в таблицу skus, размеры и товары в documents
+        
+        Таблица не перезаписывается целиком: текущие строки читаются в той же
+        транзакции, новые и изменившиеся SKU пишутся UPSERT'ом, пропавшие удаляются.
+        """
+        inventory = migrate_inventory(inventory)
+        current = {(row["type"], row["color"], row["size"]): (row["qty_total"], row["qty_reserved"])
+                   for row in conn.execute("SELECT type, color, size, qty_total, qty_reserved FROM skus")}
+        rows = {(sku["type"], sku["color"], sku["size"]): (sku["qty_total"], sku["qty_reserved"])
+                for sku in inventory["skus"].values()}
+        conn.executemany("DELETE FROM skus WHERE type = ? AND color = ? AND size = ?",
+                         [key for key in current if key not in rows])
+        conn.executemany(
+            "INSERT INTO skus (type, color, size, qty_total, qty_reserved) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(type, color, size) DO UPDATE SET "
+            "qty_total = excluded.qty_total, qty_reserved = excluded.qty_reserved",
+            [key + counters for key, counters in rows.items() if current.get(key) != counters]
+        )
+        rest = {key: value for key, value in inventory.items() if key != "skus"}
+        conn.execute("INSERT OR REPLACE INTO documents (name, data) VALUES ('inventory.json', ?)",
+                     (_dumps(rest),))
+    
+    @contextmanager
+    def _stock_draft(self):
+        """
+        Черновик остатков в транзакции inventory.json
+        
+        Индекс строится по документу, прочитанному в той же транзакции,
+        что и запись, - в таблице нет изменений, которых он не видит.
+        """
+        with self.transaction(INVENTORY_FILE) as inventory:
+            yield StockDraft(inventory, InventoryIndex(inventory))
+    
+    def list_sizes(self) -> List[str]:
+        """Список размеров в порядке добавления"""
+        rows = self._query("SELECT json_extract(data, '$.sizes') AS sizes FROM documents WHERE name = 'inventory.json'")
+        return json.loads(rows[0]["sizes"] or "[]") if rows else []
+    
+    def list_colors(self, size: str) -> List[str]:
+        """Список цветов, которые есть в остатках размера"""
+        rows = self._query("SELECT color FROM skus WHERE size = ? GROUP BY color ORDER BY MIN(rowid)", (size,))
+        return [row["color"] for row in rows]
+    
+    def available(self, size: Optional[str] = None, color: Optional[str] = None) -> int:
+        """Доступно (qty_total - qty_reserved) по размеру, цвету, паре или всего"""
+        conditions = {"size": size, "color": color}
+        conditions = {column: value for column, value in conditions.items() if value is not None}
+        where = " AND ".join(f"{column} = ?" for column in conditions) or "1"
+        rows = self._query(f"SELECT COALESCE(SUM(qty_total - qty_reserved), 0) AS available FROM skus WHERE {where}",
+                           tuple(conditions.values()))
+        return rows[0]["available"]
+    
+    def availability(self) -> AvailabilityMatrix:
+        """
+        Матрица доступности одним запросом GROUP BY
+        
+        Кешируется до записи этим процессом (_version) или другим
+        соединением (PRAGMA data_version).
+        """
+        key = (self._version, self._query("PRAGMA data_version")[0][0])
+        entry = self._availability_cache
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        cells: Dict[str, Dict[str, int]] = {}
+        for row in self._query("SELECT size, color, SUM(qty_total - qty_reserved) AS available FROM skus "
+                               "GROUP BY size, color ORDER BY MIN(rowid)"):
+            cells.setdefault(row["size"], {})[row["color"]] = row["available"]
+        matrix = AvailabilityMatrix(self.list_sizes(), cells)
+        self._availability_cache = (key, matrix)
+        return matrix
+    
+    def reserve(self, size: str, color: str, qty: int = 1) -> bool:
+        """Зарезервировать товар размера и цвета (первый SKU, где хватает остатка)"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE skus SET qty_reserved = qty_reserved + ? WHERE rowid = ("
+                "SELECT rowid FROM skus WHERE size = ? AND color = ? AND qty_total - qty_reserved >= ? "
+                "ORDER BY rowid LIMIT 1)",
+                (qty, size, color, qty)
+            )
+        return cursor.rowcount > 0
+    
+    def release(self, size: str, color: str, qty: int = 1) -> bool:
+        """Освободить зарезервированный товар размера и цвета (SKU в порядке, обратном reserve)"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE skus SET qty_reserved = qty_reserved - ? WHERE rowid = ("
+                "SELECT rowid FROM skus WHERE size = ? AND color = ? AND qty_reserved >= ? "
+                "ORDER BY rowid DESC LIMIT 1)",
+                (qty, size, color, qty)
+            )
+        return cursor.rowcount > 0
+    
+    def adjust_stock(self, product_type: str, color: str, size: str,
+                     delta_total: int = 0, delta_reserved: int = 0) -> bool:
+        """Изменить счетчики SKU одним UPDATE (новый SKU создается через документ)"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE skus SET qty_total = qty_total + ?, qty_reserved = qty_reserved + ? "
+                "WHERE type = ? AND color = ? AND size = ? "
+                "AND qty_reserved + ? >= 0 AND qty_reserved + ? <= qty_total + ?",
+                (delta_total, delta_reserved, product_type, color, size,
+                 delta_reserved, delta_reserved, delta_total)
+            )
+        if cursor.rowcount > 0:
+            return True
+        if self._query("SELECT 1 FROM skus WHERE type = ? AND color = ? AND size = ?", (product_type, color, size)):
+            return False
+        return super().adjust_stock(product_type, color, size, delta_total, delta_reserved)
+    
+    def _adjust_reserved(self, key: str, delta: int) -> bool:
+        """try_reserve/try_release одним UPDATE"""
+        product_type, color, size = key.split("|", 2)
+        return self.adjust_stock(product_type, color, size, delta_reserved=delta)
+    
+    # === ЗАКАЗЫ ===
+    
+    def _insert_order(self, conn: sqlite3.Connection, order: Dict[str, Any]):
+        order = dict(order)
+        deliveries = order.pop("deliveries", [])
+        conn.execute(
+            "INSERT INTO orders (id, user_tg_id, status, created_at, data) VALUES (?, ?, ?, ?, ?)",
+            (order["id"], str(order.get("user_tg_id")), order.get("status", "pending"),
+             order.get("created_at", ""), _dumps(order))
+        )
+        for delivery in deliveries:
+            conn.execute(
+                "INSERT INTO order_deliveries (order_id, chat_id, prefix, message_id) VALUES (?, ?, ?, ?)",
+                (order["id"], str(delivery.get("chat_id")), delivery.get("prefix"), delivery.get("message_id"))
+            )
+    
+    def _select_orders(self, where: str, params: tuple) -> List[Dict[str, Any]]:
+        """Выбрать заказы вместе с доставками"""
+        rows = self._query(f"SELECT id, status, data FROM orders {where} ORDER BY created_at, id", params)
+        orders = []
+        by_id = {}
+        for row in rows:
+            order = json.loads(row["data"])
+            order["status"] = row["status"]
+            order["deliveries"] = []
+            orders.append(order)
+            by_id[row["id"]] = order
+        
+        if by_id:
+            deliveries = self._query(
+                f"SELECT order_id, chat_id, prefix, message_id FROM order_deliveries "
+                f"WHERE order_id IN (SELECT id FROM orders {where}) ORDER BY rowid",
+                params
+            )
+            for row in deliveries:
+                by_id[row["order_id"]]["deliveries"].append({
+                    "chat_id": row["chat_id"],
+                    "prefix": row["prefix"],
+                    "message_id": row["message_id"]
+                })
+        return orders
+    
+    def create_order(self, payload: Dict[str, Any]) -> int:
+        """Создать новый заказ"""
+        with self._transaction() as conn:
+            order_id = self._allocate_order_id(conn)
+            self._insert_order(conn, self._build_order(order_id, payload))
+        return order_id
+    
+    def append_delivery(self, order_id: int, chat_id: Union[str, int], prefix: str, message_id: int) -> bool:
+        """Добавить информацию о доставке заказа"""
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE orders SET status = 'sent' WHERE id = ?", (order_id,))
+            if cursor.rowcount == 0:
+                return False
+            conn.execute(
+                "INSERT INTO order_deliveries (order_id, chat_id, prefix, message_id) VALUES (?, ?, ?, ?)",
+                (order_id, str(chat_id), prefix, message_id)
+            )
+        return True
+    
+    def set_order_status(self, order_id: int, status: str) -> bool:
+        """Изменить статус заказа"""
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
+        return cursor.rowcount > 0
+    
+    def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        """Получить заказ по ID"""
+        orders = self._select_orders("WHERE id = ?", (order_id,))
+        return orders[0] if orders else None
+    
+    def orders_by_user(self, user_tg_id: Union[str, int]) -> List[Dict[str, Any]]:
+        """Заказы пользователя по времени создания"""
+        return self._select_orders("WHERE user_tg_id = ?", (str(user_tg_id),))
+    
+    def orders_by_status(self, status: str) -> List[Dict[str, Any]]:
+        """Заказы в статусе по времени создания"""
+        return self._select_orders("WHERE status = ?", (status,))
+    
+    def orders_by_chat(self, chat_id: Union[str, int]) -> List[Dict[str, Any]]:
+        """Заказы, доставленные в чат, по времени создания"""
+        return self._select_orders(
+            "WHERE id IN (SELECT order_id FROM order_deliveries WHERE chat_id = ?)", (str(chat_id),)
+        )
+    
+    def orders_between(self, t0: Union[str, datetime], t1: Union[str, datetime]) -> List[Dict[str, Any]]:
+        """Заказы, созданные в интервале [t0, t1), по времени создания"""
+        bounds = tuple(t.isoformat() if isinstance(t, datetime) else str(t) for t in (t0, t1))
+        return self._select_orders("WHERE created_at >= ? AND created_at < ?", bounds)
+    
+    def order_status_counts(self) -> Dict[str, int]:
+        """Количество заказов по статусам"""
+        rows = self._query("SELECT status, COUNT(*) AS count FROM orders GROUP BY status")
+        return {row["status"]: row["count"] for row in rows}
+    
+    def close(self):
+        """Закрыть соединение с БД"""
+        self._stats.close()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+if __name__ == "__main__":
+    import sys
+    
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Использование: python -m src.sqlite_storage <sqlite:///bot.db> [data_dir] [--force]")
+        sys.exit(1)
+    
+    # Импорт выполняется автоматически при первом открытии БД,
+    # --force повторно перезаписывает данные из JSON файлов
+    source_dir = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != "--force" else "data"
+    db = SQLiteStorage(sqlite_path_from_url(sys.argv[1], source_dir), data_dir=source_dir)
+    if "--force" in sys.argv:
+        count = db.import_json_dir(source_dir)
+        print(f"Импортировано файлов: {count}")
+    print(f"Данные импортированы из JSON: {db._get_meta('json_imported_at')}")
@@ -0,0 +1,189 @@
+import os
+import atexit
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+from .inventory import INVENTORY_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class StockCounters:
+    """
+    Счетчики резерва SKU с блокировками по полосам (STORAGE_STOCK_COUNTERS=1)
+    
+    try_reserve(sku, qty) проверяет и увеличивает резерв под блокировкой
+    одной из STORAGE_STOCK_STRIPES (64) полос - SKU распределяются по хешу
+    ключа, поэтому заказы разных SKU не ждут друг друга и не переписывают
+    inventory.json. Остаток берется из закешированного документа, к нему
+    добавляются несохраненные изменения резерва.
+    
+    Фоновый поток раз в STORAGE_STOCK_FLUSH_MS (200) или после
+    STORAGE_STOCK_FLUSH_MAX (50) изменений в полосе записывает все изменения
+    одной транзакцией. На время записи держатся блокировки всех полос:
+    новый документ попадает в кеш вместе с очисткой изменений, и резерв
+    не видит их дважды. Чтение остатков через хранилище не пишет файл,
+    а добавляет к закешированному документу pending(). Несохраненные
+    резервы теряются при падении процесса (как и при STORAGE_WRITE_BEHIND).
+    """
+    
+    def __init__(self, storage, stripes: Optional[int] = None,
+                 flush_interval: Optional[float] = None, flush_max_changes: Optional[int] = None):
+        self.storage = storage
+        self.stripes = stripes or int(os.getenv("STORAGE_STOCK_STRIPES", "64"))
+        if flush_interval is None:
+            flush_interval = int(os.getenv("STORAGE_STOCK_FLUSH_MS", "200")) / 1000
+        self.flush_interval = flush_interval
+        self.flush_max_changes = flush_max_changes or int(os.getenv("STORAGE_STOCK_FLUSH_MAX", "50"))
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        # Изменения резерва по полосам: ключ SKU -> разница
+        self._pending: List[Dict[str, int]] = [{} for _ in range(self.stripes)]
+        self._changes = [0] * self.stripes
+        self._flushing_thread: Optional[int] = None
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self.flushes = 0
+        self.rejected = 0
+        atexit.register(self.flush)
+    
+    # === РЕЗЕРВ ===
+    
+    def _stripe(self, sku: str) -> int:
+        return hash(sku) % self.stripes
+    
+    def _change(self, stripe: int, sku: str, qty: int):
+        pending = self._pending[stripe]
+        value = pending.get(sku, 0) + qty
+        if value:
+            pending[sku] = value
+        else:
+            pending.pop(sku, None)
+        self._changes[stripe] += 1
+        if self._changes[stripe] >= self.flush_max_changes:
+            self._wake.set()
+    
+    def try_reserve(self, sku: str, qty: int = 1) -> bool:
+        """Зарезервировать qty единиц SKU, если хватает остатка"""
+        stripe = self._stripe(sku)
+        with self._locks[stripe]:
+            # Документ читается под блокировкой полосы: запись держит
+            # блокировки полос, пока новый документ не попадет в кеш
+            counters = self.storage._sku_counters(sku)
+            if counters is None:
+                return False
+            qty_total, qty_reserved = counters
+            if qty_total - qty_reserved - self._pending[stripe].get(sku, 0) < qty:
+                return False
+            self._change(stripe, sku, qty)
+        self.start()
+        return True
+    
+    def try_release(self, sku: str, qty: int = 1) -> bool:
+        """Освободить qty единиц резерва SKU"""
+        stripe = self._stripe(sku)
+        with self._locks[stripe]:
+            counters = self.storage._sku_counters(sku)
+            if counters is None or counters[1] + self._pending[stripe].get(sku, 0) < qty:
+                return False
+            self._change(stripe, sku, -qty)
+        self.start()
+        return True
+    
+    # === ЗАПИСЬ ===
+    
+    def dirty(self) -> bool:
+        return any(self._pending)
+    
+    def pending(self) -> Dict[str, int]:
+        """
+        Несохраненные изменения резерва всех полос: ключ SKU -> разница
+        
+        Запись очищает изменения и увеличивает flushes под блокировками всех
+        полос: если flushes изменился между чтением документа и pending(),
+        документ нужно перечитать.
+        """
+        deltas: Dict[str, int] = {}
+        for stripe, lock in enumerate(self._locks):
+            with lock:
+                deltas.update(self._pending[stripe])
+        return deltas
+    
+    def flush(self) -> bool:
+        """
+        Записать изменения резерва одной транзакцией inventory.json
+        
+        Блокировка файла берется до блокировок полос, как и в транзакциях
+        хранилища, поэтому запись не пересекается с другими изменениями
+        остатков. Полосы заблокированы до конца записи: try_reserve и
+        try_release ждут ее (одна запись на интервал). Изменения вне
+        допустимого диапазона хранилище отклоняет, они не повторяются.
+        При ошибке записи изменения остаются и пишутся следующей записью.
+        """
+        with self.storage._file_lock(INVENTORY_FILE):
+            if self._flushing_thread == threading.get_ident() or not self.dirty():
+                return True
+            for lock in self._locks:
+                lock.acquire()
+            try:
+                batch: Dict[str, int] = {}
+                for pending in self._pending:
+                    batch.update(pending)
+            
+                self._flushing_thread = threading.get_ident()
+                try:
+                    rejected = self.storage._apply_reserved(batch)
+                finally:
+                    self._flushing_thread = None
+                if rejected is None:
+                    logger.error(f"Не удалось записать резервы {len(batch)} SKU, повтор при следующей записи")
+                    return False
+                
+                self._pending = [{} for _ in range(self.stripes)]
+                self._changes = [0] * self.stripes
+                self.rejected += len(rejected)
+                self.flushes += 1
+                return True
+            finally:
+                for lock in reversed(self._locks):
+                    lock.release()
+    
+    def _flush_loop(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped:
+                return
+            if self.dirty():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Ошибка записи резервов: {e}")
+    
+    def start(self):
+        """Запустить фоновую запись (при первом изменении резерва)"""
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._flush_loop, name="stock-counters", daemon=True)
+                self._thread.start()
+    
+    def stop(self):
+        """Остановить фоновую запись и записать остаток изменений"""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        pending = 0
+        for stripe, lock in enumerate(self._locks):
+            with lock:
+                pending += len(self._pending[stripe])
+        return {"stripes": self.stripes, "pending_skus": pending, "flushes": self.flushes,
+                "rejected": self.rejected}
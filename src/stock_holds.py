@@ -0,0 +1,196 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from .lazy import LazyInstance
+from .storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Время жизни брони по умолчанию (STOCK_HOLD_TTL, секунды)
+DEFAULT_HOLD_TTL = 600
+
+
+class StockHolds:
+    """
+    Мягкие брони остатков на время оформления заказа
+    
+    Бронь ставится при выборе размера и цвета и живет ttl секунд. Она не
+    меняет qty_reserved в хранилище: другим пользователям доступен остаток
+    за вычетом чужих броней, а при подтверждении заказа convert() резервирует
+    товар и снимает бронь под одной блокировкой. У пользователя одна бронь,
+    новая заменяет прежнюю. Брони живут в памяти процесса и пропадают при
+    перезапуске - зависших резервов после сбоя не остается.
+    
+    Истекшие брони снимает один фоновый поток: сроки лежат в min-куче,
+    поток спит до ближайшего и снимает бронь за O(log n). Замененные
+    и сконвертированные брони остаются в куче и пропускаются по токену.
+    """
+    
+    def __init__(self, stock=None, ttl: Optional[float] = None):
+        self.stock = stock if stock is not None else storage
+        self.ttl = ttl if ttl is not None else float(os.getenv("STOCK_HOLD_TTL", DEFAULT_HOLD_TTL))
+        # user_id -> (размер, цвет, количество, срок, токен)
+        self._holds: Dict[int, Tuple[str, str, int, float, int]] = {}
+        self._held: Dict[Tuple[str, str], int] = {}
+        self._held_sizes: Dict[str, int] = {}
+        # (срок, токен, user_id)
+        self._heap: List[Tuple[float, int, int]] = []
+        self._token = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._expired = 0
+        self._converted = 0
+    
+    # === БРОНИ ===
+    
+    def _count(self, size: str, color: str, qty: int):
+        self._held[(size, color)] = self._held.get((size, color), 0) + qty
+        self._held_sizes[size] = self._held_sizes.get(size, 0) + qty
+        if not self._held[(size, color)]:
+            del self._held[(size, color)]
+        if not self._held_sizes[size]:
+            del self._held_sizes[size]
+    
+    def _drop(self, user_id: int) -> Optional[Tuple[str, str, int, float, int]]:
+        hold = self._holds.pop(user_id, None)
+        if hold is not None:
+            self._count(hold[0], hold[1], -hold[2])
+        return hold
+    
+    def _free(self, size: str, color: str) -> int:
+        """Остаток размера и цвета за вычетом броней (под блокировкой)"""
+        return self.stock.available(size, color) - self._held.get((size, color), 0)
+    
+    def place(self, user_id: int, size: str, color: str, qty: int = 1) -> bool:
+        """Забронировать товар на ttl секунд (заменяет прежнюю бронь пользователя)"""
+        with self._cond:
+            previous = self._drop(user_id)
+            if self._free(size, color) < qty:
+                if previous is not None:
+                    self._holds[user_id] = previous
+                    self._count(previous[0], previous[1], previous[2])
+                return False
+            
+            self._token += 1
+            expires_at = time.monotonic() + self.ttl
+            self._holds[user_id] = (size, color, qty, expires_at, self._token)
+            self._count(size, color, qty)
+            heapq.heappush(self._heap, (expires_at, self._token, user_id))
+            if self._heap[0][1] == self._token:
+                self._cond.notify()
+        self.start()
+        return True
+    
+    def convert(self, user_id: int, size: str, color: str, qty: int = 1) -> bool:
+        """
+        Превратить бронь в резерв хранилища
+        
+        Без брони (истекла или не ставилась) резервируется только остаток,
+        не занятый чужими бронями.
+        """
+        with self._cond:
+            hold = self._drop(user_id)
+            if hold is not None and hold[:3] != (size, color, qty):
+                hold = None
+            if hold is None and self._free(size, color) < qty:
+                return False
+            if not self.stock.reserve(size, color, qty):
+                return False
+            self._converted += 1
+            return True
+    
+    def release(self, user_id: int) -> bool:
+        """Снять бронь пользователя (отмена оформления)"""
+        with self._cond:
+            return self._drop(user_id) is not None
+    
+    def held(self, size: str, color: Optional[str] = None, exclude_user: Optional[int] = None) -> int:
+        """Забронировано по размеру (и цвету), без брони exclude_user"""
+        with self._cond:
+            if color is None:
+                count = self._held_sizes.get(size, 0)
+            else:
+                count = self._held.get((size, color), 0)
+            own = self._holds.get(exclude_user) if exclude_user is not None else None
+            if own is not None and own[0] == size and (color is None or own[1] == color):
+                count -= own[2]
+            return count
+    
+    def count(self) -> int:
+        """Число действующих броней"""
+        with self._cond:
+            return len(self._holds)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Сводка для мониторинга"""
+        with self._cond:
+            return {
+                "holds": len(self._holds),
+                "held_units": sum(self._held_sizes.values()),
+                "expired": self._expired,
+                "converted": self._converted,
+                "ttl": self.ttl
+            }
+    
+    # === ИСТЕЧЕНИЕ ===
+    
+    def expire_due(self, now: Optional[float] = None) -> int:
+        """Снять брони со сроком до now, возвращает их число"""
+        if now is None:
+            now = time.monotonic()
+        expired = 0
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                _, token, user_id = heapq.heappop(self._heap)
+                hold = self._holds.get(user_id)
+                if hold is not None and hold[4] == token:
+                    self._drop(user_id)
+                    expired += 1
+            self._expired += expired
+        if expired:
+            logger.info(f"Снято истекших броней: {expired}")
+        return expired
+    
+    def _expiry_loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            try:
+                self.expire_due()
+            except Exception as e:
+                logger.error(f"Ошибка снятия истекших броней: {e}")
+    
+    def start(self):
+        """Запустить поток истечения (один на экземпляр, стартует с первой бронью)"""
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._expiry_loop, name="stock-holds", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+# Глобальные брони (создаются при первом обращении)
+stock_holds = LazyInstance(StockHolds, "stock_holds")
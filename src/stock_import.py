@@ -0,0 +1,278 @@
+import io
+import os
+import sys
+import csv
+import logging
+import argparse
+from typing import Dict, Any, List, Iterable, Iterator, Optional, BinaryIO, Set, TextIO, Tuple, Union
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+from .inventory import INVENTORY_FILE, NO_COLOR
+
+logger = logging.getLogger(__name__)
+
+# Колонки таблицы остатков (импорт) и выгрузки (экспорт)
+COLUMNS = ("type", "color", "size", "qty")
+EXPORT_COLUMNS = ("type", "color", "size", "qty", "qty_reserved", "qty_available")
+# Русские и прежние названия колонок
+COLUMN_ALIASES = {
+    "вид": "type", "тип": "type", "цвет": "color", "размер": "size",
+    "количество": "qty", "кол-во": "qty", "остаток": "qty", "qty_total": "qty",
+}
+# Справочники, по которым проверяются строки: колонка -> (файл, ключ)
+CATALOGS = {
+    "type": ("merch_types.json", "types"),
+    "color": ("merch_colors.json", "colors"),
+    "size": ("merch_sizes.json", "sizes"),
+}
+# Сколько ошибок показывать в сообщении
+MAX_REPORTED_ERRORS = 20
+
+
+class StockTableError(ValueError):
+    """Таблица остатков не прошла проверку (errors - ошибки по строкам)"""
+    
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        shown = errors[:MAX_REPORTED_ERRORS]
+        if len(errors) > len(shown):
+            shown.append(f"... и еще {len(errors) - len(shown)}")
+        super().__init__("\n".join(shown))
+
+
+# === ЧТЕНИЕ ТАБЛИЦЫ ===
+
+def read_table(source: Union[str, BinaryIO], filename: str = "") -> Iterator[List[str]]:
+    """
+    Строки таблицы из CSV (разделитель , ; или табуляция) или XLSX
+    
+    source - путь или открытый двоичный файл, формат определяется
+    по расширению filename (или пути). Строки читаются по одной.
+    """
+    if isinstance(source, str):
+        filename = filename or source
+        with open(source, "rb") as stream:
+            yield from read_table(stream, filename)
+        return
+    
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        yield from _read_xlsx(source)
+    else:
+        yield from _read_csv(source)
+
+
+def _read_csv(stream: BinaryIO) -> Iterator[List[str]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    # Разделитель - самый частый из , ; и табуляции в строке заголовка
+    header = text.readline()
+    text.seek(0)
+    delimiter = max(",;\t", key=header.count)
+    try:
+        yield from csv.reader(text, delimiter=delimiter)
+    finally:
+        text.detach()
+
+
+def _read_xlsx(stream: BinaryIO) -> Iterator[List[str]]:
+    if openpyxl is None:
+        raise StockTableError(["Для XLSX нужен пакет openpyxl, загрузите таблицу в CSV"])
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if value is None else _cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def _cell_text(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# === ПРОВЕРКА ===
+
+def load_catalogs(storage) -> Dict[str, Dict[str, str]]:
+    """Справочники видов, цветов и размеров: колонка -> {название в нижнем регистре: название}"""
+    return {column: {str(value).lower(): value for value in storage.view(filename).get(key, [])}
+            for column, (filename, key) in CATALOGS.items()}
+
+
+def load_existing_skus(storage) -> Set[Tuple[str, str, str]]:
+    """(вид, цвет, размер) SKU, которые уже есть в остатках"""
+    return {(sku["type"], sku["color"], sku["size"])
+            for sku in storage.view(INVENTORY_FILE).get("skus", {}).values()}
+
+
+def parse_stock_table(rows: Iterable[List[str]], catalogs: Dict[str, Dict[str, str]],
+                      allow_negative: bool = False,
+                      existing: Optional[Set[Tuple[str, str, str]]] = None) -> List[Tuple[str, str, str, int]]:
+    """
+    Проверить таблицу и вернуть строки (вид, цвет, размер, количество)
+    
+    Первая непустая строка - заголовок, лишние колонки пропускаются.
+    Вид, цвет и размер должны быть в справочниках (без учета регистра,
+    в результат попадает написание из справочника), пустой цвет - товар
+    без цвета. SKU из existing (уже есть в остатках, например перенесенные
+    из прежней схемы без вида) принимаются как есть, поэтому выгрузка
+    загружается обратно. Все ошибки собираются и выдаются вместе в StockTableError.
+    """
+    existing = existing or set()
+    errors: List[str] = []
+    result: List[Tuple[str, str, str, int]] = []
+    seen: Dict[Tuple[str, str, str], int] = {}
+    columns: Optional[Dict[str, int]] = None
+    
+    for line, row in enumerate(rows, 1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        if columns is None:
+            header = [COLUMN_ALIASES.get(cell.lower(), cell.lower()) for cell in cells]
+            missing = [column for column in COLUMNS if column not in header]
+            if missing:
+                raise StockTableError([f"Строка {line}: нет колонок {', '.join(missing)} "
+                                       f"(нужны {', '.join(COLUMNS)})"])
+            columns = {column: header.index(column) for column in COLUMNS}
+            continue
+        
+        values = {column: cells[index] if index < len(cells) else "" for column, index in columns.items()}
+        if values["color"] == "":
+            values["color"] = NO_COLOR
+        row_errors = []
+        known = (values["type"], values["color"], values["size"]) in existing
+        for column in CATALOGS:
+            value = values[column]
+            if known or (column == "color" and value == NO_COLOR):
+                continue
+            canonical = catalogs[column].get(value.lower())
+            if canonical is None:
+                row_errors.append(f"{column} «{value}» нет в справочнике" if value else f"пустое поле {column}")
+            else:
+                values[column] = canonical
+        qty = 0
+        try:
+            number = float(values["qty"].replace(",", "."))
+            if not number.is_integer():
+                row_errors.append(f"количество «{values['qty']}» не целое")
+            elif number < 0 and not allow_negative:
+                row_errors.append(f"отрицательное количество {values['qty']}")
+            else:
+                qty = int(number)
+        except ValueError:
+            row_errors.append(f"количество «{values['qty']}» не число")
+        
+        key = (values["type"], values["color"], values["size"])
+        if not row_errors and key in seen:
+            row_errors.append(f"повтор строки {seen[key]}")
+        if row_errors:
+            errors.append(f"Строка {line}: {'; '.join(row_errors)}")
+            continue
+        seen[key] = line
+        result.append((values["type"], values["color"], values["size"], qty))
+    
+    if columns is None:
+        errors.append("Таблица пустая")
+    if errors:
+        raise StockTableError(errors)
+    return result
+
+
+# === ИМПОРТ И ЭКСПОРТ ===
+
+def import_stock_table(storage, source: Union[str, BinaryIO], filename: str = "",
+                       add: bool = False, dry_run: bool = False) -> List[Dict[str, Any]]:
+    """
+    Загрузить остатки из таблицы одной записью inventory.json
+    
+    Возвращает изменения (см. storage.import_stock). Ошибки проверки
+    и записи - StockTableError, при них остатки не меняются.
+    """
+    rows = parse_stock_table(read_table(source, filename), load_catalogs(storage), allow_negative=add,
+                             existing=load_existing_skus(storage))
+    changes = storage.import_stock(rows, add=add, dry_run=dry_run)
+    if changes is None:
+        raise StockTableError(["Не удалось записать остатки"])
+    if not dry_run:
+        logger.info(f"Импорт остатков: строк {len(rows)}, изменено SKU {len(changes)}")
+    return changes
+
+
+def format_changes(changes: List[Dict[str, Any]], limit: Optional[int] = None) -> str:
+    """Изменения импорта по строке на SKU (не больше limit строк)"""
+    if not changes:
+        return "Остатки не изменились"
+    lines = []
+    for change in changes[:limit]:
+        name = "/".join(value for value in (change["type"], change["color"], change["size"]) if value != NO_COLOR)
+        if change["before"] is None:
+            lines.append(f"+ {name}: {change['after']}")
+        else:
+            lines.append(f"~ {name}: {change['before']} → {change['after']}")
+    if len(changes) > len(lines):
+        lines.append(f"... и еще {len(changes) - len(lines)}")
+    return "\n".join(lines)
+
+
+def iter_stock_rows(storage) -> Iterator[List[Any]]:
+    """Строки выгрузки остатков (с заголовком), пригодные для обратного импорта"""
+    yield list(EXPORT_COLUMNS)
+    for item in storage.list_stock():
+        yield [item["type"], "" if item["color"] == NO_COLOR else item["color"], item["size"],
+               item["qty_total"], item["qty_reserved"], item["qty_available"]]
+
+
+def export_stock_table(storage, out: TextIO) -> int:
+    """Записать остатки в CSV построчно, возвращает число SKU"""
+    writer = csv.writer(out)
+    count = -1
+    for count, row in enumerate(iter_stock_rows(storage)):
+        writer.writerow(row)
+    return count
+
+
+def main(argv=None) -> int:
+    """python -m src.stock_import import stock.csv [--add] [--dry-run] | export [stock.csv]"""
+    parser = argparse.ArgumentParser(description="Загрузка и выгрузка таблицы остатков")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("file", nargs="?", default="-", help="CSV/XLSX (для export по умолчанию stdout)")
+    parser.add_argument("--data", default="data", help="папка данных")
+    parser.add_argument("--add", action="store_true", help="прибавить количество к остатку вместо замены")
+    parser.add_argument("--dry-run", action="store_true", help="только показать изменения")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.WARNING)
+    from .storage import create_storage
+    storage = create_storage(None, args.data)
+    try:
+        if args.command == "export":
+            if args.file == "-":
+                count = export_stock_table(storage, sys.stdout)
+            else:
+                with open(args.file, "w", encoding="utf-8", newline="") as out:
+                    count = export_stock_table(storage, out)
+            print(f"Выгружено SKU: {count}", file=sys.stderr)
+            return 0
+        
+        if args.file == "-" or not os.path.exists(args.file):
+            print("❌ Укажите файл таблицы")
+            return 1
+        try:
+            changes = import_stock_table(storage, args.file, add=args.add, dry_run=args.dry_run)
+        except StockTableError as e:
+            print(f"❌ {e}")
+            return 1
+        print(format_changes(changes))
+        if args.dry_run:
+            print("(проверка, остатки не изменены)")
+        return 0
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,43 +2,96 @@ import json
 import os
 import logging
 import tempfile
-import shutil
-from typing import Dict, Any, Optional, List, Union
+import threading
+import atexit
+import time
+from collections.abc import Mapping
+from types import MappingProxyType
+from contextlib import contextmanager, ExitStack
+from typing import (Dict, Any, Optional, List, Union, Tuple, Callable, ContextManager, Iterable, Protocol,
+                    runtime_checkable)
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .storage_codec import encode, decode, resolve_codec, DEFAULT_CODEC
+from .lazy import LazyInstance
+from .storage_stats import StorageStats
+from .inventory import (INVENTORY_FILE, INVENTORY_SCHEMA, SKU_FIELDS, AvailabilityMatrix, InventoryIndex,
+                        StockDraft, migrate_inventory, new_sku, sku_key, stock_record)
+
 logger = logging.getLogger(__name__)
 
 
+class StorageError(Exception):
+    """Ошибка записи в хранилище"""
+
+
+# fsync при атомарной записи файлов (STORAGE_FSYNC=0 отключает)
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "1").lower() in ("1", "true", "yes")
+
+# Документы-словари (ключ -> запись), остальные документы - списки
+DICT_DOCUMENTS = ("users.json", "chat_messages.json", "audit_log.json", "settings.json", "inventory.json",
+                  "meta.json", "merch_types.json", "merch_colors.json", "merch_sizes.json")
+
+
 def load_json(path: str, default: Any = None) -> Any:
-    """Загрузка JSON файла с дефолтным значением"""
+    """Загрузка файла данных с дефолтным значением (формат определяется по содержимому)"""
     try:
         if not os.path.exists(path):
             return default
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(path, 'rb') as f:
+            return decode(f.read())
     except Exception as e:
         logger.error(f"Ошибка чтения файла {path}: {e}")
         return default
 
 
-def save_json_atomic(path: str, data: Any) -> bool:
-    """Атомарное сохранение JSON через временный файл"""
+def fsync_dir(path: str):
+    """fsync папки, чтобы переименование файла пережило сбой питания (POSIX)"""
     try:
-        # Создаем временный файл
-        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
-        os.close(temp_fd)
-        
-        # Записываем во временный файл
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        # Windows не открывает папки на чтение
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def save_json_atomic(path: str, data: Any, codec: str = DEFAULT_CODEC) -> bool:
+    """
+    Атомарное сохранение JSON (или другого формата codec) через временный файл
+    
+    Данные сбрасываются на диск до os.replace, а после - сама папка, поэтому
+    после сбоя на месте файла оказывается старая или новая версия целиком.
+    STORAGE_FSYNC=0 отключает fsync (быстрее, но без этой гарантии).
+    """
+    temp_path = None
+    try:
+        # Создаем временный файл и записываем в него
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix='.tmp')
+        with os.fdopen(temp_fd, 'wb') as f:
+            f.write(encode(data, codec))
+            if STORAGE_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
         
-        # Атомарно переименовываем
-        shutil.move(temp_path, path)
+        # Атомарно заменяем файл
+        os.replace(temp_path, path)
+        if STORAGE_FSYNC:
+            fsync_dir(os.path.dirname(path))
         return True
     except Exception as e:
         logger.error(f"Ошибка атомарной записи в файл {path}: {e}")
         # Удаляем временный файл если он остался
-        if os.path.exists(temp_path):
+        if temp_path and os.path.exists(temp_path):
             try:
                 os.remove(temp_path)
             except:
@@ -46,13 +99,255 @@ def save_json_atomic(path: str, data: Any) -> bool:
         return False
 
 
+def _env_flag(name: str) -> bool:
+    """Булев флаг из переменной окружения"""
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+
+def _copy_json(value: Any) -> Any:
+    """Быстрая глубокая копия JSON-совместимых данных"""
+    if isinstance(value, dict):
+        return {key: _copy_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(item) for item in value]
+    return value
+
+
+def _freeze(value: Any) -> Any:
+    """Представление JSON-данных только для чтения: dict -> MappingProxyType, list -> tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class _KeyedView(Mapping):
+    """
+    Словарный документ, записи которого читаются по мере обхода
+    
+    Используется для users.json при раскладке sharded и для коллекций
+    dbm хранилища: get_all не собирает весь документ в память.
+    """
+    
+    def __init__(self, storage: "JSONStorage", filename: str, keys):
+        self._storage = storage
+        self._filename = filename
+        self._keys = keys
+    
+    def __getitem__(self, key: str) -> Any:
+        value = self._storage.get(self._filename, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __iter__(self):
+        return iter(sorted(self._keys()))
+    
+    def __len__(self) -> int:
+        return len(self._keys())
+
+
+# Документы, попадающие в snapshot()
+SNAPSHOT_DOCUMENTS = ("users.json", "chats.json", "inventory.json", "orders.json", "settings.json", "meta.json")
+
+
+class StorageSnapshot:
+    """
+    Срез документов на момент вызова storage.snapshot()
+    
+    Документы отдаются только для чтения, как в view(): словари - как
+    MappingProxyType, списки - как tuple. Каждый документ среза - целая
+    версия, изменения нескольких документов попадают в срез вместе,
+    только если записаны одним update_many.
+    """
+    
+    def __init__(self, version: int, documents: Dict[str, Any]):
+        self.version = version
+        self.taken_at = datetime.now()
+        self._documents = documents
+    
+    def get(self, filename: str) -> Any:
+        """Документ среза (только для чтения)"""
+        return self._documents[filename]
+    
+    @property
+    def users(self) -> Mapping[str, Any]:
+        return self._documents["users.json"]
+    
+    @property
+    def chats(self) -> Tuple[Mapping[str, Any], ...]:
+        return self._documents["chats.json"]
+    
+    @property
+    def active_chats(self) -> List[Mapping[str, Any]]:
+        return [chat for chat in self.chats if chat.get("active", True)]
+    
+    @property
+    def inventory(self) -> Mapping[str, Any]:
+        return self._documents["inventory.json"]
+    
+    @property
+    def orders(self) -> Tuple[Mapping[str, Any], ...]:
+        return self._documents["orders.json"]
+    
+    @property
+    def settings(self) -> Mapping[str, Any]:
+        return self._documents["settings.json"]
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """
+    Интерфейс хранилища, который используют обработчики и менеджеры бота
+    
+    Только методы, которые вызываются снаружи хранилищ. Реализации:
+    JSONStorage (json://), SQLiteStorage (sqlite://), DbmStorage (dbm://),
+    MemoryStorage (memory://). Новая реализация регистрируется через
+    register_backend() и должна проходить tests/test_storage_conformance.py.
+    """
+    
+    # Документы целиком
+    def get_all(self, filename: str) -> Any: ...
+    def view(self, filename: str) -> Any: ...
+    def edit(self, filename: str) -> ContextManager[Any]: ...
+    def snapshot(self) -> StorageSnapshot: ...
+    
+    # Записи по ключу
+    def get(self, filename: str, key: str) -> Optional[Any]: ...
+    def set(self, filename: str, key: str, value: Any) -> bool: ...
+    def update_many(self, changes: Dict[str, Dict[Union[str, int], Dict[str, Any]]],
+                    replace: bool = False) -> bool: ...
+    
+    # Пользователи и чаты
+    def inc_total_orders(self, tg_id: Union[str, int]) -> int: ...
+    def add_chat(self, chat_data: Dict[str, Any]) -> bool: ...
+    def get_chat(self, chat_id: Union[str, int]) -> Optional[Dict[str, Any]]: ...
+    def update_chat(self, chat_id: Union[str, int], updated_data: Dict[str, Any]) -> bool: ...
+    def delete_chat(self, chat_id: Union[str, int]) -> bool: ...
+    def list_active_chats(self) -> List[Dict[str, Any]]: ...
+    def find_chat_by_prefix(self, prefix: str,
+                            exclude_chat_id: Union[str, int, None] = None) -> Optional[Dict[str, Any]]: ...
+    def used_prefixes(self) -> set: ...
+    
+    # Остатки
+    def list_sizes(self) -> List[str]: ...
+    def list_colors(self, size: str) -> List[str]: ...
+    def add_size(self, size: str) -> bool: ...
+    def remove_size(self, size: str) -> bool: ...
+    def available(self, size: Optional[str] = None, color: Optional[str] = None) -> int: ...
+    def availability(self) -> AvailabilityMatrix: ...
+    def reserve(self, size: str, color: str, qty: int = 1) -> bool: ...
+    def release(self, size: str, color: str, qty: int = 1) -> bool: ...
+    def try_reserve(self, sku: str, qty: int = 1) -> bool: ...
+    def try_release(self, sku: str, qty: int = 1) -> bool: ...
+    def get_stock(self, product_type: str, color: str, size: str) -> Optional[Dict[str, Any]]: ...
+    def list_stock(self) -> List[Dict[str, Any]]: ...
+    def set_stock(self, product_type: str, color: str, size: str, qty: int) -> bool: ...
+    def adjust_stock(self, product_type: str, color: str, size: str,
+                     delta_total: int = 0, delta_reserved: int = 0) -> bool: ...
+    def remove_stock(self, product_type: Optional[str] = None, color: Optional[str] = None,
+                     size: Optional[str] = None) -> int: ...
+    def rename_stock(self, field: str, old_value: str, new_value: str) -> int: ...
+    def import_stock(self, rows: Iterable[Tuple[str, str, str, int]], add: bool = False,
+                     dry_run: bool = False) -> Optional[List[Dict[str, Any]]]: ...
+    
+    # Товары
+    def list_products(self) -> Dict[str, Any]: ...
+    def get_product(self, product_id: str) -> Optional[Dict[str, Any]]: ...
+    def add_product(self, product_id: str, name: str, product_type: str, base_color: str,
+                    sizes: Dict[str, int]) -> bool: ...
+    def toggle_product_status(self, product_id: str) -> bool: ...
+    def get_inventory_summary(self) -> Dict[str, Any]: ...
+    
+    # Заказы
+    def create_order(self, payload: Dict[str, Any]) -> int: ...
+    def orders_by_status(self, status: str) -> List[Dict[str, Any]]: ...
+    def orders_between(self, t0: Union[str, datetime], t1: Union[str, datetime]) -> List[Dict[str, Any]]: ...
+    def order_status_counts(self) -> Dict[str, int]: ...
+    
+    def close(self): ...
+
+
 class JSONStorage:
     """Класс для работы с JSON файлами данных"""
     
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", process_locks: Optional[bool] = None,
+                 write_behind: Optional[bool] = None, codec: Optional[str] = None,
+                 users_layout: Optional[str] = None):
         self.data_dir = data_dir
+        # Формат файлов на диске (STORAGE_CODEC), чтение определяет формат автоматически
+        self.codec = resolve_codec(codec or os.getenv("STORAGE_CODEC", DEFAULT_CODEC))
+        # Межпроцессные блокировки fcntl (STORAGE_PROCESS_LOCKS=1)
+        if process_locks is None:
+            process_locks = _env_flag("STORAGE_PROCESS_LOCKS")
+        self.process_locks = process_locks and fcntl is not None
+        self._file_locks: Dict[str, threading.RLock] = {}
+        self._drafts = threading.local()
+        # Кеш разобранных документов: имя файла -> (сигнатура файла, данные)
+        self._cache: Dict[str, Tuple[Optional[Tuple[int, int, int]], Any]] = {}
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        # Счетчики чтений/записей по файлам (storage.stats())
+        self._stats = StorageStats()
+        # Версия данных: растет при каждой записи, и snapshot() берет срез под _snapshot_lock
+        self._version = 0
+        self._snapshot_lock = threading.RLock()
+        # Индексы чатов, построенные по закешированной версии chats.json
+        self._chat_index_cache: Optional[Tuple[Any, Dict[str, int], Dict[str, List[str]]]] = None
+        # Агрегаты остатков по закешированной версии inventory.json
+        self._inventory_index_cache: Optional[InventoryIndex] = None
+        # Документ и индекс с несохраненными резервами счетчиков для последних изменений
+        self._reserved_document_cache: Optional[Tuple[Any, Dict[str, int], Any]] = None
+        self._reserved_index_cache: Optional[Tuple[InventoryIndex, int, Dict[str, int], InventoryIndex]] = None
+        # Представления только для чтения: имя файла -> (закешированный документ, представление)
+        self._views: Dict[str, Tuple[Any, Any]] = {}
+        self._init_write_behind(write_behind)
+        self._init_stock_counters()
         self._ensure_data_dir()
+        self._recover()
+        self._init_users_layout(users_layout)
         self._init_data_files()
+        self._migrate_inventory()
+        self._init_order_journal()
+        
+        from .order_sequence import OrderIdSequence
+        self._order_sequence = OrderIdSequence(self._load_order_high_water, self._save_order_high_water)
+        self._record_codec()
+    
+    def _init_write_behind(self, write_behind: Optional[bool]):
+        """
+        Отложенная запись (STORAGE_WRITE_BEHIND=1)
+        
+        Изменения попадают в кеш и помечают файл как грязный, фоновый поток
+        сбрасывает их на диск раз в STORAGE_FLUSH_INTERVAL_MS или после
+        STORAGE_FLUSH_MAX_CHANGES изменений.
+        """
+        if write_behind is None:
+            write_behind = _env_flag("STORAGE_WRITE_BEHIND")
+        self.write_behind = write_behind
+        self.flush_interval = int(os.getenv("STORAGE_FLUSH_INTERVAL_MS", "200")) / 1000
+        self.flush_max_changes = int(os.getenv("STORAGE_FLUSH_MAX_CHANGES", "50"))
+        # Грязные файлы: имя файла -> версия несохраненных изменений
+        self._dirty: Dict[str, int] = {}
+        self._dirty_changes = 0
+        self._flush_cond = threading.Condition(self._cache_lock)
+        self._flush_lock = threading.Lock()
+        self._flush_thread: Optional[threading.Thread] = None
+        self._flush_stopped = False
+        
+        if self.write_behind:
+            if self.process_locks:
+                logger.warning("Отложенная запись не защищает от других процессов: STORAGE_PROCESS_LOCKS не поможет")
+            atexit.register(self.flush)
+    
+    def _init_stock_counters(self):
+        """Счетчики резерва SKU с блокировками по полосам (STORAGE_STOCK_COUNTERS=1, см. stock_counters.py)"""
+        self._stock_counters = None
+        if _env_flag("STORAGE_STOCK_COUNTERS"):
+            from .stock_counters import StockCounters
+            self._stock_counters = StockCounters(self)
     
     def _ensure_data_dir(self):
         """Создание папки для данных если не существует"""
@@ -60,208 +355,1083 @@ class JSONStorage:
             os.makedirs(self.data_dir)
             logger.info(f"Создана папка данных: {self.data_dir}")
     
-    def _init_data_files(self):
-        """Инициализация JSON файлов с базовой структурой"""
-        files = {
+    def _recover(self):
+        """Восстановление после сбоя: временные файлы и оборванные документы (см. recovery.py)"""
+        from .recovery import recover_data_dir
+        from .backup import default_backup_dir
+        recover_data_dir(self.data_dir, default_backup_dir(self.data_dir))
+    
+    def _init_users_layout(self, users_layout: Optional[str]):
+        """
+        Раскладка пользователей (STORAGE_USERS_LAYOUT)
+        
+        file - все пользователи в users.json, sharded - файл на пользователя
+        data/users/<первые 2 цифры ID>/<tg_id>.json. Существующий users.json
+        при переходе на sharded раскладывается по файлам и переименовывается
+        в users.json.migrated.
+        """
+        self.users_layout = users_layout or os.getenv("STORAGE_USERS_LAYOUT", "file")
+        if self.users_layout not in ("file", "sharded"):
+            raise ValueError(f"Неизвестная раскладка пользователей: {self.users_layout}")
+        # Индекс ID пользователей sharded раскладки, строится при первом обращении
+        self._user_ids: Optional[set] = None
+        
+        users_path = self._get_filepath("users.json")
+        if self.users_layout != "sharded" or not os.path.exists(users_path):
+            return
+        users = load_json(users_path, None)
+        if users is None:
+            raise StorageError(f"Не удалось прочитать {users_path} для переноса пользователей")
+        for tg_id, user in users.items():
+            user_path = self._get_filepath(self._user_filename(tg_id))
+            os.makedirs(os.path.dirname(user_path), exist_ok=True)
+            if not save_json_atomic(user_path, user, self.codec):
+                raise StorageError(f"Не удалось перенести пользователя {tg_id}")
+        os.replace(users_path, users_path + ".migrated")
+        logger.info(f"Пользователи разложены по файлам: {len(users)}")
+    
+    def _user_filename(self, tg_id: Union[str, int]) -> str:
+        """Файл пользователя в sharded раскладке"""
+        tg_id = str(tg_id)
+        return f"users/{tg_id[:2]}/{tg_id}.json"
+    
+    def _sharded_user_ids(self) -> set:
+        """ID пользователей sharded раскладки (обход data/users только при первом вызове)"""
+        with self._cache_lock:
+            if self._user_ids is not None:
+                return self._user_ids
+        
+        user_ids = set()
+        users_dir = self._get_filepath("users")
+        if os.path.isdir(users_dir):
+            for shard in os.scandir(users_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".json"):
+                        user_ids.add(entry.name[:-len(".json")])
+        
+        with self._cache_lock:
+            if self._user_ids is None:
+                # Пользователи с отложенной записью еще не на диске
+                user_ids.update(os.path.basename(name)[:-len(".json")]
+                                for name in self._dirty if name.startswith("users/"))
+                self._user_ids = user_ids
+            return self._user_ids
+    
+    def _write_sharded_users(self, users: Dict[str, Any]) -> bool:
+        """Запись users.json целиком в sharded раскладке: меняются только отличающиеся файлы"""
+        success = True
+        for tg_id, user in users.items():
+            user_file = self._user_filename(tg_id)
+            if self._load_cached(user_file) != user and not self._write_file(user_file, user):
+                success = False
+        
+        for tg_id in self._sharded_user_ids() - set(users):
+            user_file = self._user_filename(tg_id)
+            try:
+                os.remove(self._get_filepath(user_file))
+            except FileNotFoundError:
+                pass
+            with self._cache_lock:
+                self._cache.pop(user_file, None)
+                self._dirty.pop(user_file, None)
+                self._user_ids.discard(tg_id)
+        return success
+    
+    def _default_files(self) -> Dict[str, Any]:
+        """Базовая структура файлов данных"""
+        return {
             "meta.json": {"next_order_id": 1},
             "users.json": {},
             "chats.json": [],
             "inventory.json": {
+                "schema": INVENTORY_SCHEMA,
+                "sizes": ["S", "M", "L"],
                 "products": {
                     "longsleeve_white": {
                         "name": "Лонгслив белый",
                         "type": "longsleeve",
                         "base_color": "white",
-                        "sizes": {
-                            "S": {"qty_total": 10, "qty_reserved": 0},
-                            "M": {"qty_total": 15, "qty_reserved": 0},
-                            "L": {"qty_total": 12, "qty_reserved": 0}
-                        },
                         "active": True
                     }
                 },
-                "sizes": {
-                    "S": {"colors": {"white": {"qty_total": 10, "qty_reserved": 0}}},
-                    "M": {"colors": {"white": {"qty_total": 15, "qty_reserved": 0}}},
-                    "L": {"colors": {"white": {"qty_total": 12, "qty_reserved": 0}}}
+                "skus": {
+                    sku_key("longsleeve", "white", size): new_sku("longsleeve", "white", size, qty)
+                    for size, qty in (("S", 10), ("M", 15), ("L", 12))
                 }
             },
             "orders.json": []
         }
-        
-        for filename, default_data in files.items():
+    
+    def _init_data_files(self):
+        """Инициализация JSON файлов с базовой структурой"""
+        for filename, default_data in self._default_files().items():
+            if filename == "orders.json":
+                # Заказы хранятся в сегментах журнала заказов
+                continue
+            if filename == "users.json" and self.users_layout == "sharded":
+                continue
             filepath = os.path.join(self.data_dir, filename)
             if not os.path.exists(filepath):
-                save_json_atomic(filepath, default_data)
+                save_json_atomic(filepath, default_data, self.codec)
                 logger.info(f"Создан файл: {filename}")
     
+    def _migrate_inventory(self):
+        """Перевести inventory.json прежних схем на таблицу SKU (см. inventory.migrate_inventory)"""
+        inventory = self._load_cached(INVENTORY_FILE)
+        if isinstance(inventory, dict) and inventory.get("schema") == INVENTORY_SCHEMA:
+            return
+        migrated = migrate_inventory(inventory)
+        if not self._write_file(INVENTORY_FILE, migrated):
+            logger.error("Не удалось перевести inventory.json на таблицу SKU")
+            return
+        logger.info(f"inventory.json переведен на таблицу SKU: {len(migrated['skus'])} SKU, "
+                    f"{len(migrated['sizes'])} размеров")
+    
+    def _init_order_journal(self):
+        """
+        Журнал заказов вместо перезаписи orders.json на каждый заказ
+        
+        Заказы лежат в сегментах data/orders/ по месяцам (STORAGE_ORDER_PARTITION=day —
+        по дням), STORAGE_ORDER_SEGMENTS_GZIP=1 сжимает закрытые сегменты.
+        """
+        from .order_journal import OrderJournal
+        self._order_journal = OrderJournal(
+            self._get_filepath("orders.json"),
+            self._get_filepath("orders.journal.jsonl"),
+            segments_dir=self._get_filepath("orders"),
+            partition=os.getenv("STORAGE_ORDER_PARTITION", "month"),
+            compress_closed=_env_flag("STORAGE_ORDER_SEGMENTS_GZIP"),
+            codec=self.codec,
+            recover=self._recover_file
+        )
+        self._order_journal.start_background_compaction()
+    
+    def _record_codec(self):
+        """
+        Записать формат хранения в meta.json
+        
+        Файлы в прежнем формате продолжают читаться и переходят на новый
+        при следующей записи; сразу конвертировать папку: python -m src.storage_codec.
+        """
+        meta = self._load_cached("meta.json")
+        previous = meta.get("storage_codec", DEFAULT_CODEC)
+        if meta.get("storage_codec") == self.codec:
+            return
+        with self.transaction("meta.json") as meta:
+            meta["storage_codec"] = self.codec
+        self.flush("meta.json")
+        if previous != self.codec:
+            logger.info(f"Формат хранения изменен: {previous} -> {self.codec}")
+    
     def _get_filepath(self, filename: str) -> str:
         """Получение полного пути к файлу"""
         return os.path.join(self.data_dir, filename)
     
-    def _read_file(self, filename: str) -> Any:
-        """Чтение JSON файла"""
+    def _default_data(self, filename: str) -> Any:
+        """Значение по умолчанию для отсутствующего файла"""
+        if filename.startswith("users/"):
+            return None
+        return {} if filename in DICT_DOCUMENTS else []
+    
+    def _file_signature(self, filepath: str) -> Optional[Tuple[int, int, int]]:
+        """Сигнатура файла (mtime, размер, inode) для проверки актуальности кеша"""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    
+    @staticmethod
+    def _stats_name(filename: str) -> str:
+        """Имя файла в статистике (файлы пользователей считаются вместе)"""
+        return "users/*.json" if filename.startswith("users/") else filename
+    
+    def _load_cached(self, filename: str) -> Any:
+        """
+        Получить разобранный документ из кеша
+        
+        Возвращает общий объект кеша - его нельзя изменять.
+        Файл перечитывается только если изменились mtime, размер или inode.
+        """
+        self._stats.count_read(self._stats_name(filename))
+        if filename == "orders.json":
+            return self._order_journal.orders()
+        if filename == "users.json" and self.users_layout == "sharded":
+            users = ((tg_id, self._load_cached(self._user_filename(tg_id)))
+                     for tg_id in sorted(self._sharded_user_ids()))
+            return {tg_id: user for tg_id, user in users if user is not None}
+        
         filepath = self._get_filepath(filename)
-        return load_json(filepath, {} if filename == "users.json" else [])
+        signature = self._file_signature(filepath)
+        
+        with self._cache_lock:
+            entry = self._cache.get(filename)
+            if entry is not None and (filename in self._dirty or
+                                      (signature is not None and entry[0] == signature)):
+                self._cache_hits += 1
+                return entry[1]
+            self._cache_misses += 1
+        
+        started = time.perf_counter()
+        data = self._parse_file(filename, filepath)
+        self._stats.record_parse(self._stats_name(filename), signature[1] if signature else 0,
+                                 time.perf_counter() - started)
+        if signature is not None:
+            with self._cache_lock:
+                self._cache[filename] = (signature, data)
+        return data
+    
+    def _parse_file(self, filename: str, filepath: str) -> Any:
+        """
+        Разбор файла документа
+        
+        Файл, который не удалось разобрать, восстанавливается из резервной
+        копии или откладывается в <файл>.corrupt (см. recovery.recover_file)
+        под блокировкой файла, после чего читается еще раз.
+        """
+        default = self._default_data(filename)
+        try:
+            with open(filepath, 'rb') as f:
+                return decode(f.read())
+        except FileNotFoundError:
+            return default
+        except OSError as e:
+            logger.error(f"Ошибка чтения файла {filepath}: {e}")
+            return default
+        except Exception as e:
+            logger.error(f"Файл {filepath} не разбирается: {e}")
+        
+        with self._file_lock(filename):
+            # Пока ждали блокировку, файл мог перезаписать или восстановить другой поток
+            try:
+                with open(filepath, 'rb') as f:
+                    return decode(f.read())
+            except FileNotFoundError:
+                return default
+            except Exception:
+                pass
+            self._recover_file(filepath)
+            return load_json(filepath, default)
+    
+    def _recover_file(self, filepath: str) -> Optional[str]:
+        """Восстановить поврежденный файл папки данных (см. recovery.recover_file)"""
+        from .recovery import recover_file
+        from .backup import default_backup_dir
+        return recover_file(self.data_dir, os.path.relpath(filepath, self.data_dir), default_backup_dir(self.data_dir))
+    
+    def _read_file(self, filename: str) -> Any:
+        """Чтение JSON файла (возвращает копию, которую можно изменять)"""
+        return _copy_json(self._load_cached(filename))
     
     def _write_file(self, filename: str, data: Any) -> bool:
-        """Запись в JSON файл"""
+        """Запись в JSON файл с обновлением кеша"""
+        self._stats.count_write(self._stats_name(filename))
+        if filename == "orders.json":
+            if not self._order_journal.replace(data):
+                return False
+            self._bump_version()
+            return True
+        if filename == "users.json" and self.users_layout == "sharded":
+            return self._write_sharded_users(data)
+        if filename.startswith("users/"):
+            os.makedirs(os.path.dirname(self._get_filepath(filename)), exist_ok=True)
+            with self._cache_lock:
+                if self._user_ids is not None:
+                    self._user_ids.add(os.path.basename(filename)[:-len(".json")])
+        
+        if self.write_behind:
+            self._mark_dirty(filename, data)
+            return True
+        
         filepath = self._get_filepath(filename)
-        return save_json_atomic(filepath, data)
+        started = time.perf_counter()
+        if not save_json_atomic(filepath, data, self.codec):
+            self.invalidate_cache(filename)
+            return False
+        
+        signature = self._file_signature(filepath)
+        self._stats.record_serialize(self._stats_name(filename), signature[1] if signature else 0,
+                                     time.perf_counter() - started)
+        with self._cache_lock:
+            if signature is not None:
+                self._cache[filename] = (signature, _copy_json(data))
+            else:
+                self._cache.pop(filename, None)
+            self._version += 1
+        return True
     
-    def next_order_id(self) -> int:
-        """Получение следующего ID заказа"""
-        meta_path = self._get_filepath("meta.json")
-        orders_path = self._get_filepath("orders.json")
+    def _mark_dirty(self, filename: str, data: Any):
+        """Положить изменения в кеш и отложить запись на диск"""
+        with self._cache_lock:
+            entry = self._cache.get(filename)
+            self._cache[filename] = (entry[0] if entry else None, _copy_json(data))
+            self._version += 1
+            self._dirty[filename] = self._dirty.get(filename, 0) + 1
+            self._dirty_changes += 1
+            if self._dirty_changes >= self.flush_max_changes:
+                self._flush_cond.notify()
+            if self._flush_thread is None and not self._flush_stopped:
+                self._flush_thread = threading.Thread(target=self._flush_loop, name="storage-flush", daemon=True)
+                self._flush_thread.start()
+    
+    def _flush_loop(self):
+        """Фоновый сброс грязных файлов по таймеру или по числу изменений"""
+        while True:
+            with self._cache_lock:
+                self._flush_cond.wait_for(
+                    lambda: self._flush_stopped or self._dirty_changes >= self.flush_max_changes,
+                    timeout=self.flush_interval
+                )
+                if self._flush_stopped:
+                    return
+                has_dirty = bool(self._dirty)
+            if has_dirty:
+                self.flush()
+    
+    def flush(self, filename: Optional[str] = None) -> bool:
+        """
+        Записать на диск отложенные изменения (всех файлов или одного)
+        
+        Каждый файл пишется через save_json_atomic, поэтому гарантия
+        атомарной замены файла сохраняется.
+        """
+        if filename is None or filename == INVENTORY_FILE:
+            self._sync_stock()
+        with self._flush_lock:
+            with self._cache_lock:
+                pending = {name: (version, self._cache[name][1])
+                           for name, version in self._dirty.items()
+                           if filename is None or name == filename}
+                if filename is None:
+                    self._dirty_changes = 0
+            
+            success = True
+            for name, (version, data) in pending.items():
+                filepath = self._get_filepath(name)
+                started = time.perf_counter()
+                if not save_json_atomic(filepath, data, self.codec):
+                    success = False
+                    continue
+                signature = self._file_signature(filepath)
+                self._stats.record_serialize(self._stats_name(name), signature[1] if signature else 0,
+                                             time.perf_counter() - started)
+                with self._cache_lock:
+                    # Если файл успели изменить во время записи, он остается грязным
+                    if self._dirty.get(name) == version:
+                        del self._dirty[name]
+                        self._cache[name] = (signature, data)
+            return success
+    
+    def _file_lock(self, filename: str) -> threading.RLock:
+        """RLock файла (создается при первом обращении)"""
+        with self._cache_lock:
+            lock = self._file_locks.get(filename)
+            if lock is None:
+                lock = self._file_locks[filename] = threading.RLock()
+            return lock
+    
+    @contextmanager
+    def _process_lock(self, filename: str):
+        """Эксклюзивная fcntl блокировка файла для нескольких процессов"""
+        if not self.process_locks:
+            yield
+            return
+        with open(self._get_filepath(f".{filename.replace('/', '_')}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    @contextmanager
+    def transaction(self, filename: str):
+        """
+        Транзакция чтение-изменение-запись над одним файлом
+        
+        Отдает изменяемую копию документа и записывает ее при выходе без ошибок
+        (если документ изменился). Потоки сериализуются RLock'ом файла, процессы -
+        fcntl блокировкой. Вложенная транзакция по тому же файлу в том же потоке
+        работает с тем же черновиком. При ошибке записи поднимается StorageError.
+        """
+        drafts = getattr(self._drafts, "files", None)
+        if drafts is None:
+            drafts = self._drafts.files = {}
+        if filename in drafts:
+            yield drafts[filename]
+            return
+        
+        with self._file_lock(filename), self._process_lock(filename):
+            original = self._load_cached(filename)
+            draft = _copy_json(original)
+            drafts[filename] = draft
+            try:
+                yield draft
+            finally:
+                del drafts[filename]
+            if draft != original and not self._write_file(filename, draft):
+                raise StorageError(f"Не удалось записать {filename}")
+    
+    @contextmanager
+    def edit(self, filename: str):
+        """
+        Изменяемый черновик документа, который записывается при выходе из блока
         
-        # Пробуем взять из meta
-        meta = load_json(meta_path, {"next_order_id": 1})
-        next_id = meta.get("next_order_id", 1)
+        Единственный способ изменить документ целиком: view() и get_all()
+        для этого не подходят (первый только для чтения, второй - копия,
+        которую никто не сохранит).
+        """
+        with self.transaction(filename) as draft:
+            yield draft
+    
+    def view(self, filename: str) -> Any:
+        """
+        Документ только для чтения без копирования
         
-        # Если нет в meta, вычисляем из orders
-        if next_id == 1:
-            orders = load_json(orders_path, [])
-            if orders:
-                max_id = max(order.get("id", 0) for order in orders)
-                next_id = max_id + 1
+        Словари отдаются как MappingProxyType, списки - как tuple. Представление
+        строится один раз на версию закешированного документа, поэтому повторные
+        чтения не выделяют память. Для изменений используйте edit().
+        """
+        if filename == "orders.json":
+            # Заказы журнал изменяет на месте - представление строится по срезу
+            return _freeze(self._order_journal.snapshot())
+        if filename == "users.json" and self.users_layout == "sharded":
+            # Пользователи читаются по одному при обходе
+            return self.get_all(filename)
+        if filename == INVENTORY_FILE:
+            return self._frozen(filename, self._inventory_document())
+        return self._frozen(filename, self._load_cached(filename))
+    
+    def _frozen(self, filename: str, data: Any) -> Any:
+        """Представление закешированного документа (одно на его версию)"""
+        with self._cache_lock:
+            entry = self._views.get(filename)
+            if entry is not None and entry[0] is data:
+                return entry[1]
+        frozen = _freeze(data)
+        with self._cache_lock:
+            self._views[filename] = (data, frozen)
+        return frozen
+    
+    def invalidate_cache(self, filename: Optional[str] = None):
+        """Сбросить кеш одного файла или всех файлов (кроме несохраненных изменений)"""
+        with self._cache_lock:
+            names = list(self._cache.keys()) if filename is None else [filename]
+            for name in names:
+                if name not in self._dirty:
+                    self._cache.pop(name, None)
+            if filename is None:
+                # Пользователей могли добавить другие процессы
+                self._user_ids = None
+    
+    def snapshot(self) -> StorageSnapshot:
+        """
+        Срез users, chats, inventory, orders, settings и meta только для чтения
         
-        # Обновляем meta
-        meta["next_order_id"] = next_id + 1
-        save_json_atomic(meta_path, meta)
+        Срез собирается из закешированных документов (запись подменяет документ
+        в кеше, а не изменяет его) и их представлений из view(), поэтому
+        писатели не ждут, пока читатель строит статистику. Каждый документ -
+        целая версия, пакетная запись update_many попадает в срез целиком
+        (она одна берет _snapshot_lock). Заказы копируются поверхностно
+        под блокировкой журнала.
+        """
+        with self._snapshot_lock:
+            documents = {filename: self._load_cached(filename)
+                         for filename in SNAPSHOT_DOCUMENTS if filename not in ("orders.json", INVENTORY_FILE)}
+            documents[INVENTORY_FILE] = self._inventory_document()
+            orders = self._order_journal.snapshot()
+            with self._cache_lock:
+                version = self._version
+        documents = {filename: self._frozen(filename, data) for filename, data in documents.items()}
+        documents["orders.json"] = _freeze(orders)
+        return StorageSnapshot(version, documents)
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """Статистика кеша: попадания, промахи, число закешированных и несохраненных файлов"""
+        with self._cache_lock:
+            return {
+                "hits": self._cache_hits,
+                "misses": self._cache_misses,
+                "files": len(self._cache),
+                "dirty": len(self._dirty)
+            }
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика ввода-вывода: счетчики, байты и гистограммы времени по файлам
         
-        return next_id
+        reads/writes - обращения к документу, parses/serializes - фактическое
+        чтение с диска и запись на диск.
+        """
+        stats = {"files": self._stats.as_dict(), "cache": self.cache_stats()}
+        if self._stock_counters is not None:
+            stats["stock_counters"] = self._stock_counters.stats()
+        return stats
+    
+    def _load_order_high_water(self) -> int:
+        """Граница выданных ID заказов из meta.json (не меньше максимального ID заказа)"""
+        meta = self._load_cached("meta.json")
+        next_id = meta.get("next_order_id", 1) if isinstance(meta, dict) else 1
+        return max(next_id, self._order_journal.max_order_id() + 1)
+    
+    def _save_order_high_water(self, value: int) -> bool:
+        """Сохранить границу выданных ID заказов в meta.json"""
+        try:
+            with self.transaction("meta.json") as meta:
+                meta["next_order_id"] = value
+        except StorageError:
+            return False
+        # Граница должна попасть на диск сразу, иначе после падения ID повторятся
+        return self.flush("meta.json")
+    
+    def next_order_id(self) -> int:
+        """Получение следующего ID заказа"""
+        return self._order_sequence.next_id()
     
     # Утилиты для пользователей
     def get_or_create_user(self, tg_user) -> Dict[str, Any]:
         """Получить или создать пользователя"""
-        users = self._read_file("users.json")
         tg_id = str(tg_user.id)
+        if self.users_layout == "sharded":
+            return self._get_or_create_sharded_user(tg_user)
         
-        if tg_id not in users:
-            users[tg_id] = {
-                "username": tg_user.username or "",
-                "first_name": tg_user.first_name or "",
-                "last_name": tg_user.last_name or "",
-                "total_orders": 0,
-                "created_at": datetime.now().isoformat()
-            }
-            self._write_file("users.json", users)
+        cached_users = self._load_cached("users.json")
+        if tg_id in cached_users:
+            return _copy_json(cached_users[tg_id])
+        
+        with self.transaction("users.json") as users:
+            if tg_id not in users:
+                users[tg_id] = self._new_user(tg_user)
+            user = _copy_json(users[tg_id])
         
-        return users[tg_id]
+        return user
+    
+    def _new_user(self, tg_user) -> Dict[str, Any]:
+        """Запись нового пользователя"""
+        return {
+            "username": tg_user.username or "",
+            "first_name": tg_user.first_name or "",
+            "last_name": tg_user.last_name or "",
+            "total_orders": 0,
+            "created_at": datetime.now().isoformat()
+        }
+    
+    def _get_or_create_sharded_user(self, tg_user) -> Dict[str, Any]:
+        user_file = self._user_filename(tg_user.id)
+        user = self._load_cached(user_file)
+        if user is None:
+            with self._file_lock(user_file), self._process_lock(user_file):
+                user = self._load_cached(user_file)
+                if user is None:
+                    user = self._new_user(tg_user)
+                    if not self._write_file(user_file, user):
+                        raise StorageError(f"Не удалось записать {user_file}")
+        return _copy_json(user)
     
     def inc_total_orders(self, tg_id: Union[str, int]) -> int:
         """Увеличить счетчик заказов пользователя"""
-        users = self._read_file("users.json")
         tg_id_str = str(tg_id)
         
-        if tg_id_str in users:
+        if self.users_layout == "sharded":
+            with self.transaction(self._user_filename(tg_id_str)) as user:
+                if user is None:
+                    return 0
+                user["total_orders"] = user.get("total_orders", 0) + 1
+                return user["total_orders"]
+        
+        with self.transaction("users.json") as users:
+            if tg_id_str not in users:
+                return 0
             users[tg_id_str]["total_orders"] = users[tg_id_str].get("total_orders", 0) + 1
-            self._write_file("users.json", users)
-            return users[tg_id_str]["total_orders"]
-        return 0
+            total_orders = users[tg_id_str]["total_orders"]
+        return total_orders
     
     # Утилиты для чатов
     def list_active_chats(self) -> List[Dict[str, Any]]:
         """Список активных чатов"""
-        chats = self._read_file("chats.json")
-        return [chat for chat in chats if chat.get("active", True)]
+        chats = self._load_cached("chats.json")
+        return [_copy_json(chat) for chat in chats if chat.get("active", True)]
     
     def add_chat(self, chat_data: Dict[str, Any]) -> bool:
         """Добавить новый чат"""
-        chats = self._read_file("chats.json")
-        chats.append(chat_data)
-        return self._write_file("chats.json", chats)
+        try:
+            with self.transaction("chats.json") as chats:
+                chats.append(chat_data)
+        except StorageError:
+            return False
+        return True
+    
+    def _chat_index(self) -> Tuple[List[Dict[str, Any]], Dict[str, int], Dict[str, List[str]]]:
+        """
+        Индексы чатов: chat_id -> позиция в chats.json и префикс -> chat_id активных чатов
+        
+        Перестраиваются, когда в кеше появляется новая версия chats.json
+        (после записи или изменения файла на диске).
+        """
+        chats = self._load_cached("chats.json")
+        with self._cache_lock:
+            index = self._chat_index_cache
+        if index is not None and index[0] is chats:
+            return index
+        
+        by_id: Dict[str, int] = {}
+        by_prefix: Dict[str, List[str]] = {}
+        for position, chat in enumerate(chats):
+            chat_id_str = str(chat.get("chat_id"))
+            by_id.setdefault(chat_id_str, position)
+            if chat.get("prefix") and chat.get("active", True):
+                by_prefix.setdefault(chat["prefix"], []).append(chat_id_str)
+        
+        index = (chats, by_id, by_prefix)
+        with self._cache_lock:
+            self._chat_index_cache = index
+        return index
+    
+    def _find_chat_position(self, chats: List[Dict[str, Any]], chat_id_str: str) -> Optional[int]:
+        """Позиция чата в черновике chats.json по индексу"""
+        position = self._chat_index()[1].get(chat_id_str)
+        if position is None:
+            return None
+        if position < len(chats) and str(chats[position].get("chat_id")) == chat_id_str:
+            return position
+        # Индекс построен по другой версии файла
+        for position, chat in enumerate(chats):
+            if str(chat.get("chat_id")) == chat_id_str:
+                return position
+        return None
     
     def update_chat(self, chat_id: Union[str, int], updated_data: Dict[str, Any]) -> bool:
         """Обновить существующий чат"""
-        chats = self._read_file("chats.json")
         chat_id_str = str(chat_id)
         
-        for i, chat in enumerate(chats):
-            if str(chat.get("chat_id")) == chat_id_str:
-                chats[i].update(updated_data)
-                return self._write_file("chats.json", chats)
-        return False
+        try:
+            with self.transaction("chats.json") as chats:
+                position = self._find_chat_position(chats, chat_id_str)
+                if position is None:
+                    return False
+                chats[position].update(updated_data)
+        except StorageError:
+            return False
+        return True
     
     def delete_chat(self, chat_id: Union[str, int]) -> bool:
         """Удалить чат по ID"""
-        chats = self._read_file("chats.json")
         chat_id_str = str(chat_id)
         
-        for i, chat in enumerate(chats):
-            if str(chat.get("chat_id")) == chat_id_str:
-                del chats[i]
-                return self._write_file("chats.json", chats)
-        return False
+        try:
+            with self.transaction("chats.json") as chats:
+                position = self._find_chat_position(chats, chat_id_str)
+                if position is None:
+                    return False
+                del chats[position]
+        except StorageError:
+            return False
+        return True
     
     def get_chat(self, chat_id: Union[str, int]) -> Optional[Dict[str, Any]]:
         """Получить чат по ID"""
-        chats = self._read_file("chats.json")
-        chat_id_str = str(chat_id)
-        
-        for chat in chats:
-            if str(chat.get("chat_id")) == chat_id_str:
-                return chat
-        return None
+        chats, by_id, _ = self._chat_index()
+        position = by_id.get(str(chat_id))
+        return _copy_json(chats[position]) if position is not None else None
     
     def get_prefix(self, chat_id: Union[str, int]) -> Optional[str]:
         """Получить префикс чата"""
-        chats = self._read_file("chats.json")
-        chat_id_str = str(chat_id)
-        
-        for chat in chats:
-            if str(chat.get("chat_id")) == chat_id_str:
-                return chat.get("prefix")
+        chats, by_id, _ = self._chat_index()
+        position = by_id.get(str(chat_id))
+        return chats[position].get("prefix") if position is not None else None
+    
+    def find_chat_by_prefix(self, prefix: str, exclude_chat_id: Union[str, int, None] = None) -> Optional[Dict[str, Any]]:
+        """Найти активный чат с префиксом (кроме exclude_chat_id)"""
+        chats, by_id, by_prefix = self._chat_index()
+        for chat_id_str in by_prefix.get(prefix, []):
+            if exclude_chat_id is None or chat_id_str != str(exclude_chat_id):
+                return _copy_json(chats[by_id[chat_id_str]])
         return None
     
+    def used_prefixes(self) -> set:
+        """Префиксы активных чатов"""
+        return set(self._chat_index()[2].keys())
+    
     def list_common_chats(self) -> List[Dict[str, Any]]:
         """Список общих чатов"""
-        chats = self._read_file("chats.json")
-        return [chat for chat in chats if chat.get("is_common", False) and chat.get("active", True)]
+        chats = self._load_cached("chats.json")
+        return [_copy_json(chat) for chat in chats if chat.get("is_common", False) and chat.get("active", True)]
+    
+    # === ОСТАТКИ (таблица SKU вид/цвет/размер, см. inventory.py) ===
+    
+    def _sync_stock(self):
+        """Записать несохраненные изменения счетчиков резерва перед изменением остатков"""
+        counters = self._stock_counters
+        if counters is not None and counters.dirty():
+            counters.flush()
+    
+    def _pending_reserved(self) -> Tuple[Any, Dict[str, int]]:
+        """
+        Закешированный inventory.json и несохраненные изменения резерва счетчиков
+        
+        Если счетчики записались между чтением документа и изменений,
+        пара читается заново - резерв не теряется и не считается дважды.
+        """
+        counters = self._stock_counters
+        while True:
+            flushes = counters.flushes if counters is not None else 0
+            inventory = self._load_cached(INVENTORY_FILE)
+            if counters is None or not counters.dirty():
+                return inventory, {}
+            deltas = counters.pending()
+            if counters.flushes == flushes:
+                return inventory, deltas
+    
+    def _inventory_document(self) -> Any:
+        """
+        inventory.json с несохраненными резервами счетчиков (общий объект, не изменять)
+        
+        Измененные SKU копируются поверх закешированного документа, копия
+        кешируется до следующего изменения документа или резервов.
+        """
+        inventory, deltas = self._pending_reserved()
+        if not deltas:
+            return inventory
+        with self._cache_lock:
+            entry = self._reserved_document_cache
+        if entry is not None and entry[0] is inventory and entry[1] == deltas:
+            return entry[2]
+        skus = dict(inventory.get("skus", {}))
+        for key, delta in deltas.items():
+            if key in skus:
+                skus[key] = dict(skus[key], qty_reserved=skus[key]["qty_reserved"] + delta)
+        document = dict(inventory, skus=skus)
+        with self._cache_lock:
+            self._reserved_document_cache = (inventory, deltas, document)
+        return document
+    
+    def _inventory_index(self) -> InventoryIndex:
+        """Агрегаты остатков с учетом несохраненных резервов счетчиков (файл не пишется)"""
+        inventory, deltas = self._pending_reserved()
+        index = self._stock_index(inventory)
+        if not deltas:
+            return index
+        with self._cache_lock:
+            entry = self._reserved_index_cache
+        if entry is not None and entry[0] is index and entry[1] == index.generation and entry[2] == deltas:
+            return entry[3]
+        reserved = index.with_reserved(deltas)
+        with self._cache_lock:
+            self._reserved_index_cache = (index, index.generation, deltas, reserved)
+        return reserved
+    
+    def _stock_index(self, inventory: Any = None) -> InventoryIndex:
+        """Агрегаты остатков по текущей версии inventory.json (перестраиваются при ее смене)"""
+        if inventory is None:
+            inventory = self._load_cached(INVENTORY_FILE)
+        with self._cache_lock:
+            index = self._inventory_index_cache
+        if index is not None and index.source is inventory:
+            return index
+        index = InventoryIndex(inventory)
+        with self._cache_lock:
+            self._inventory_index_cache = index
+        return index
+    
+    @contextmanager
+    def _stock_draft(self):
+        """
+        Транзакция над inventory.json с точечным обновлением агрегатов
+        
+        После записи изменения счетчиков переносятся в индекс по разнице,
+        а добавление и удаление SKU или размеров сбрасывает индекс.
+        """
+        with self._file_lock(INVENTORY_FILE):
+            self._sync_stock()
+            index = self._stock_index()
+            with self.transaction(INVENTORY_FILE) as inventory:
+                draft = StockDraft(inventory, index)
+                yield draft
+            current = self._load_cached(INVENTORY_FILE)
+            if current is index.source:
+                # Ничего не записано (или изменения во внешней транзакции)
+                return
+            with self._cache_lock:
+                if draft.structural or self._inventory_index_cache is not index:
+                    self._inventory_index_cache = None
+                else:
+                    index.apply(draft.changes())
+                    index.source = current
     
-    # Утилиты для инвентаря
     def list_sizes(self) -> List[str]:
-        """Список доступных размеров"""
-        inventory = self._read_file("inventory.json")
-        return list(inventory.get("sizes", {}).keys())
+        """Список размеров в порядке добавления"""
+        return list(self._inventory_index().sizes)
     
     def list_colors(self, size: str) -> List[str]:
-        """Список доступных цветов для размера"""
-        inventory = self._read_file("inventory.json")
-        size_data = inventory.get("sizes", {}).get(size, {})
-        return list(size_data.get("colors", {}).keys())
+        """Список цветов, которые есть в остатках размера"""
+        return self._inventory_index().colors(size)
+    
+    def add_size(self, size: str) -> bool:
+        """Добавить размер в список размеров (False - уже есть)"""
+        try:
+            with self._stock_draft() as draft:
+                return draft.add_size(size)
+        except StorageError:
+            return False
+                
+    def remove_size(self, size: str) -> bool:
+        """Удалить размер вместе с его остатками"""
+        try:
+            with self._stock_draft() as draft:
+                if not draft.remove_size(size):
+                    return False
+                for sku in [sku for sku in draft.skus.values() if sku["size"] == size]:
+                    draft.remove(sku)
+        except StorageError:
+            return False
+        return True
+    
+    def available(self, size: Optional[str] = None, color: Optional[str] = None) -> int:
+        """Доступно (qty_total - qty_reserved) по размеру, цвету, паре или всего"""
+        return self._inventory_index().available(size, color)
+    
+    def availability(self) -> AvailabilityMatrix:
+        """
+        Матрица доступности по размерам и цветам для выбора в заказе
+        
+        Кешируется в индексе остатков и сбрасывается только при изменении
+        счетчиков или самого inventory.json.
+        """
+        return self._inventory_index().availability()
     
     def reserve(self, size: str, color: str, qty: int = 1) -> bool:
-        """Зарезервировать товар"""
-        inventory = self._read_file("inventory.json")
-        size_data = inventory.get("sizes", {}).get(size, {})
-        color_data = size_data.get("colors", {}).get(color, {})
-        
-        if color_data.get("qty_total", 0) - color_data.get("qty_reserved", 0) >= qty:
-            color_data["qty_reserved"] = color_data.get("qty_reserved", 0) + qty
-            self._write_file("inventory.json", inventory)
-            return True
+        """Зарезервировать товар размера и цвета (первый SKU, где хватает остатка)"""
+        if self._stock_counters is not None:
+            return any(self._stock_counters.try_reserve(key, qty) for key in self._stock_index().keys(size, color))
+        try:
+            with self._stock_draft() as draft:
+                for sku in draft.find(size, color):
+                    if sku["qty_total"] - sku["qty_reserved"] >= qty:
+                        draft.set_counters(sku, sku["qty_total"], sku["qty_reserved"] + qty)
+                        return True
+        except StorageError:
+            pass
         return False
     
     def release(self, size: str, color: str, qty: int = 1) -> bool:
-        """Освободить зарезервированный товар"""
-        inventory = self._read_file("inventory.json")
-        size_data = inventory.get("sizes", {}).get(size, {})
-        color_data = size_data.get("colors", {}).get(color, {})
-        
-        if color_data.get("qty_reserved", 0) >= qty:
-            color_data["qty_reserved"] = color_data.get("qty_reserved", 0) - qty
-            self._write_file("inventory.json", inventory)
-            return True
+        """Освободить зарезервированный товар размера и цвета (SKU в порядке, обратном reserve)"""
+        if self._stock_counters is not None:
+            return any(self._stock_counters.try_release(key, qty)
+                       for key in reversed(self._stock_index().keys(size, color)))
+        try:
+            with self._stock_draft() as draft:
+                for sku in reversed(draft.find(size, color)):
+                    if sku["qty_reserved"] >= qty:
+                        draft.set_counters(sku, sku["qty_total"], sku["qty_reserved"] - qty)
+                        return True
+        except StorageError:
+            pass
         return False
+                
+    def try_reserve(self, sku: str, qty: int = 1) -> bool:
+        """Атомарно зарезервировать qty единиц SKU (ключ sku_key), если хватает остатка"""
+        if self._stock_counters is not None:
+            return self._stock_counters.try_reserve(sku, qty)
+        return self._adjust_reserved(sku, qty)
     
-    # Утилиты для заказов
-    def create_order(self, payload: Dict[str, Any]) -> int:
-        """Создать новый заказ"""
-        orders = self._read_file("orders.json")
+    def try_release(self, sku: str, qty: int = 1) -> bool:
+        """Атомарно освободить qty единиц резерва SKU"""
+        if self._stock_counters is not None:
+            return self._stock_counters.try_release(sku, qty)
+        return self._adjust_reserved(sku, -qty)
+    
+    def _adjust_reserved(self, key: str, delta: int) -> bool:
+        try:
+            with self._stock_draft() as draft:
+                sku = draft.skus.get(key)
+                if sku is None or not 0 <= sku["qty_reserved"] + delta <= sku["qty_total"]:
+                    return False
+                draft.set_counters(sku, sku["qty_total"], sku["qty_reserved"] + delta)
+        except StorageError:
+            return False
+        return True
+    
+    def _sku_counters(self, key: str) -> Optional[Tuple[int, int]]:
+        """(qty_total, qty_reserved) SKU по закешированному документу без учета счетчиков"""
+        sku = self._load_cached(INVENTORY_FILE).get("skus", {}).get(key)
+        return (sku["qty_total"], sku["qty_reserved"]) if sku is not None else None
+    
+    def _apply_reserved(self, deltas: Dict[str, int]) -> Optional[List[str]]:
+        """
+        Перенести изменения резерва из счетчиков в inventory.json одной транзакцией
         
-        order_id = self.next_order_id()
-        order = {
+        Изменение, после которого резерв вышел бы за 0..qty_total (остаток
+        поменяли в обход счетчиков), не применяется и пишется в лог.
+        Возвращает отклоненные SKU или None при ошибке записи.
+        """
+        rejected = []
+        try:
+            with self._stock_draft() as draft:
+                for key, delta in deltas.items():
+                    if not delta:
+                        continue
+                    sku = draft.skus.get(key)
+                    if sku is None or not 0 <= sku["qty_reserved"] + delta <= sku["qty_total"]:
+                        counters = (sku["qty_total"], sku["qty_reserved"]) if sku is not None else None
+                        logger.error(f"Резерв {key} {delta:+d} вне остатка {counters}, изменение отклонено")
+                        rejected.append(key)
+                        continue
+                    draft.set_counters(sku, sku["qty_total"], sku["qty_reserved"] + delta)
+        except StorageError:
+            return None
+        return rejected
+    
+    def get_stock(self, product_type: str, color: str, size: str) -> Optional[Dict[str, Any]]:
+        """Остаток SKU с qty_available или None"""
+        key = sku_key(product_type, color, size)
+        inventory, deltas = self._pending_reserved()
+        sku = inventory.get("skus", {}).get(key)
+        if sku is None:
+            return None
+        if key in deltas:
+            sku = dict(sku, qty_reserved=sku["qty_reserved"] + deltas[key])
+        return stock_record(sku)
+    
+    def list_stock(self) -> List[Dict[str, Any]]:
+        """Все SKU с qty_available"""
+        return [stock_record(sku) for sku in self._inventory_document().get("skus", {}).values()]
+    
+    def set_stock(self, product_type: str, color: str, size: str, qty: int) -> bool:
+        """Установить qty_total SKU (резерв не больше нового остатка), SKU создается при необходимости"""
+        qty = max(0, qty)
+        try:
+            with self._stock_draft() as draft:
+                sku = draft.get(product_type, color, size)
+                if sku is None:
+                    draft.add(product_type, color, size, qty)
+                else:
+                    draft.set_counters(sku, qty, min(sku["qty_reserved"], qty))
+        except StorageError:
+            return False
+        return True
+    
+    def adjust_stock(self, product_type: str, color: str, size: str,
+                     delta_total: int = 0, delta_reserved: int = 0) -> bool:
+        """
+        Изменить счетчики SKU на delta_total/delta_reserved
+        
+        Отказывает, если резерв станет отрицательным или больше остатка.
+        Отсутствующий SKU создается только при поступлении (delta_total > 0).
+        """
+        try:
+            with self._stock_draft() as draft:
+                sku = draft.get(product_type, color, size)
+                if sku is None:
+                    if delta_total <= 0 or delta_reserved:
+                        return False
+                    draft.add(product_type, color, size, delta_total)
+                    return True
+                qty_total = sku["qty_total"] + delta_total
+                qty_reserved = sku["qty_reserved"] + delta_reserved
+                if qty_reserved < 0 or qty_reserved > qty_total:
+                    return False
+                draft.set_counters(sku, qty_total, qty_reserved)
+        except StorageError:
+            return False
+        return True
+    
+    def remove_stock(self, product_type: Optional[str] = None, color: Optional[str] = None,
+                     size: Optional[str] = None) -> int:
+        """Удалить SKU по виду, цвету и/или размеру, возвращает число удаленных"""
+        match = {"type": product_type, "color": color, "size": size}
+        match = {field: value for field, value in match.items() if value is not None}
+        if not match:
+            return 0
+        try:
+            with self._stock_draft() as draft:
+                removed = [sku for sku in draft.skus.values()
+                           if all(sku[field] == value for field, value in match.items())]
+                for sku in removed:
+                    draft.remove(sku)
+        except StorageError:
+            return 0
+        return len(removed)
+    
+    def rename_stock(self, field: str, old_value: str, new_value: str) -> int:
+        """
+        Переименовать вид, цвет или размер (field: type/color/size) во всех SKU
+        
+        Совпавшие после переименования SKU складываются. Товары и список
+        размеров переименовываются вместе с остатками.
+        """
+        if field not in SKU_FIELDS:
+            raise ValueError(f"Неизвестное поле SKU: {field}")
+        try:
+            with self._stock_draft() as draft:
+                renamed = [sku for sku in draft.skus.values() if sku[field] == old_value]
+                for sku in renamed:
+                    draft.remove(sku)
+                    values = {name: sku[name] for name in SKU_FIELDS}
+                    values[field] = new_value
+                    target = draft.get(values["type"], values["color"], values["size"])
+                    if target is None:
+                        target = draft.add(values["type"], values["color"], values["size"])
+                    target["qty_total"] += sku["qty_total"]
+                    target["qty_reserved"] += sku["qty_reserved"]
+                
+                if field == "size":
+                    draft.rename_size(old_value, new_value)
+                product_field = {"type": "type", "color": "base_color"}.get(field)
+                for product in draft.products.values():
+                    if product_field and product.get(product_field) == old_value:
+                        product[product_field] = new_value
+        except StorageError:
+            return 0
+        return len(renamed)
+    
+    def import_stock(self, rows: Iterable[Tuple[str, str, str, int]], add: bool = False,
+                     dry_run: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """
+        Загрузить таблицу остатков (вид, цвет, размер, количество) одной записью
+        
+        Количество становится qty_total SKU (add=True - прибавляется к нему),
+        резерв не больше нового остатка, недостающие SKU создаются. Возвращает
+        изменившиеся SKU с полями before/after (before=None - новый SKU)
+        или None при ошибке записи. dry_run=True только считает изменения.
+        """
+        if dry_run:
+            return self._import_changes(self.view(INVENTORY_FILE).get("skus", {}), rows, add)
+        try:
+            with self._stock_draft() as draft:
+                changes = self._import_changes(draft.skus, rows, add)
+                for change in changes:
+                    sku = draft.get(change["type"], change["color"], change["size"])
+                    if sku is None:
+                        draft.add(change["type"], change["color"], change["size"], change["after"])
+                    else:
+                        draft.set_counters(sku, change["after"], min(sku["qty_reserved"], change["after"]))
+        except StorageError:
+            return None
+        return changes
+    
+    @staticmethod
+    def _import_changes(skus: Mapping[str, Any], rows: Iterable[Tuple[str, str, str, int]],
+                        add: bool) -> List[Dict[str, Any]]:
+        """Изменения SKU от строк импорта (сам документ не меняется)"""
+        changes: Dict[str, Dict[str, Any]] = {}
+        for product_type, color, size, qty in rows:
+            key = sku_key(product_type, color, size)
+            sku = skus.get(key)
+            before = sku["qty_total"] if sku is not None else None
+            change = changes.setdefault(key, {"type": product_type, "color": color, "size": size,
+                                              "before": before, "after": before})
+            change["after"] = max(0, (change["after"] or 0) + qty if add else qty)
+        return [change for change in changes.values() if change["after"] != change["before"]]
+    
+    # Утилиты для заказов
+    def _bump_version(self):
+        with self._cache_lock:
+            self._version += 1
+    
+    def _build_order(self, order_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Сформировать запись нового заказа"""
+        return {
             "id": order_id,
             "user_tg_id": payload["user_tg_id"],
             "size": payload["size"],
@@ -271,90 +1441,224 @@ class JSONStorage:
             "created_at": datetime.now().isoformat(),
             "deliveries": []
         }
-        
-        orders.append(order)
-        self._write_file("orders.json", orders)
-        
+    
+    def create_order(self, payload: Dict[str, Any]) -> int:
+        """Создать новый заказ"""
+        order_id = self.next_order_id()
+        self._order_journal.create(self._build_order(order_id, payload))
+        self._bump_version()
         return order_id
     
     def append_delivery(self, order_id: int, chat_id: Union[str, int], prefix: str, message_id: int) -> bool:
         """Добавить информацию о доставке заказа"""
-        orders = self._read_file("orders.json")
-        
-        for order in orders:
-            if order.get("id") == order_id:
-                delivery = {
-                    "chat_id": str(chat_id),
-                    "prefix": prefix,
-                    "message_id": message_id
-                }
-                order["deliveries"].append(delivery)
-                order["status"] = "sent"
-                self._write_file("orders.json", orders)
-                return True
-        
-        return False
+        delivery = {
+            "chat_id": str(chat_id),
+            "prefix": prefix,
+            "message_id": message_id
+        }
+        if not self._order_journal.append_delivery(order_id, delivery):
+            return False
+        self._bump_version()
+        return True
+    
+    def set_order_status(self, order_id: int, status: str) -> bool:
+        """Изменить статус заказа"""
+        if not self._order_journal.set_status(order_id, status):
+            return False
+        self._bump_version()
+        return True
+    
+    def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
+        """Получить заказ по ID"""
+        return self._order_journal.get(order_id)
+    
+    def orders_by_user(self, user_tg_id: Union[str, int]) -> List[Dict[str, Any]]:
+        """Заказы пользователя по времени создания"""
+        return self._order_journal.by_user(user_tg_id)
+    
+    def orders_by_status(self, status: str) -> List[Dict[str, Any]]:
+        """Заказы в статусе по времени создания"""
+        return self._order_journal.by_status(status)
+    
+    def orders_by_chat(self, chat_id: Union[str, int]) -> List[Dict[str, Any]]:
+        """Заказы, доставленные в чат, по времени создания"""
+        return self._order_journal.by_chat(chat_id)
+    
+    def orders_between(self, t0: Union[str, datetime], t1: Union[str, datetime]) -> List[Dict[str, Any]]:
+        """Заказы, созданные в интервале [t0, t1), по времени создания"""
+        return self._order_journal.between(t0, t1)
+    
+    def order_status_counts(self) -> Dict[str, int]:
+        """Количество заказов по статусам"""
+        return self._order_journal.status_counts()
+    
+    def close(self):
+        """Завершение работы: сбрасываем отложенные записи и сворачиваем журнал заказов"""
+        if self._stock_counters is not None:
+            self._stock_counters.stop()
+        with self._cache_lock:
+            self._flush_stopped = True
+            self._flush_cond.notify_all()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout=5)
+            self._flush_thread = None
+        self.flush()
+        self._order_journal.close()
+        self._stats.close()
     
     # Устаревшие методы для совместимости
     def get_all(self, filename: str) -> Any:
         """Получить все данные из файла"""
+        if filename == "users.json" and self.users_layout == "sharded":
+            # Пользователи читаются по одному при обходе
+            return _KeyedView(self, filename, self._sharded_user_ids)
+        if filename == INVENTORY_FILE:
+            return _copy_json(self._inventory_document())
         return self._read_file(filename)
     
     def get(self, filename: str, key: str) -> Optional[Any]:
         """Получить значение по ключу (только для users.json)"""
         if filename == "users.json":
-            users = self._read_file(filename)
-            return users.get(key)
+            if self.users_layout == "sharded":
+                return _copy_json(self._load_cached(self._user_filename(key)))
+            users = self._load_cached(filename)
+            return _copy_json(users.get(key))
         return None
     
     def set(self, filename: str, key: str, value: Any) -> bool:
         """Установить значение по ключу (только для users.json)"""
+        if filename == "users.json" and self.users_layout == "sharded":
+            user_file = self._user_filename(key)
+            with self._file_lock(user_file), self._process_lock(user_file):
+                return self._write_file(user_file, value)
         if filename == "users.json":
-            users = self._read_file(filename)
-            users[key] = value
-            return self._write_file(filename, users)
+            try:
+                with self.transaction(filename) as users:
+                    users[key] = value
+            except StorageError:
+                return False
+            return True
         return False
     
-    # Функции управления товарами
+    # Пакетные операции
+    def get_many(self, filename: str, keys: List[Union[str, int]]) -> Dict[str, Any]:
+        """
+        Получить несколько записей одним чтением
+        
+        Для словарных документов ключ - ключ словаря, для chats.json - chat_id.
+        Отсутствующие записи возвращаются как None.
+        """
+        keys = [str(key) for key in keys]
+        if filename == "users.json" and self.users_layout == "sharded":
+            return {key: self.get(filename, key) for key in keys}
+        if filename == "chats.json":
+            chats, by_id, _ = self._chat_index()
+            return {key: _copy_json(chats[by_id[key]]) if key in by_id else None for key in keys}
+        document = self._load_cached(filename)
+        return {key: _copy_json(document.get(key)) for key in keys}
+    
+    def set_many(self, filename: str, items: Dict[Union[str, int], Any]) -> bool:
+        """Записать несколько записей словарного документа одной записью файла"""
+        return self.update_many({filename: items}, replace=True)
+    
+    def update_many(self, changes: Dict[str, Dict[Union[str, int], Dict[str, Any]]],
+                    replace: bool = False) -> bool:
+        """
+        Изменить записи в одном или нескольких документах
+        
+        changes: {файл: {ключ: поля}}. Поля дописываются в существующие записи
+        (отсутствующие записи пропускаются), при replace=True записи заменяются
+        целиком. Каждый файл читается и записывается один раз; все документы
+        блокируются на время изменения, поэтому записи видны вместе.
+        """
+        try:
+            with ExitStack() as stack:
+                # Срез не должен увидеть только часть пакета
+                stack.enter_context(self._snapshot_lock)
+                # Блокируем файлы в одном порядке, чтобы не было взаимоблокировок
+                for filename in sorted(changes):
+                    records = {str(key): value for key, value in changes[filename].items()}
+                    if filename == "users.json" and self.users_layout == "sharded":
+                        self._update_sharded_users(stack, records, replace)
+                    elif filename == "chats.json":
+                        self._update_chats(stack.enter_context(self.transaction(filename)), records, replace)
+                    else:
+                        document = stack.enter_context(self.transaction(filename))
+                        for key, value in records.items():
+                            if replace:
+                                document[key] = value
+                            elif isinstance(document.get(key), dict):
+                                document[key].update(value)
+        except StorageError as e:
+            logger.error(f"Ошибка пакетной записи: {e}")
+            return False
+        return True
+    
+    def _update_chats(self, chats: List[Dict[str, Any]], records: Dict[str, Any], replace: bool):
+        for chat_id_str, value in records.items():
+            position = self._find_chat_position(chats, chat_id_str)
+            if position is None:
+                if replace:
+                    chats.append(value)
+            elif replace:
+                chats[position] = value
+            else:
+                chats[position].update(value)
+    
+    def _update_sharded_users(self, stack: ExitStack, records: Dict[str, Any], replace: bool):
+        for tg_id, value in records.items():
+            user_file = self._user_filename(tg_id)
+            if replace:
+                stack.enter_context(self._file_lock(user_file))
+                stack.enter_context(self._process_lock(user_file))
+                if not self._write_file(user_file, value):
+                    raise StorageError(f"Не удалось записать {user_file}")
+            else:
+                user = stack.enter_context(self.transaction(user_file))
+                if user is not None:
+                    user.update(value)
+    
+    # Функции управления товарами (товар - название и статус вида/цвета, остатки в SKU)
+    def _product_with_sizes(self, product: Dict[str, Any], inventory: Dict[str, Any],
+                            index: InventoryIndex) -> Dict[str, Any]:
+        """Товар с остатками по размерам из SKU его вида и базового цвета"""
+        product = _copy_json(product)
+        skus = inventory.get("skus", {})
+        product["sizes"] = {
+            skus[key]["size"]: {"qty_total": skus[key]["qty_total"], "qty_reserved": skus[key]["qty_reserved"]}
+            for key in index.product_keys(product.get("type"), product.get("base_color")) if key in skus
+        }
+        return product
+    
     def list_products(self) -> Dict[str, Any]:
         """Получить список всех товаров"""
-        inventory = self._read_file("inventory.json")
-        return inventory.get("products", {})
+        inventory, index = self._inventory_document(), self._stock_index()
+        return {product_id: self._product_with_sizes(product, inventory, index)
+                for product_id, product in inventory.get("products", {}).items()}
     
     def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
         """Получить информацию о товаре"""
-        products = self.list_products()
-        return products.get(product_id)
+        inventory, index = self._inventory_document(), self._stock_index()
+        product = inventory.get("products", {}).get(product_id)
+        return self._product_with_sizes(product, inventory, index) if product is not None else None
     
     def add_product(self, product_id: str, name: str, product_type: str, base_color: str, sizes: Dict[str, int]) -> bool:
-        """Добавить новый товар"""
+        """Добавить новый товар (количество по размерам добавляется к остаткам SKU)"""
         try:
-            inventory = self._read_file("inventory.json")
-            products = inventory.get("products", {})
-            
-            # Создаем товар
-            products[product_id] = {
-                "name": name,
-                "type": product_type,
-                "base_color": base_color,
-                "sizes": {},
-                "active": True
-            }
-            
-            # Добавляем размеры и цвета
-            for size, qty in sizes.items():
-                products[product_id]["sizes"][size] = {"qty_total": qty, "qty_reserved": 0}
-                
-                # Обновляем общую структуру размеров
-                if size not in inventory["sizes"]:
-                    inventory["sizes"][size] = {"colors": {}}
-                if base_color not in inventory["sizes"][size]["colors"]:
-                    inventory["sizes"][size]["colors"][base_color] = {"qty_total": 0, "qty_reserved": 0}
-                
-                inventory["sizes"][size]["colors"][base_color]["qty_total"] += qty
-            
-            inventory["products"] = products
-            return self._write_file("inventory.json", inventory)
+            with self._stock_draft() as draft:
+                draft.products[product_id] = {
+                    "name": name,
+                    "type": product_type,
+                    "base_color": base_color,
+                    "active": True
+                }
+                for size, qty in sizes.items():
+                    sku = draft.get(product_type, base_color, size)
+                    if sku is None:
+                        draft.add(product_type, base_color, size, qty)
+                    else:
+                        draft.set_counters(sku, sku["qty_total"] + qty, sku["qty_reserved"])
+            return True
         except Exception as e:
             logger.error(f"Ошибка добавления товара: {e}")
             return False
@@ -362,26 +1666,15 @@ class JSONStorage:
     def update_product_quantity(self, product_id: str, size: str, qty: int) -> bool:
         """Обновить количество товара"""
         try:
-            inventory = self._read_file("inventory.json")
-            products = inventory.get("products", {})
-            
-            if product_id not in products:
-                return False
-            
-            product = products[product_id]
-            if size not in product["sizes"]:
-                return False
-            
-            # Обновляем количество в товаре
-            old_qty = product["sizes"][size]["qty_total"]
-            product["sizes"][size]["qty_total"] = qty
-            
-            # Обновляем общую структуру размеров
-            base_color = product["base_color"]
-            if size in inventory["sizes"] and base_color in inventory["sizes"][size]["colors"]:
-                inventory["sizes"][size]["colors"][base_color]["qty_total"] += (qty - old_qty)
-            
-            return self._write_file("inventory.json", inventory)
+            with self._stock_draft() as draft:
+                product = draft.products.get(product_id)
+                if product is None:
+                    return False
+                sku = draft.get(product["type"], product["base_color"], size)
+                if sku is None:
+                    return False
+                draft.set_counters(sku, qty, min(sku["qty_reserved"], qty))
+            return True
         except Exception as e:
             logger.error(f"Ошибка обновления количества товара: {e}")
             return False
@@ -389,34 +1682,25 @@ class JSONStorage:
     def toggle_product_status(self, product_id: str) -> bool:
         """Переключить статус товара (активен/неактивен)"""
         try:
-            inventory = self._read_file("inventory.json")
-            products = inventory.get("products", {})
-            
-            if product_id not in products:
-                return False
-            
-            products[product_id]["active"] = not products[product_id].get("active", True)
-            inventory["products"] = products
-            
-            return self._write_file("inventory.json", inventory)
+            with self._stock_draft() as draft:
+                if product_id not in draft.products:
+                    return False
+                
+                draft.products[product_id]["active"] = not draft.products[product_id].get("active", True)
+            return True
         except Exception as e:
             logger.error(f"Ошибка переключения статуса товара: {e}")
             return False
     
     def delete_product(self, product_id: str) -> bool:
-        """Удалить товар"""
+        """Удалить товар (остатки SKU сохраняются)"""
         try:
-            inventory = self._read_file("inventory.json")
-            products = inventory.get("products", {})
-            
-            if product_id not in products:
-                return False
-            
-            # Удаляем товар
-            del products[product_id]
-            inventory["products"] = products
-            
-            return self._write_file("inventory.json", inventory)
+            with self._stock_draft() as draft:
+                if product_id not in draft.products:
+                    return False
+                
+                del draft.products[product_id]
+            return True
         except Exception as e:
             logger.error(f"Ошибка удаления товара: {e}")
             return False
@@ -424,45 +1708,101 @@ class JSONStorage:
     def get_inventory_summary(self) -> Dict[str, Any]:
         """Получить сводку по инвентарю"""
         try:
-            inventory = self._read_file("inventory.json")
-            products = inventory.get("products", {})
+            index = self._inventory_index()
+            products = index.source.get("products", {})
+            qty_total, qty_reserved = index.counters()
             
             summary = {
                 "total_products": len(products),
                 "active_products": sum(1 for p in products.values() if p.get("active", True)),
-                "total_items": 0,
-                "reserved_items": 0,
+                "total_items": qty_total,
+                "reserved_items": qty_reserved,
                 "products": []
             }
             
             for product_id, product in products.items():
-                product_summary = {
+                product = self._product_with_sizes(product, index.source, index)
+                summary["products"].append({
                     "id": product_id,
                     "name": product["name"],
                     "type": product["type"],
                     "color": product["base_color"],
                     "active": product.get("active", True),
-                    "sizes": {}
-                }
-                
-                for size, size_data in product["sizes"].items():
-                    qty_total = size_data["qty_total"]
-                    qty_reserved = size_data["qty_reserved"]
-                    product_summary["sizes"][size] = {
-                        "total": qty_total,
-                        "reserved": qty_reserved,
-                        "available": qty_total - qty_reserved
+                    "sizes": {
+                        size: {
+                            "total": size_data["qty_total"],
+                            "reserved": size_data["qty_reserved"],
+                            "available": size_data["qty_total"] - size_data["qty_reserved"]
+                        }
+                        for size, size_data in product["sizes"].items()
                     }
-                    summary["total_items"] += qty_total
-                    summary["reserved_items"] += qty_reserved
-                
-                summary["products"].append(product_summary)
+                })
             
             return summary
         except Exception as e:
             logger.error(f"Ошибка получения сводки инвентаря: {e}")
             return {}
 
+# Фабрики хранилищ по схеме DATABASE_URL: схема -> factory(database_url, data_dir)
+BACKENDS: Dict[str, Callable[[str, str], StorageBackend]] = {}
+
+
+def register_backend(scheme: str, factory: Callable[[str, str], StorageBackend]):
+    """Зарегистрировать хранилище для схемы DATABASE_URL (<scheme>://...)"""
+    BACKENDS[scheme] = factory
+
+
+def _json_backend(database_url: str, data_dir: str) -> StorageBackend:
+    return JSONStorage(data_dir)
+
+
+def _sqlite_backend(database_url: str, data_dir: str) -> StorageBackend:
+    from .sqlite_storage import SQLiteStorage, sqlite_path_from_url
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    db_path = sqlite_path_from_url(database_url, data_dir)
+    logger.info(f"Используется SQLite хранилище: {db_path}")
+    return SQLiteStorage(db_path, data_dir=data_dir)
+
+
+def _dbm_backend(database_url: str, data_dir: str) -> StorageBackend:
+    from .dbm_storage import DbmStorage, dbm_dir_from_url
+    dbm_dir = dbm_dir_from_url(database_url, data_dir)
+    logger.info(f"Используется dbm хранилище: {dbm_dir}")
+    return DbmStorage(dbm_dir, data_dir=data_dir)
+
+
+def _memory_backend(database_url: str, data_dir: str) -> StorageBackend:
+    from .memory_storage import MemoryStorage
+    logger.info("Используется хранилище в памяти (данные не сохраняются)")
+    return MemoryStorage()
+
+
+register_backend("json", _json_backend)
+register_backend("sqlite", _sqlite_backend)
+register_backend("dbm", _dbm_backend)
+register_backend("memory", _memory_backend)
+
+
+def create_storage(database_url: Optional[str] = None, data_dir: str = "data") -> StorageBackend:
+    """
+    Создание хранилища по DATABASE_URL (схема выбирает фабрику из BACKENDS)
+    
+    sqlite:///bot.db - SQLite (относительный путь внутри data_dir),
+    dbm:///kv - пользователи и сообщения чатов в stdlib dbm (data_dir/kv),
+    memory:// - в памяти процесса, пусто или json:// - JSON файлы в data_dir.
+    """
+    if database_url is None:
+        database_url = os.getenv("DATABASE_URL", "")
+    database_url = database_url.strip()
+    
+    scheme = database_url.split("://", 1)[0] if "://" in database_url else ""
+    factory = BACKENDS.get(scheme or "json")
+    if factory is None or (database_url and not scheme):
+        logger.warning(f"Неподдерживаемый DATABASE_URL: {database_url}, используются JSON файлы")
+        factory = BACKENDS["json"]
+    return factory(database_url, data_dir)
+
 
-# Глобальный экземпляр хранилища
-storage = JSONStorage()
+# Глобальный экземпляр хранилища (создается при первом обращении или в bootstrap())
+storage = LazyInstance(create_storage, "storage")
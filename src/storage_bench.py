@@ -0,0 +1,74 @@
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from typing import Dict
+
+from .storage import StorageBackend, BACKENDS, create_storage
+from .inventory import sku_key
+
+logger = logging.getLogger(__name__)
+
+
+def _seed(storage: StorageBackend):
+    """Остатки, с которыми работают замеры резерва"""
+    storage.set_stock("hoodie", "black", "XL", 10)
+    storage.set_stock("hoodie", "black", "M", 10)
+
+
+def benchmark(storage: StorageBackend, iterations: int) -> Dict[str, float]:
+    """Операций в секунду для типичных обращений обработчиков"""
+    operations = {
+        "get user": lambda i: storage.get("users.json", str(1000 + i % 50)),
+        "set user": lambda i: storage.set("users.json", str(1000 + i % 50), {"username": f"u{i}"}),
+        "view inventory": lambda i: storage.view("inventory.json"),
+        "availability": lambda i: storage.availability(),
+        "reserve/release": lambda i: storage.reserve("XL", "black", 1) and storage.release("XL", "black", 1),
+        "try_reserve SKU": lambda i: (storage.try_reserve(sku_key("hoodie", "black", "M"), 1)
+                                      and storage.try_release(sku_key("hoodie", "black", "M"), 1)),
+        "create order": lambda i: storage.create_order({"user_tg_id": 1000 + i % 50, "size": "XL",
+                                                         "photo_file_id": "bench"}),
+        "orders by user": lambda i: storage.orders_by_user(1000 + i % 50),
+    }
+    results = {}
+    for name, operation in operations.items():
+        started = time.perf_counter()
+        for i in range(iterations):
+            operation(i)
+        elapsed = time.perf_counter() - started
+        results[name] = iterations / elapsed if elapsed > 0 else float("inf")
+    return results
+
+
+def main(argv=None) -> int:
+    """python -m src.storage_bench [json sqlite ...] [-n 200]"""
+    schemes = sorted(BACKENDS)
+    parser = argparse.ArgumentParser(description="Замеры хранилищ (проверки - tests/test_storage_conformance.py)")
+    parser.add_argument("schemes", nargs="*", default=schemes, help=f"хранилища: {', '.join(schemes)}")
+    parser.add_argument("-n", "--iterations", type=int, default=200, help="итераций на операцию")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.WARNING)
+    for scheme in args.schemes:
+        if scheme not in BACKENDS:
+            print(f"- {scheme}: схема не зарегистрирована")
+            continue
+        data_dir = tempfile.mkdtemp(prefix=f"storage-{scheme}-")
+        try:
+            storage = create_storage(f"{scheme}://", data_dir)
+            try:
+                _seed(storage)
+                print(f"{scheme}://")
+                for operation, rate in benchmark(storage, args.iterations).items():
+                    print(f"    {operation:<16} {rate:>10.0f} оп/с")
+            finally:
+                storage.close()
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
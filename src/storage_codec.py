@@ -0,0 +1,135 @@
+import os
+import sys
+import gzip
+import json
+import logging
+import argparse
+from typing import Any, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# json — JSON с отступами (как раньше), compact — JSON без пробелов,
+# orjson — компактный JSON через orjson, msgpack — двоичный формат
+CODECS = ("json", "compact", "orjson", "msgpack")
+DEFAULT_CODEC = "json"
+
+
+def available_codecs() -> List[str]:
+    """Форматы, доступные в текущем окружении"""
+    return [codec for codec in CODECS
+            if (codec != "orjson" or orjson is not None) and (codec != "msgpack" or msgpack is not None)]
+
+
+def resolve_codec(name: str) -> str:
+    """Проверить формат; если библиотека не установлена, используем compact"""
+    name = (name or DEFAULT_CODEC).lower()
+    if name not in CODECS:
+        raise ValueError(f"Неизвестный формат хранения: {name} (доступны: {', '.join(CODECS)})")
+    if name not in available_codecs():
+        logger.warning(f"Формат {name} недоступен (библиотека не установлена), используется compact")
+        return "compact"
+    return name
+
+
+def encode(data: Any, codec: str = DEFAULT_CODEC) -> bytes:
+    """Сериализовать данные в байты выбранного формата"""
+    if codec == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    if codec == "orjson":
+        return orjson.dumps(data)
+    if codec == "compact":
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def detect_codec(raw: bytes) -> str:
+    """Определить формат по содержимому: JSON начинается с { или [, иначе msgpack"""
+    stripped = raw.lstrip()
+    if not stripped or stripped[:1] in (b"{", b"["):
+        return "json"
+    return "msgpack"
+
+
+def decode(raw: bytes) -> Any:
+    """Разобрать байты любого поддерживаемого формата"""
+    if detect_codec(raw) == "msgpack":
+        if msgpack is None:
+            raise ValueError("Файл в формате msgpack, но библиотека msgpack не установлена")
+        return msgpack.unpackb(raw, raw=False)
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # orjson строже стандартного json (NaN, большие числа)
+            pass
+    return json.loads(raw.decode("utf-8"))
+
+
+def convert_data_dir(data_dir: str, codec: str, backup_dir: Optional[str] = None) -> int:
+    """
+    Перезаписать все файлы данных в выбранном формате
+    
+    Возвращает количество перезаписанных файлов. Формат записывается
+    в meta.json (storage_codec). Папка резервных копий (backup_dir,
+    по умолчанию BACKUP_DIR или <data_dir>/backups) не трогается:
+    манифесты копий всегда читаются как JSON.
+    """
+    from .storage import load_json, save_json_atomic
+    from .backup import default_backup_dir
+    
+    skip_dir = os.path.realpath(backup_dir or default_backup_dir(data_dir))
+    paths = []
+    for directory, subdirs, names in os.walk(data_dir):
+        subdirs[:] = [name for name in subdirs if os.path.realpath(os.path.join(directory, name)) != skip_dir]
+        paths += [os.path.join(directory, name) for name in sorted(names)
+                  if name.endswith(".json") or name.endswith(".json.gz")]
+    
+    converted = 0
+    for path in paths:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                data = decode(f.read())
+            tmp_path = path + ".tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(encode(data, codec))
+            os.replace(tmp_path, path)
+        else:
+            data = load_json(path, None)
+            if data is None or not save_json_atomic(path, data, codec):
+                logger.error(f"Не удалось конвертировать {path}")
+                continue
+        converted += 1
+    
+    meta_path = os.path.join(data_dir, "meta.json")
+    meta = load_json(meta_path, {}) or {}
+    meta["storage_codec"] = codec
+    save_json_atomic(meta_path, meta, codec)
+    return converted
+
+
+def main(argv=None) -> int:
+    """python -m src.storage_codec data --codec compact"""
+    parser = argparse.ArgumentParser(description="Конвертация папки data/ в другой формат хранения")
+    parser.add_argument("data_dir", nargs="?", default="data")
+    parser.add_argument("--codec", required=True, choices=CODECS)
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO)
+    codec = resolve_codec(args.codec)
+    converted = convert_data_dir(args.data_dir, codec)
+    print(f"Конвертировано файлов: {converted} (формат {codec})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import os
+import sys
+import bisect
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы времени, мс
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+# Файлы хранилища, которые пропускаются при поиске вызывающей функции
+_STORAGE_SOURCES = ("storage.py", "sqlite_storage.py", "dbm_storage.py", "storage_stats.py",
+                    "order_journal.py", "lazy.py", "contextlib.py")
+
+
+def _caller() -> str:
+    """Первая функция вне кода хранилища в стеке вызова"""
+    frame = sys._getframe(1)
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _STORAGE_SOURCES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+class LatencyHistogram:
+    """Гистограмма времени операций по корзинам LATENCY_BUCKETS_MS"""
+    
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+    
+    def add(self, ms: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+    
+    def as_dict(self) -> Dict[str, Any]:
+        labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {label: n for label, n in zip(labels, self.buckets) if n}
+        }
+
+
+class FileStats:
+    """Счетчики одного файла"""
+    
+    def __init__(self):
+        self.reads = 0
+        self.parses = 0
+        self.bytes_in = 0
+        self.writes = 0
+        self.serializes = 0
+        self.bytes_out = 0
+        self.parse_ms = LatencyHistogram()
+        self.serialize_ms = LatencyHistogram()
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "reads": self.reads,
+            "parses": self.parses,
+            "bytes_in": self.bytes_in,
+            "writes": self.writes,
+            "serializes": self.serializes,
+            "bytes_out": self.bytes_out,
+            "parse_ms": self.parse_ms.as_dict(),
+            "serialize_ms": self.serialize_ms.as_dict()
+        }
+
+
+class StorageStats:
+    """
+    Статистика ввода-вывода хранилища по файлам
+    
+    reads/writes - обращения к документу (в том числе из кеша и отложенные),
+    parses/serializes - фактическое чтение и разбор файла или запись на диск
+    с размером в байтах и гистограммой времени. Операции дольше
+    STORAGE_SLOW_MS (100 мс) пишутся в лог вместе с вызывающей функцией.
+    STORAGE_STATS_LOG_INTERVAL (секунды) включает периодический вывод сводки.
+    """
+    
+    def __init__(self, slow_ms: Optional[float] = None, log_interval: Optional[float] = None):
+        if slow_ms is None:
+            slow_ms = float(os.getenv("STORAGE_SLOW_MS", "100"))
+        if log_interval is None:
+            log_interval = float(os.getenv("STORAGE_STATS_LOG_INTERVAL", "0"))
+        self.slow_ms = slow_ms
+        self.log_interval = log_interval
+        self._files: Dict[str, FileStats] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._log_thread: Optional[threading.Thread] = None
+        if self.log_interval > 0:
+            self._log_thread = threading.Thread(target=self._log_loop, name="storage-stats", daemon=True)
+            self._log_thread.start()
+    
+    def _file(self, filename: str) -> FileStats:
+        stats = self._files.get(filename)
+        if stats is None:
+            stats = self._files[filename] = FileStats()
+        return stats
+    
+    # === УЧЕТ ===
+    
+    def count_read(self, filename: str):
+        """Обращение к документу на чтение"""
+        with self._lock:
+            self._file(filename).reads += 1
+    
+    def count_write(self, filename: str):
+        """Изменение документа"""
+        with self._lock:
+            self._file(filename).writes += 1
+    
+    def record_parse(self, filename: str, nbytes: int, seconds: float):
+        """Чтение и разбор файла с диска"""
+        ms = seconds * 1000
+        with self._lock:
+            stats = self._file(filename)
+            stats.parses += 1
+            stats.bytes_in += nbytes
+            stats.parse_ms.add(ms)
+        if ms >= self.slow_ms:
+            logger.warning(f"Медленное чтение {filename}: {ms:.1f} мс, {nbytes} байт, вызов из {_caller()}")
+    
+    def record_serialize(self, filename: str, nbytes: int, seconds: float):
+        """Сериализация и запись файла на диск"""
+        ms = seconds * 1000
+        with self._lock:
+            stats = self._file(filename)
+            stats.serializes += 1
+            stats.bytes_out += nbytes
+            stats.serialize_ms.add(ms)
+        if ms >= self.slow_ms:
+            logger.warning(f"Медленная запись {filename}: {ms:.1f} мс, {nbytes} байт, вызов из {_caller()}")
+    
+    # === ВЫВОД ===
+    
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Счетчики по файлам"""
+        with self._lock:
+            return {filename: stats.as_dict() for filename, stats in sorted(self._files.items())}
+    
+    def reset(self):
+        with self._lock:
+            self._files.clear()
+    
+    def summary(self, limit: int = 5) -> str:
+        """Короткая сводка: самые читаемые и записываемые файлы"""
+        files = self.as_dict()
+        by_reads = sorted(files.items(), key=lambda item: item[1]["reads"], reverse=True)[:limit]
+        by_writes = sorted(files.items(), key=lambda item: item[1]["writes"], reverse=True)[:limit]
+        reads = ", ".join(f"{name}={stats['reads']} ({stats['parses']} с диска)"
+                          for name, stats in by_reads if stats["reads"])
+        writes = ", ".join(f"{name}={stats['writes']} ({stats['bytes_out']} байт)"
+                           for name, stats in by_writes if stats["writes"])
+        return f"чтения: {reads or '-'}; записи: {writes or '-'}"
+    
+    def _log_loop(self):
+        while not self._stop.wait(self.log_interval):
+            logger.info(f"Статистика хранилища: {self.summary()}")
+    
+    def close(self):
+        """Остановить периодический вывод"""
+        self._stop.set()
+        if self._log_thread is not None:
+            self._log_thread.join(timeout=5)
+            self._log_thread = None
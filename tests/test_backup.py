@@ -0,0 +1,136 @@
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.backup import BackupStore
+from src.storage import load_json
+from src.storage_codec import available_codecs, convert_data_dir
+
+CODECS = [pytest.param(codec, marks=pytest.mark.skipif(codec not in available_codecs(),
+                                                        reason=f"{codec} не установлен"))
+          for codec in ("compact", "msgpack")]
+
+
+def _write(data_dir, relpath: str, data):
+    path = os.path.join(data_dir, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("BACKUP_DIR", raising=False)
+    path = str(tmp_path / "data")
+    _write(path, "users.json", {"7": {"username": "seven"}})
+    _write(path, "chats.json", [])
+    return path
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_convert_skips_backups(data_dir, codec):
+    """Конвертация не трогает манифесты копий, копия восстанавливается после нее"""
+    store = BackupStore(data_dir)
+    store.backup()
+    name = store.list_backups()[-1]
+    manifest_path = os.path.join(store.manifests_dir, f"{name}.json")
+    with open(manifest_path, "rb") as f:
+        manifest = f.read()
+    
+    assert convert_data_dir(data_dir, codec) == 2
+    with open(manifest_path, "rb") as f:
+        assert f.read() == manifest
+    
+    _write(data_dir, "users.json", {})
+    assert store.restore() == name
+    assert load_json(os.path.join(data_dir, "users.json")) == {"7": {"username": "seven"}}
+
+
+def test_restore_sqlite_drops_wal(data_dir):
+    """Восстановленная база не соседствует с -wal/-shm текущей, чужая база не удаляется"""
+    db_path = os.path.join(data_dir, "bot.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (v INTEGER)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    conn.close()
+    store = BackupStore(data_dir)
+    store.backup()
+    
+    for suffix in ("-wal", "-shm"):
+        with open(db_path + suffix, "wb") as f:
+            f.write(b"stale")
+    sqlite3.connect(os.path.join(data_dir, "other.db")).close()
+    store.restore()
+    
+    assert not os.path.exists(db_path + "-wal") and not os.path.exists(db_path + "-shm")
+    assert os.path.exists(os.path.join(data_dir, "other.db"))
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT v FROM t").fetchall() == [(1,)]
+    conn.close()
+
+
+def _chunk_files(store: BackupStore) -> set:
+    return {name for _, _, names in os.walk(store.chunks_dir) for name in names}
+
+
+def _append_journal(data_dir, start: int, count: int):
+    with open(os.path.join(data_dir, "orders.journal.jsonl"), "a", encoding="utf-8") as f:
+        for i in range(start, start + count):
+            f.write(json.dumps({"op": "create", "order": {"id": i, "note": "x" * 40}}) + "\n")
+
+
+def test_chunks_dedup(data_dir):
+    """Вторая копия пишет только чанки дописанного конца журнала"""
+    _append_journal(data_dir, 0, 20000)
+    store = BackupStore(data_dir)
+    first = store.backup()["files"]["orders.journal.jsonl"]["chunks"]
+    assert len(first) > 2
+    chunks = _chunk_files(store)
+    
+    _append_journal(data_dir, 20000, 10)
+    second = store.backup()["files"]["orders.journal.jsonl"]["chunks"]
+    assert second[:-1] == first[:-1] and second[-1] != first[-1]
+    assert len(_chunk_files(store) - chunks) == 1
+
+
+def test_restore_at(data_dir):
+    """restore(at) берет последнюю копию не позже at и удаляет файлы, которых в ней нет"""
+    store = BackupStore(data_dir)
+    store.backup()
+    _write(data_dir, "users.json", {"8": {"username": "eight"}})
+    _append_journal(data_dir, 0, 1)
+    store.backup()
+    _write(data_dir, "users.json", {})
+    first, second = store.list_backups()
+    
+    at = datetime.strptime(first, "%Y%m%dT%H%M%S%f")
+    assert store.restore(at) == first
+    assert load_json(os.path.join(data_dir, "users.json")) == {"7": {"username": "seven"}}
+    assert not os.path.exists(os.path.join(data_dir, "orders.journal.jsonl"))
+    
+    assert store.restore() == second
+    assert load_json(os.path.join(data_dir, "users.json")) == {"8": {"username": "eight"}}
+    assert os.path.exists(os.path.join(data_dir, "orders.journal.jsonl"))
+    
+    with pytest.raises(ValueError):
+        store.restore(at - timedelta(days=1))
+
+
+def test_prune(data_dir):
+    """Хранится keep последних копий, чанки удаленных копий удаляются"""
+    store = BackupStore(data_dir, keep=2)
+    for i in range(3):
+        # Разный размер: файл с тем же размером и mtime берется из прошлой копии
+        _write(data_dir, "users.json", {str(i): {"username": "x" * i}})
+        store.backup()
+    
+    assert len(store.list_backups()) == 2
+    used = {f"{digest}.gz" for name in store.list_backups()
+            for entry in store._load_manifest(name)["files"].values() for digest in entry["chunks"]}
+    assert _chunk_files(store) == used
+    assert [json.loads(data) for _, data in store.file_versions("users.json")] == [
+        {"2": {"username": "xx"}}, {"1": {"username": "x"}}]
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+from src.bootstrap import DEFAULT_IMPORT_BUDGET_MS, LAZY_MODULES, measure_cold_import
+
+BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", DEFAULT_IMPORT_BUDGET_MS))
+
+
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_cold_import_within_budget(module):
+    """Холодный импорт укладывается в бюджет и не создает файлов"""
+    if module == "src.auth":
+        # Настройки бота (config.py) лежат рядом с main.py только при развертывании
+        pytest.importorskip("config")
+    elapsed_ms, created = measure_cold_import([module])
+    assert created == []
+    assert elapsed_ms <= BUDGET_MS, f"{module}: {elapsed_ms:.0f} мс при бюджете {BUDGET_MS:.0f} мс"
@@ -0,0 +1,73 @@
+import os
+import copy
+
+from src.inventory import INVENTORY_SCHEMA, NO_COLOR, NO_TYPE, migrate_inventory, sku_key
+from src.storage import load_json
+
+BASELINE_INVENTORY = os.path.join(os.path.dirname(__file__), "..", "data", "inventory.json")
+
+
+def _counters(inventory, product_type, color, size):
+    sku = inventory["skus"][sku_key(product_type, color, size)]
+    return sku["qty_total"], sku["qty_reserved"]
+
+
+def test_products_with_size_colors():
+    """Остатки товаров + резервы по размеру и цвету, излишек - SKU без вида"""
+    inventory = migrate_inventory({
+        "products": {"hoodie_black": {"name": "Худи", "type": "hoodie", "base_color": "black",
+                                      "sizes": {"M": {"qty_total": 5, "qty_reserved": 0}}}},
+        "sizes": {"M": {"colors": {"black": {"qty_total": 7, "qty_reserved": 2},
+                                   "white": {"qty_total": 3, "qty_reserved": 1}}}},
+    })
+    assert inventory["schema"] == INVENTORY_SCHEMA
+    assert inventory["sizes"] == ["M"]
+    assert inventory["products"] == {"hoodie_black": {"name": "Худи", "type": "hoodie", "base_color": "black"}}
+    assert len(inventory["skus"]) == 3
+    assert _counters(inventory, "hoodie", "black", "M") == (5, 2)
+    assert _counters(inventory, NO_TYPE, "black", "M") == (2, 0)
+    assert _counters(inventory, NO_TYPE, "white", "M") == (3, 1)
+
+
+def test_sizes_without_colors():
+    """Размер без цветов становится SKU без вида и цвета, пустой размер - только в списке"""
+    inventory = migrate_inventory({"sizes": {"XL": {"qty_total": 4, "qty_reserved": 1}, "S": {}}})
+    assert inventory["sizes"] == ["XL", "S"]
+    assert list(inventory["skus"]) == [sku_key(NO_TYPE, NO_COLOR, "XL")]
+    assert _counters(inventory, NO_TYPE, NO_COLOR, "XL") == (4, 1)
+
+
+def test_flat_keys():
+    """Плоские ключи MerchManager переносятся в SKU, прочие поля сохраняются"""
+    inventory = migrate_inventory({
+        "tshirt_black_L": {"merch_type": "tshirt", "color": "black", "size": "L",
+                           "qty_total": 3, "qty_reserved": 1},
+        "cap_L": {"merch_type": "cap", "size": "L", "qty_total": 2},
+        "updated_at": "2024-01-01",
+    })
+    assert inventory["sizes"] == ["L"]
+    assert _counters(inventory, "tshirt", "black", "L") == (3, 1)
+    assert _counters(inventory, "cap", NO_COLOR, "L") == (2, 0)
+    assert inventory["updated_at"] == "2024-01-01"
+    assert "tshirt_black_L" not in inventory
+
+
+def test_idempotent():
+    """Повторная миграция не меняет переведенный документ"""
+    migrated = migrate_inventory(load_json(BASELINE_INVENTORY))
+    expected = copy.deepcopy(migrated)
+    assert migrate_inventory(migrated) == expected
+    assert migrate_inventory(None) == migrate_inventory([]) == {"schema": INVENTORY_SCHEMA, "sizes": [],
+                                                                 "products": {}, "skus": {}}
+
+
+def test_baseline_inventory():
+    """data/inventory.json из репозитория переводится в 3 SKU без дублей"""
+    inventory = migrate_inventory(load_json(BASELINE_INVENTORY))
+    assert inventory["sizes"] == ["S", "M", "L"]
+    assert {key: _counters(inventory, *key.split("|")) for key in inventory["skus"]} == {
+        sku_key("longsleeve", "white", "S"): (10, 0),
+        sku_key("longsleeve", "white", "M"): (15, 0),
+        sku_key("longsleeve", "white", "L"): (12, 0),
+    }
+    assert inventory["products"]["longsleeve_white"]["active"] is True
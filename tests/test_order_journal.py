@@ -0,0 +1,146 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from src.order_journal import OrderJournal
+
+
+def _order(order_id: int, created_at: str = "2024-01-05T10:00:00", **fields):
+    return dict({"id": order_id, "user_tg_id": 100 + order_id, "size": "M", "status": "pending",
+                 "created_at": created_at}, **fields)
+
+
+@pytest.fixture
+def open_journal(tmp_path):
+    """Открыть журнал в tmp_path (без close() - как после падения процесса)"""
+    def open_journal(**kwargs) -> OrderJournal:
+        return OrderJournal(str(tmp_path / "orders.json"), str(tmp_path / "orders.journal.jsonl"),
+                            segments_dir=str(tmp_path / "orders"), **kwargs)
+    return open_journal
+
+
+def _ids(journal: OrderJournal):
+    return [order["id"] for order in journal.orders()]
+
+
+def test_replay_truncated_last_line(open_journal):
+    """Оборванная последняя строка пропускается, следующая запись не склеивается с ней"""
+    journal = open_journal()
+    journal.create(_order(1))
+    journal.create(_order(2))
+    assert journal.set_status(1, "done")
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "create", "order": {"id": 3, "created_')
+    
+    journal = open_journal()
+    assert _ids(journal) == [1, 2] and journal.get(1)["status"] == "done"
+    journal.create(_order(4))
+    
+    journal = open_journal()
+    assert _ids(journal) == [1, 2, 4]
+    assert journal.pending_records() == 4
+
+
+def test_leftover_compacting(open_journal):
+    """Недосжатый журнал применяется первым, без потерь и повторов"""
+    journal = open_journal()
+    journal.create(_order(1))
+    journal.create(_order(2))
+    assert journal.append_delivery(1, {"chat_id": "-100", "prefix": "AB", "number": 1})
+    # Падение после переименования журнала, но до записи сегментов
+    os.replace(journal.journal_path, journal.compacting_path)
+    
+    journal = open_journal()
+    assert _ids(journal) == [1, 2]
+    journal.create(_order(3))
+    assert journal.set_status(2, "done")
+    
+    journal = open_journal()
+    assert _ids(journal) == [1, 2, 3] and journal.get(2)["status"] == "done"
+    assert journal.compact()
+    assert not os.path.exists(journal.compacting_path) and not os.path.exists(journal.journal_path)
+    
+    journal = open_journal()
+    assert _ids(journal) == [1, 2, 3]
+    assert len(journal.get(1)["deliveries"]) == 1 and journal.get(1)["status"] == "sent"
+    assert journal.get(2)["status"] == "done" and journal.pending_records() == 0
+
+
+def test_compacting_already_in_segments(open_journal):
+    """Падение после записи сегментов: повтор .compacting не дублирует заказы и доставки"""
+    journal = open_journal()
+    journal.create(_order(1))
+    assert journal.append_delivery(1, {"chat_id": "-100", "prefix": "AB", "number": 1})
+    with open(journal.journal_path, "rb") as f:
+        records = f.read()
+    assert journal.compact()
+    with open(journal.compacting_path, "wb") as f:
+        f.write(records)
+    
+    journal = open_journal()
+    assert _ids(journal) == [1]
+    assert len(journal.get(1)["deliveries"]) == 1
+    assert journal.status_counts() == {"sent": 1}
+
+
+def test_apply_idempotent(open_journal):
+    journal = open_journal()
+    create = {"op": "create", "order": _order(1)}
+    delivery = {"op": "delivery", "id": 1, "delivery": {"chat_id": "-100", "prefix": "AB", "number": 1}}
+    status = {"op": "status", "id": 1, "status": "done"}
+    for record in (create, delivery, status, create, delivery, status):
+        journal._apply(record)
+    
+    assert _ids(journal) == [1]
+    order = journal.get(1)
+    assert len(order["deliveries"]) == 1 and order["status"] == "done"
+    assert journal.status_counts() == {"done": 1}
+    assert [o["id"] for o in journal.by_chat("-100")] == [1]
+
+
+def _segmented(open_journal, **kwargs) -> OrderJournal:
+    """Журнал с заказами за январь, февраль и текущий месяц, свернутый в сегменты"""
+    journal = open_journal(**kwargs)
+    journal.create(_order(1, "2024-01-05T10:00:00"))
+    journal.create(_order(2, "2024-02-07T10:00:00"))
+    journal.create(_order(3, datetime.now().isoformat()))
+    assert journal.set_status(2, "done")
+    assert journal.compact()
+    return open_journal(**kwargs)
+
+
+def test_segments_load_lazily(open_journal):
+    journal = _segmented(open_journal)
+    current = journal._current_segment_key()
+    assert sorted(journal._segments) == ["2024-01", "2024-02", current]
+    assert journal._loaded_segments == {current}
+    assert journal.status_counts() == {"pending": 2, "done": 1}
+    assert journal.max_order_id() == 3
+    
+    assert journal.get(1)["created_at"].startswith("2024-01")
+    assert journal._loaded_segments == {current, "2024-01"}
+    assert [order["id"] for order in journal.by_status("done")] == [2]
+    assert journal._loaded_segments == {current, "2024-01", "2024-02"}
+    # Подгруженные не по порядку сегменты встают на место по времени создания
+    assert _ids(journal) == [1, 2, 3]
+
+
+def test_closed_segment_gzip(open_journal):
+    journal = _segmented(open_journal, compress_closed=True)
+    segments_dir = journal.segments_dir
+    assert journal._segments["2024-01"]["compressed"]
+    assert not journal._segments[journal._current_segment_key()]["compressed"]
+    assert os.path.exists(os.path.join(segments_dir, "2024-01.json.gz"))
+    assert not os.path.exists(os.path.join(segments_dir, "2024-01.json"))
+    
+    assert [order["id"] for order in journal.between("2024-02-01", "2024-03-01")] == [2]
+    assert journal.get(1)["status"] == "pending"
+    
+    # Изменение старого заказа перезаписывает его сжатый сегмент
+    assert journal.set_status(1, "done")
+    assert journal.compact()
+    journal = open_journal(compress_closed=True)
+    assert journal.get(1)["status"] == "done"
+    assert sorted(os.listdir(segments_dir)) == sorted(["2024-01.json.gz", "2024-02.json.gz",
+                                                        f"{journal._current_segment_key()}.json", "manifest.json"])
@@ -0,0 +1,65 @@
+import threading
+
+from src.order_sequence import OrderIdSequence
+from src.storage import JSONStorage
+
+
+def test_block_lease():
+    """Граница сохраняется раз на блок, после перезапуска остаток блока пропускается"""
+    saved = []
+    sequence = OrderIdSequence(lambda: saved[-1] if saved else 1, lambda value: saved.append(value) or True,
+                               block_size=3)
+    assert [sequence.next_id() for _ in range(4)] == [1, 2, 3, 4]
+    assert saved == [4, 7]
+    
+    restarted = OrderIdSequence(lambda: saved[-1], lambda value: saved.append(value) or True, block_size=3)
+    assert restarted.next_id() == 7 and saved[-1] == 10
+
+
+def test_threads_unique():
+    saved = [1]
+    sequence = OrderIdSequence(lambda: saved[-1], lambda value: saved.append(value) or True, block_size=7)
+    ids = []
+    
+    def take():
+        ids.extend(sequence.next_id() for _ in range(100))
+    
+    threads = [threading.Thread(target=take) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ids) == list(range(1, 801))
+
+
+def test_restart(tmp_path):
+    """ID 1, 2, 3 до перезапуска, 101 после: next_order_id = 201 в meta.json"""
+    storage = JSONStorage(str(tmp_path))
+    assert [storage.next_order_id() for _ in range(3)] == [1, 2, 3]
+    storage.close()
+    
+    storage = JSONStorage(str(tmp_path))
+    try:
+        assert storage.next_order_id() == 101
+        assert storage.view("meta.json")["next_order_id"] == 201
+    finally:
+        storage.close()
+
+
+def test_two_instances(tmp_path):
+    """Два хранилища на одной папке арендуют разные блоки"""
+    first = JSONStorage(str(tmp_path))
+    second = JSONStorage(str(tmp_path))
+    try:
+        ids = {first: [], second: []}
+        for i in range(250):
+            storage = first if i % 3 else second
+            ids[storage].append(storage.next_order_id())
+        
+        for issued in ids.values():
+            assert issued == sorted(issued)
+        assert len(set(ids[first]) | set(ids[second])) == 250
+        assert not set(ids[first]) & set(ids[second])
+    finally:
+        first.close()
+        second.close()
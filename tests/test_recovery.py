@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from src.backup import BackupStore
+from src.recovery import STALE_TMP_SECONDS, recover_data_dir
+from src.storage import JSONStorage, load_json
+
+
+def _write(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv("BACKUP_DIR", raising=False)
+    return str(tmp_path / "data")
+
+
+def test_stale_tmp_removed(data_dir):
+    """Удаляются только временные файлы старше STALE_TMP_SECONDS"""
+    stale = os.path.join(data_dir, "users", "7", "7.json.tmp")
+    fresh = os.path.join(data_dir, "chats.json.tmp")
+    _write(stale, '{"a"')
+    _write(fresh, '{"a"')
+    old = time.time() - STALE_TMP_SECONDS - 1
+    os.utime(stale, (old, old))
+    
+    report = recover_data_dir(data_dir)
+    assert report["removed_tmp"] == [os.path.join("users", "7", "7.json.tmp")]
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+
+
+def test_truncated_restored_from_latest_intact(data_dir):
+    """Оборванный документ заменяется последней целой версией из копий"""
+    path = os.path.join(data_dir, "users.json")
+    store = BackupStore(data_dir)
+    _write(path, '{"7": {"username": "older"}}')
+    store.backup()
+    _write(path, '{"7": {"username": "new"}}')
+    store.backup()
+    # Последняя копия сделана уже с оборванного файла
+    _write(path, '{"7": {"username": "ne')
+    store.backup()
+    
+    report = recover_data_dir(data_dir, store.backup_dir)
+    assert report["restored"] == ["users.json"]
+    assert load_json(path) == {"7": {"username": "new"}}
+
+
+def test_quarantine_without_backup(data_dir):
+    """Без резервной копии оборванный документ сохраняется как .corrupt"""
+    path = os.path.join(data_dir, "chats.json")
+    _write(path, '[{"chat_id": "-1"')
+    
+    report = recover_data_dir(data_dir, os.path.join(data_dir, "backups"))
+    assert report["quarantined"] == ["chats.json"]
+    assert not os.path.exists(path) and os.path.exists(path + ".corrupt")
+
+
+def test_sharded_user_recovered_on_read(data_dir, monkeypatch):
+    """Файл пользователя не проверяется при запуске, а восстанавливается при ошибке разбора"""
+    monkeypatch.setenv("STORAGE_USERS_LAYOUT", "sharded")
+    storage = JSONStorage(data_dir)
+    assert storage.set("users.json", "7", {"username": "seven"})
+    assert storage.set("users.json", "8", {"username": "eight"})
+    storage.close()
+    BackupStore(data_dir).backup()
+    
+    seven = os.path.join(data_dir, storage._user_filename("7"))
+    eight = os.path.join(data_dir, storage._user_filename("8"))
+    # Начало и конец на месте - ошибка только в середине файла
+    _write(seven, '{"username": seven}')
+    _write(eight, '{"username": "eig')
+    assert recover_data_dir(data_dir, os.path.join(data_dir, "backups"))["restored"] == []
+    
+    storage = JSONStorage(data_dir)
+    try:
+        assert storage.get("users.json", "7") == {"username": "seven"}
+        assert storage.get("users.json", "8") == {"username": "eight"}
+    finally:
+        storage.close()
+    
+    # Без копии файл откладывается в .corrupt, пользователь читается как отсутствующий
+    _write(seven, '{"username": seven}')
+    monkeypatch.setenv("BACKUP_DIR", os.path.join(data_dir, "no-backups"))
+    storage = JSONStorage(data_dir)
+    try:
+        assert storage.get("users.json", "7") is None
+        assert os.path.exists(seven + ".corrupt")
+    finally:
+        storage.close()
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from src.inventory import sku_key
+from src.storage import JSONStorage, load_json
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setenv("STORAGE_STOCK_COUNTERS", "1")
+    # Фоновая запись не успевает сработать за время теста
+    monkeypatch.setenv("STORAGE_STOCK_FLUSH_MS", "600000")
+    monkeypatch.setenv("STORAGE_STOCK_FLUSH_MAX", "1000")
+    storage = JSONStorage(str(tmp_path))
+    yield storage
+    storage.close()
+
+
+def test_reads_overlay_pending_reserves(storage):
+    """Чтение остатков видит несохраненные резервы и не пишет inventory.json"""
+    assert storage.set_stock("hoodie", "black", "XL", 5)
+    counters = storage._stock_counters
+    path = os.path.join(storage.data_dir, "inventory.json")
+    signature = storage._file_signature(path)
+    
+    assert storage.try_reserve(sku_key("hoodie", "black", "XL"), 2)
+    assert storage.reserve("XL", "black", 1)
+    assert storage.available("XL", "black") == 2
+    assert storage.availability().available("XL", "black") == 2
+    assert storage.get_stock("hoodie", "black", "XL")["qty_reserved"] == 3
+    assert [item["qty_available"] for item in storage.list_stock()
+            if (item["type"], item["size"]) == ("hoodie", "XL")] == [2]
+    assert storage.view("inventory.json")["skus"][sku_key("hoodie", "black", "XL")]["qty_reserved"] == 3
+    assert storage.snapshot().inventory["skus"][sku_key("hoodie", "black", "XL")]["qty_reserved"] == 3
+    assert storage.get_inventory_summary()["reserved_items"] == 3
+    assert counters.flushes == 0 and storage._file_signature(path) == signature
+    
+    # Остаток не уходит в минус с учетом несохраненных резервов
+    assert not storage.try_reserve(sku_key("hoodie", "black", "XL"), 3)
+    
+    assert storage.flush()
+    assert counters.flushes == 1 and not counters.dirty()
+    assert load_json(path)["skus"][sku_key("hoodie", "black", "XL")]["qty_reserved"] == 3
+    assert storage.available("XL", "black") == 2
+
+
+def test_write_flushes_counters_first(storage):
+    """Изменение остатков сначала записывает резервы счетчиков"""
+    assert storage.set_stock("hoodie", "black", "XL", 5)
+    assert storage.try_reserve(sku_key("hoodie", "black", "XL"), 4)
+    assert storage.set_stock("hoodie", "black", "XL", 3)
+    stock = storage.get_stock("hoodie", "black", "XL")
+    assert (stock["qty_total"], stock["qty_reserved"]) == (3, 3)
+    assert storage._stock_counters.rejected == 0
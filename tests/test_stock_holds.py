@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from src.memory_storage import MemoryStorage
+from src.stock_holds import StockHolds
+
+
+@pytest.fixture
+def stock():
+    stock = MemoryStorage()
+    assert stock.set_stock("hoodie", "black", "XL", 3)
+    yield stock
+    stock.close()
+
+
+@pytest.fixture
+def holds(stock):
+    holds = StockHolds(stock, ttl=600)
+    yield holds
+    holds.stop()
+
+
+def test_place_beyond_free(holds, stock):
+    assert holds.place(1, "XL", "black", 2)
+    assert not holds.place(2, "XL", "black", 2)
+    assert holds.place(2, "XL", "black", 1)
+    assert not holds.place(3, "XL", "black", 1)
+    assert holds.held("XL", "black") == 3 and holds.held("XL") == 3
+    # Брони не меняют резерв в хранилище
+    assert stock.available("XL", "black") == 3
+
+
+def test_expire_due(holds):
+    assert holds.place(1, "XL", "black", 3)
+    assert holds.expire_due(time.monotonic()) == 0
+    assert not holds.place(2, "XL", "black", 1)
+    
+    assert holds.expire_due(time.monotonic() + 601) == 1
+    assert holds.count() == 0 and holds.held("XL") == 0
+    assert holds.stats()["expired"] == 1
+    assert holds.place(2, "XL", "black", 3)
+
+
+def test_convert(holds, stock):
+    assert holds.place(1, "XL", "black", 2)
+    assert holds.convert(1, "XL", "black", 2)
+    assert stock.get_stock("hoodie", "black", "XL")["qty_reserved"] == 2
+    assert holds.count() == 0
+    
+    # Без брони резервируется только остаток, не занятый чужими бронями
+    assert holds.place(2, "XL", "black", 1)
+    assert not holds.convert(3, "XL", "black", 1)
+    assert holds.release(2)
+    assert holds.convert(3, "XL", "black", 1)
+    assert stock.available("XL", "black") == 0
+    assert holds.stats()["converted"] == 2
+
+
+def test_release(holds):
+    assert holds.place(1, "XL", "black", 3)
+    assert holds.release(1)
+    assert not holds.release(1)
+    assert holds.held("XL", "black") == 0
+    assert holds.place(2, "XL", "black", 3)
+
+
+def test_own_hold_not_subtracted(holds):
+    assert holds.place(1, "XL", "black", 2)
+    assert holds.held("XL", "black", exclude_user=1) == 0
+    assert holds.held("XL", exclude_user=2) == 2
+    # Новая бронь пользователя заменяет прежнюю, а не складывается с ней
+    assert holds.place(1, "XL", "black", 3)
+    assert holds.count() == 1 and holds.held("XL", "black") == 3
+    # При отказе прежняя бронь остается
+    assert not holds.place(1, "XL", "black", 4)
+    assert holds.held("XL", "black", exclude_user=2) == 3
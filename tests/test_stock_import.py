@@ -0,0 +1,93 @@
+import io
+
+import pytest
+
+from src.inventory import NO_COLOR, NO_TYPE
+from src.stock_import import StockTableError, export_stock_table, import_stock_table, parse_stock_table
+from src.storage import JSONStorage
+
+CATALOGS = {
+    "type": {"hoodie": "hoodie", "tshirt": "tshirt"},
+    "color": {"black": "black", "white": "white"},
+    "size": {"m": "M", "xl": "XL"},
+}
+
+
+def _errors(rows, **kwargs):
+    with pytest.raises(StockTableError) as error:
+        parse_stock_table(rows, CATALOGS, **kwargs)
+    return error.value.errors
+
+
+def test_parse():
+    """Заголовок с алиасами, регистр из справочника, пустой цвет - без цвета"""
+    rows = [[], ["Вид", "Цвет", "Размер", "Количество", "комментарий"],
+            ["Hoodie", "BLACK", "xl", "5", "новая партия"],
+            ["tshirt", "", "M", "3,0"],
+            ["", "", "", ""]]
+    assert parse_stock_table(rows, CATALOGS) == [("hoodie", "black", "XL", 5), ("tshirt", NO_COLOR, "M", 3)]
+
+
+def test_unknown_catalog_value():
+    errors = _errors([["type", "color", "size", "qty"], ["cap", "black", "M", "1"], ["hoodie", "red", "", "1"]])
+    assert errors == ["Строка 2: type «cap» нет в справочнике",
+                      "Строка 3: color «red» нет в справочнике; пустое поле size"]
+    assert _errors([["type", "size", "qty"]]) == ["Строка 1: нет колонок color (нужны type, color, size, qty)"]
+
+
+def test_duplicate_row():
+    errors = _errors([["type", "color", "size", "qty"], ["hoodie", "black", "M", "1"], ["HOODIE", "black", "m", "2"]])
+    assert errors == ["Строка 3: повтор строки 2"]
+
+
+def test_quantity():
+    rows = [["type", "color", "size", "qty"], ["hoodie", "black", "M", "-1"],
+            ["hoodie", "white", "M", "1.5"], ["tshirt", "black", "M", "много"]]
+    assert _errors(rows) == ["Строка 2: отрицательное количество -1", "Строка 3: количество «1.5» не целое",
+                             "Строка 4: количество «много» не число"]
+    # Отрицательное количество допустимо, когда остаток прибавляется
+    assert _errors(rows, allow_negative=True) == ["Строка 3: количество «1.5» не целое",
+                                                  "Строка 4: количество «много» не число"]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = JSONStorage(str(tmp_path))
+    for filename, key, values in (("merch_types.json", "types", ["hoodie"]),
+                                  ("merch_colors.json", "colors", ["black"]),
+                                  ("merch_sizes.json", "sizes", ["M", "XL"])):
+        with storage.edit(filename) as catalog:
+            catalog[key] = values
+    yield storage
+    storage.close()
+
+
+def test_dry_run_and_apply(storage):
+    table = b"type,color,size,qty\nhoodie,black,M,4\nhoodie,black,XL,2\n"
+    assert storage.set_stock("hoodie", "black", "M", 1)
+    
+    changes = import_stock_table(storage, io.BytesIO(table), "stock.csv", dry_run=True)
+    assert [(c["size"], c["before"], c["after"]) for c in changes] == [("M", 1, 4), ("XL", None, 2)]
+    assert storage.get_stock("hoodie", "black", "M")["qty_total"] == 1
+    assert storage.get_stock("hoodie", "black", "XL") is None
+    
+    assert import_stock_table(storage, io.BytesIO(table), "stock.csv") == changes
+    assert storage.get_stock("hoodie", "black", "M")["qty_total"] == 4
+    assert storage.get_stock("hoodie", "black", "XL")["qty_total"] == 2
+    assert import_stock_table(storage, io.BytesIO(table), "stock.csv") == []
+
+
+def test_export_round_trip(storage):
+    """Выгрузка загружается обратно, в том числе SKU вне справочников (перенесенные из прежней схемы)"""
+    assert storage.set_stock("hoodie", "black", "M", 3)
+    assert storage.set_stock("longsleeve", "white", "S", 10)
+    assert storage.set_stock(NO_TYPE, NO_COLOR, "XL", 2)
+    out = io.StringIO()
+    export_stock_table(storage, out)
+    
+    table = io.BytesIO(out.getvalue().encode("utf-8"))
+    assert import_stock_table(storage, table, "stock.csv") == []
+    
+    # Новый SKU вне справочников по-прежнему отклоняется
+    with pytest.raises(StockTableError):
+        import_stock_table(storage, io.BytesIO(b"type,color,size,qty\nlongsleeve,black,S,1\n"), "stock.csv")
@@ -0,0 +1,245 @@
+import pytest
+
+from src.storage import BACKENDS, StorageBackend, create_storage
+from src.inventory import sku_key
+
+# Варианты JSON хранилища: переменные окружения поверх json://
+JSON_VARIANTS = {
+    "json-sharded": {"STORAGE_USERS_LAYOUT": "sharded"},
+    "json-write-behind": {"STORAGE_WRITE_BEHIND": "1"},
+    "json-stock-counters": {"STORAGE_STOCK_COUNTERS": "1"},
+}
+
+TARGETS = [pytest.param((scheme, {}), id=scheme) for scheme in sorted(BACKENDS)] + [
+    pytest.param(("json", env), id=name) for name, env in JSON_VARIANTS.items()
+]
+
+
+class _TgUser:
+    """Минимальный пользователь Telegram для get_or_create_user"""
+    
+    def __init__(self, user_id: int, username: str = ""):
+        self.id = user_id
+        self.username = username
+        self.first_name = f"user{user_id}"
+        self.last_name = ""
+
+
+@pytest.fixture(params=TARGETS)
+def target(request, tmp_path, monkeypatch):
+    """(схема, функция открытия хранилища) в пустой папке данных"""
+    scheme, env = request.param
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    opened = []
+    
+    def open_storage() -> StorageBackend:
+        storage = create_storage(f"{scheme}://", str(tmp_path))
+        opened.append(storage)
+        return storage
+    
+    yield scheme, open_storage
+    for storage in opened:
+        storage.close()
+
+
+@pytest.fixture
+def storage(target) -> StorageBackend:
+    return target[1]()
+
+
+def test_protocol(storage):
+    assert isinstance(storage, StorageBackend)
+
+
+def test_users(storage):
+    user = storage.get_or_create_user(_TgUser(101, "alice"))
+    assert user["username"] == "alice"
+    assert storage.get_or_create_user(_TgUser(101, "other"))["username"] == "alice"
+    assert storage.inc_total_orders(101) == 1
+    assert storage.inc_total_orders(999999) == 0
+    
+    assert storage.set("users.json", "102", {"username": "bob", "role": "promo", "is_active": True})
+    assert storage.get("users.json", "102")["role"] == "promo"
+    assert storage.get("users.json", "404") is None
+    assert "102" in storage.view("users.json")
+
+
+def test_batch(storage):
+    assert storage.set_many("users.json", {"201": {"username": "a"}, "202": {"username": "b"}})
+    assert storage.update_many({"users.json": {"201": {"role": "admin"}, "404": {"role": "admin"}}})
+    users = storage.get_many("users.json", ["201", "202", "404"])
+    assert users["201"] == {"username": "a", "role": "admin"}
+    assert users["202"]["username"] == "b"
+    assert users["404"] is None
+
+
+def test_chats(storage):
+    assert storage.add_chat({"chat_id": "-1001", "title": "Чат", "prefix": "AB", "active": True})
+    assert storage.get_chat(-1001)["title"] == "Чат"
+    assert storage.update_chat("-1001", {"title": "Новый"})
+    assert storage.get_chat("-1001")["title"] == "Новый"
+    assert not storage.update_chat("-404", {"title": "x"})
+    assert storage.find_chat_by_prefix("AB")["chat_id"] == "-1001"
+    assert storage.find_chat_by_prefix("AB", exclude_chat_id="-1001") is None
+    assert "AB" in storage.used_prefixes()
+    assert any(chat["chat_id"] == "-1001" for chat in storage.list_active_chats())
+    assert storage.get_many("chats.json", ["-1001"])["-1001"]["title"] == "Новый"
+    assert storage.delete_chat("-1001")
+    assert storage.get_chat("-1001") is None
+
+
+def test_documents(storage):
+    with storage.edit("settings.json") as settings:
+        settings["limits"] = {"per_user": 2}
+    view = storage.view("settings.json")
+    assert view["limits"]["per_user"] == 2
+    with pytest.raises(TypeError):
+        view["limits"]["per_user"] = 3
+    
+    copy = storage.get_all("settings.json")
+    copy["limits"]["per_user"] = 100
+    assert storage.view("settings.json")["limits"]["per_user"] == 2
+    
+    with pytest.raises(RuntimeError):
+        with storage.edit("settings.json") as settings:
+            settings["limits"]["per_user"] = 50
+            raise RuntimeError("откат")
+    assert storage.view("settings.json")["limits"]["per_user"] == 2
+
+
+def test_reserve(storage):
+    assert storage.set_stock("hoodie", "black", "XL", 2)
+    assert "XL" in storage.list_sizes()
+    assert "black" in storage.list_colors("XL")
+    assert storage.reserve("XL", "black", 2)
+    assert not storage.reserve("XL", "black", 1)
+    assert storage.release("XL", "black", 1)
+    assert storage.reserve("XL", "black", 1)
+    assert not storage.release("XL", "black", 5)
+    assert storage.available("XL", "black") == 0
+    
+    # Один размер и цвет у нескольких видов: резерв берет первый SKU с остатком
+    assert storage.adjust_stock("tshirt", "black", "XL", delta_total=3)
+    assert storage.available("XL") == 3 and storage.available(color="black") == 3
+    assert storage.reserve("XL", "black", 2)
+    assert storage.get_stock("tshirt", "black", "XL")["qty_available"] == 1
+    assert not storage.adjust_stock("tshirt", "black", "XL", delta_total=-2)
+    assert not storage.adjust_stock("tshirt", "black", "XXS", delta_reserved=1)
+    assert storage.release("XL", "black", 2)
+
+
+def test_availability(storage):
+    assert storage.set_stock("hoodie", "black", "XL", 2)
+    assert storage.reserve("XL", "black", 2)
+    # Матрица доступности кешируется до изменения остатков
+    matrix = storage.availability()
+    assert storage.availability() is matrix
+    assert matrix.available("XL", "black") == 0 and matrix.totals["XL"] == storage.available("XL")
+    assert list(matrix.sizes) == storage.list_sizes()
+    assert storage.adjust_stock("tshirt", "black", "XL", delta_total=3)
+    assert matrix.available("XL", "black") == 0
+    assert storage.availability().available("XL", "black") == storage.available("XL", "black") == 3
+
+
+def test_try_reserve(storage):
+    assert storage.set_stock("tshirt", "black", "XL", 3)
+    key = sku_key("tshirt", "black", "XL")
+    assert storage.try_reserve(key, 3) and not storage.try_reserve(key, 1)
+    assert storage.get_stock("tshirt", "black", "XL")["qty_reserved"] == 3
+    assert storage.try_release(key, 3) and not storage.try_release(key, 1)
+    assert not storage.try_reserve(sku_key("tshirt", "black", "XXXL"), 1)
+
+
+def test_stock_dimensions(storage):
+    assert storage.set_stock("cap", "white", "XS", 4)
+    assert storage.rename_stock("color", "white", "ivory") >= 1
+    assert storage.get_stock("cap", "ivory", "XS")["qty_total"] == 4
+    assert storage.remove_stock(product_type="cap") == 1
+    assert storage.get_stock("cap", "ivory", "XS") is None
+    assert storage.add_size("XXS") and not storage.add_size("XXS")
+    assert storage.remove_size("XXS") and "XXS" not in storage.list_sizes()
+
+
+def test_products(storage):
+    assert storage.set_stock("tshirt", "black", "XL", 3)
+    assert storage.add_product("tshirt_black", "Футболка", "tshirt", "black", {"XL": 1, "M": 2})
+    product = storage.get_product("tshirt_black")
+    assert product["sizes"]["XL"]["qty_total"] == 4 and product["sizes"]["M"]["qty_total"] == 2
+    assert storage.update_product_quantity("tshirt_black", "M", 5)
+    assert storage.available("M", "black") == 5
+    assert storage.get_inventory_summary()["total_items"] == sum(item["qty_total"] for item in storage.list_stock())
+
+
+def test_import_stock(storage):
+    assert storage.set_stock("hoodie", "black", "XL", 2)
+    assert storage.reserve("XL", "black", 2)
+    assert storage.set_stock("tshirt", "black", "M", 5)
+    
+    # Загрузка таблицы остатков одной записью
+    rows = [("hoodie", "black", "XL", 5), ("cap", "red", "S", 2), ("tshirt", "black", "M", 5)]
+    assert len(storage.import_stock(rows, dry_run=True)) == 2 and storage.get_stock("cap", "red", "S") is None
+    changes = storage.import_stock(rows)
+    assert {(c["type"], c["before"], c["after"]) for c in changes} == {("hoodie", 2, 5), ("cap", None, 2)}
+    assert storage.get_stock("hoodie", "black", "XL")["qty_reserved"] == 2
+    assert storage.import_stock([("cap", "red", "S", -5)], add=True)[0]["after"] == 0
+
+
+def _create_orders(storage):
+    first = storage.create_order({"user_tg_id": 101, "size": "XL", "color": "black", "photo_file_id": "p1"})
+    second = storage.create_order({"user_tg_id": 102, "size": "XL", "photo_file_id": "p2"})
+    assert storage.append_delivery(first, "-2002", "AB", 7)
+    assert storage.set_order_status(second, "done")
+    return first, second
+
+
+def test_orders(storage):
+    first, second = _create_orders(storage)
+    assert second > first
+    assert storage.next_order_id() > second
+    assert not storage.set_order_status(10 ** 9, "done")
+    
+    assert storage.get_order(first)["status"] == "sent"
+    assert storage.get_order(first)["deliveries"][0]["chat_id"] == "-2002"
+    assert [order["id"] for order in storage.orders_by_user(101)] == [first]
+    assert [order["id"] for order in storage.orders_by_status("done")] == [second]
+    assert [order["id"] for order in storage.orders_by_chat("-2002")] == [first]
+    assert len(storage.orders_between("2000-01-01", "2100-01-01")) == 2
+    counts = storage.order_status_counts()
+    assert counts.get("sent") == 1 and counts.get("done") == 1
+
+
+def test_snapshot(storage):
+    _create_orders(storage)
+    before = storage.snapshot()
+    storage.set("users.json", "301", {"username": "snap"})
+    after = storage.snapshot()
+    assert after.version > before.version
+    assert "301" in after.users and "301" not in before.users
+    assert len(after.orders) == 2
+    with pytest.raises(TypeError):
+        after.users["301"]["username"] = "x"
+
+
+def test_stats(storage):
+    storage.get("users.json", "1")
+    assert storage.stats()["files"], "stats() не считает обращения"
+    assert storage.flush()
+
+
+def test_reopen(target):
+    """Данные сохраняются после закрытия и повторного открытия"""
+    scheme, open_storage = target
+    if scheme == "memory":
+        pytest.skip("memory:// ничего не сохраняет")
+    storage = open_storage()
+    assert storage.set("users.json", "102", {"username": "bob"})
+    first, _ = _create_orders(storage)
+    assert storage.set_stock("hoodie", "black", "XL", 5)
+    assert storage.try_reserve(sku_key("hoodie", "black", "XL"), 2)
+    storage.close()
+    
+    storage = open_storage()
+    assert storage.get("users.json", "102")["username"] == "bob"
+    assert storage.get_order(first)["status"] == "sent"
+    assert storage.get_stock("hoodie", "black", "XL")["qty_reserved"] == 2